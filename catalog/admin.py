@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Category, Brand, Product, ProductImage, Features, FeatureValue, Review, Tag
+from .models import Category, Brand, Product, ProductImage, Features, FeatureValue, Review, Tag, Banner
 
 
 @admin.register(Category)
@@ -35,7 +35,8 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ('title', 'description')
     list_filter = ('category', 'brand', 'is_limited')
     prepopulated_fields = {'slug': ('title',)}
-    readonly_fields = ('purchases_count', 'created_at')
+    readonly_fields = ('purchases_count', 'created_at',
+                       'rating', 'reviews_count', 'rating_sum', 'reserved_count')
     ordering = ('-created_at',)
     inlines = [PhotoInline]
 
@@ -66,4 +67,12 @@ class ReviewAdmin(admin.ModelAdmin):
 class TagAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'slug')
     search_fields = ('name', 'slug')
-    prepopulated_fields = {'slug': ('name',)}
\ No newline at end of file
+    prepopulated_fields = {'slug': ('name',)}
+
+
+@admin.register(Banner)
+class BannerAdmin(admin.ModelAdmin):
+    list_display = ('category', 'title', 'sort_index', 'is_active')
+    list_filter = ('is_active',)
+    list_editable = ('sort_index', 'is_active')
+    autocomplete_fields = ('category',)
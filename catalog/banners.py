@@ -0,0 +1,92 @@
+# catalog/banners.py
+"""
+Баннеры главной страницы.
+
+Определения берутся из модели Banner. Пока в таблице нет ни одной строки
+(свежая установка, категории заведены после migrate), показываются первые
+DEFAULT_COUNT активных корневых категорий со статичными картинками — как
+раньше в BannersView. Минимальная цена — одним сгруппированным запросом
+по поддеревьям всех баннерных категорий.
+Готовый ответ хранится в памяти процесса и сбрасывается при изменении
+товаров, категорий или баннеров (catalog/signals.py).
+"""
+from django.db.models import Min
+from django.templatetags.static import static
+
+from megano import responsecache
+from . import categories
+from .cache import LocalSnapshot
+from .models import Banner, Product
+
+DEFAULT_COUNT = 3
+DEFAULT_IMAGES = [
+    "frontend/assets/img/content/home/slider.png",
+    "frontend/assets/img/content/home/bigGoods.png",
+    "frontend/assets/img/content/home/videoca.png",
+]
+
+
+def _default_banners(tree):
+    """Баннеры без настроек: первые корневые категории, картинки по кругу."""
+    roots = [node for node in tree.roots if node.parent_id is None and node.is_active][:DEFAULT_COUNT]
+    return [
+        Banner(category_id=node.id, static_image=DEFAULT_IMAGES[i % len(DEFAULT_IMAGES)])
+        for i, node in enumerate(roots)
+    ]
+
+
+def build_banners():
+    tree = categories.get_tree()
+    if Banner.objects.exists():
+        banners = [
+            b for b in Banner.objects.filter(is_active=True).order_by("sort_index", "id")
+            if tree.is_active(b.category_id)
+        ]
+    else:
+        banners = _default_banners(tree)
+    if not banners:
+        return []
+
+    subtrees = {b.category_id: tree.subtree_ids(b.category_id) for b in banners}
+    category_ids = {pk for ids in subtrees.values() for pk in ids}
+    min_prices = dict(
+        Product.objects
+        .filter(category_id__in=category_ids)
+        .values("category_id")
+        .annotate(min_price=Min("price"))
+        .values_list("category_id", "min_price")
+    )
+
+    out = []
+    for banner in banners:
+        node = tree.nodes[banner.category_id]
+        prices = [min_prices[pk] for pk in subtrees[banner.category_id] if pk in min_prices]
+        if banner.image:
+            src = banner.image.url
+        elif banner.static_image:
+            src = static(banner.static_image)
+        else:
+            src = node.icon_url
+        title = banner.title or node.name
+        out.append({
+            "id": node.id,
+            "title": title,
+            "price": min(prices) if prices else 0,
+            "images": [{"src": src, "alt": title}],
+            "link": f"/catalog?category={node.id}",
+            "category": node.id,
+            "category_slug": node.slug or "",
+        })
+    return out
+
+
+_snapshot = LocalSnapshot("banners", build_banners)
+
+
+def get_banners():
+    return _snapshot.get()
+
+
+def invalidate():
+    _snapshot.invalidate()
+    responsecache.invalidate("banners")
@@ -0,0 +1,114 @@
+# catalog/cache.py
+"""
+In-process снимки справочных данных каталога.
+
+Значение строится один раз и дальше отдаётся из памяти процесса. Версия
+хранится в общем кеше (алиас ``shared`` в settings.CACHES — база данных
+или Redis, один на все процессы): invalidate() увеличивает её, и каждый
+процесс (gunicorn-воркер, runworker) перестраивает свой снимок, как только
+заметит новую версию. Чтобы не ходить в общий кеш на каждый get(), версия
+перечитывается не чаще раза в CHECK_INTERVAL секунд — на столько другие
+процессы могут отстать.
+"""
+import threading
+import time
+
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+# кеш, общий для всех процессов: версии, кеш ответов (megano/responsecache.py)
+shared_cache = ConnectionProxy(caches, "shared")
+
+CHECK_INTERVAL = 1.0  # сек. между проверками общей версии снимка
+
+
+class SharedVersion:
+    """Счётчик версии в общем кеше, один для всех процессов."""
+
+    def __init__(self, name):
+        self.key = f"catalog:version:{name}"
+
+    def get(self):
+        version = shared_cache.get(self.key)
+        if version is None:
+            # стартуем не с 1, чтобы после рестарта кеша версии не повторялись
+            shared_cache.add(self.key, time.time_ns(), None)
+            version = shared_cache.get(self.key)
+        return version
+
+    def bump(self):
+        try:
+            return shared_cache.incr(self.key)
+        except ValueError:
+            version = time.time_ns()
+            shared_cache.set(self.key, version, None)
+            return version
+
+
+class LocalSnapshot:
+    instances = []
+
+    def __init__(self, name, builder, ttl=None, check_interval=CHECK_INTERVAL):
+        self.name = name
+        self.builder = builder
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.version = SharedVersion(f"snapshot:{name}")
+        self._lock = threading.RLock()
+        self._value = None
+        self._version = None
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        LocalSnapshot.instances.append(self)
+
+    def current_version(self):
+        return self.version.get()
+
+    def _bump(self):
+        return self.version.bump()
+
+    def _is_fresh(self, version):
+        if self._version is None or self._version != version:
+            return False
+        return self.ttl is None or time.monotonic() - self._built_at < self.ttl
+
+    def _recently_checked(self, now):
+        if self._version is None or now - self._checked_at >= self.check_interval:
+            return False
+        return self.ttl is None or now - self._built_at < self.ttl
+
+    def get(self):
+        now = time.monotonic()
+        if self._recently_checked(now):
+            return self._value
+        version = self.current_version()
+        self._checked_at = now
+        if not self._is_fresh(version):
+            with self._lock:
+                if not self._is_fresh(version):
+                    self._value = self.builder()
+                    self._version = version
+                    self._built_at = time.monotonic()
+        return self._value
+
+    def forget(self):
+        """Забыть локальную копию: следующий get() перестроит её только в этом процессе."""
+        with self._lock:
+            self._value = None
+            self._version = None
+
+    def peek(self):
+        """Текущее локальное значение без проверки версии (None, если не строилось)."""
+        return self._value
+
+    def invalidate(self):
+        """Сбросить снимок во всех процессах."""
+        with self._lock:
+            self._bump()
+            self._version = None
+
+
+def forget_snapshots():
+    """Все снимки процесса перестроятся при следующем get()."""
+    for snapshot in LocalSnapshot.instances:
+        snapshot.forget()
@@ -0,0 +1,141 @@
+# catalog/cards.py
+"""
+Кеш карточек товаров (ProductShort) по id.
+
+Каталог, популярные/лимитированные, главная и корзина показывают одну и
+ту же короткую карточку. Карточки лежат в кеше процесса (Django cache
+``default``) под ключом с версией товара: get_cards() читает версии одним
+get_many из общего кеша версий (алиас ``card_versions``), карточки — одним
+get_many из своего, недостающие строит одним батчем (product_short_by_ids —
+три запроса на все промахи) и докладывает set_many. Спискам остаётся
+получить упорядоченные id и склеить карточки.
+
+Версий по одной на товар, поэтому у них свой алиас и срок жизни
+(VERSION_TTL): вытеснение при MAX_ENTRIES задевает только их, а не версии
+каталога и теги кеша ответов в ``shared``. Потерянная версия заводится
+заново текущим временем — карточки просто строятся ещё раз.
+
+invalidate() только двигает версии товаров в кеше версий — старые карточки
+перестают читаться во всех процессах сразу. Версия читается до выборки из
+БД, поэтому карточка, построенная до изменения и записанная после сброса,
+ложится под старую версию и никому не попадётся. Версия — метка времени,
+а не счётчик: если общий кеш её потеряет, новая не совпадёт ни с одной
+прежней.
+
+В кеше URL картинок относительные (/media/...) — карточка не зависит от
+хоста; абсолютными их делает get_cards() для конкретного запроса, с
+префиксом хоста, посчитанным один раз.
+
+Сбрасываются сигналами (catalog/signals.py): товар, его картинки, теги
+(и переименование тега), отзывы (рейтинг), а остаток — после checkout.
+Всё разом — invalidate_all() через общую версию.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.utils.connection import ConnectionProxy
+
+from .cache import SharedVersion
+from .serializers import product_short_by_ids
+
+DEFAULTS = {
+    "TTL": 300,  # сек., страховка на случай изменений мимо сигналов (queryset.update)
+    "VERSION_TTL": 3600,  # сек., версии давно не читавшихся товаров уходят сами
+}
+
+version = SharedVersion("cards")
+
+# версии карточек, общие для всех процессов
+version_cache = ConnectionProxy(caches, "card_versions")
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CATALOG_CARDS", {})}
+
+
+def _version_key(product_id):
+    return f"catalog:card-version:{product_id}"
+
+
+def _key(current, product_id, product_version):
+    return f"catalog:card:{current}:{product_id}:{product_version}"
+
+
+def product_versions(ids):
+    """
+    {id: версия карточки} из кеша версий; недостающие заводятся текущим
+    временем одним set_many. Перезаписать так версию, сдвинутую invalidate()
+    другого процесса, безопасно: сдвиг делается после коммита, а карточка
+    строится уже после записи версии — из изменённых данных.
+    """
+    keys = {pk: _version_key(pk) for pk in ids}
+    found = version_cache.get_many(keys.values())
+    missing = [key for key in keys.values() if key not in found]
+    if missing:
+        missing = dict.fromkeys(missing, time.time_ns())
+        version_cache.set_many(missing, get_config()["VERSION_TTL"])
+        found.update(missing)
+    return {pk: found[key] for pk, key in keys.items()}
+
+
+# --------- чтение ---------
+class _Absolutizer:
+    """Относительный URL картинки -> абсолютный, как build_absolute_uri."""
+
+    def __init__(self, request):
+        self.request = request
+        self.host = request.build_absolute_uri("/")[:-1]
+
+    def __call__(self, src):
+        if not src or not src.startswith("/"):
+            return src
+        if src.startswith("//") or "/./" in src or "/../" in src:
+            return self.request.build_absolute_uri(src)
+        return self.host + src
+
+
+def _for_request(card, absolutize):
+    return {
+        **card,
+        "images": [{"src": absolutize(img["src"]), "alt": img["alt"]} for img in card["images"]],
+    }
+
+
+def get_cards(ids, request=None):
+    """
+    Карточки ProductShort по списку id в том же порядке (удалённые товары
+    пропускаются). С request URL картинок абсолютные — как у сериализатора.
+    """
+    ids = list(ids)
+    if not ids:
+        return []
+    current = version.get()
+    keys = {pk: _key(current, pk, v) for pk, v in product_versions(dict.fromkeys(ids)).items()}
+    found = cache.get_many(keys.values())
+    cards = {pk: found[key] for pk, key in keys.items() if key in found}
+
+    missing = [pk for pk in dict.fromkeys(ids) if pk not in cards]
+    if missing:
+        built = {card["id"]: card for card in product_short_by_ids(missing)}
+        cache.set_many({keys[pk]: card for pk, card in built.items()}, get_config()["TTL"])
+        cards.update(built)
+
+    ordered = [cards[pk] for pk in ids if pk in cards]
+    if request is None:
+        return ordered
+    absolutize = _Absolutizer(request)
+    return [_for_request(card, absolutize) for card in ordered]
+
+
+# --------- сброс ---------
+def invalidate(product_ids):
+    """Сбросить карточки товаров во всех процессах: сдвинуть их версии."""
+    product_ids = set(product_ids)
+    if product_ids:
+        now = time.time_ns()
+        version_cache.set_many({_version_key(pk): now for pk in product_ids}, get_config()["VERSION_TTL"])
+
+
+def invalidate_all():
+    version.bump()
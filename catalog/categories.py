@@ -0,0 +1,134 @@
+# catalog/categories.py
+"""
+Дерево категорий в памяти процесса.
+
+Строится одним запросом: предки/потомки, «эффективная» активность (сама
+категория и все её предки активны) и URL иконок считаются заранее.
+Перестраивается при изменении Category (catalog/signals.py) во всех
+процессах: версия снимка лежит в общем кеше (catalog/cache.py).
+"""
+from megano import responsecache
+from .cache import LocalSnapshot
+from .models import Category
+
+
+class CategoryNode:
+    __slots__ = ("id", "name", "slug", "is_active", "parent_id", "icon_url", "children")
+
+    def __init__(self, id, name, slug, is_active, parent_id, icon_url):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.is_active = is_active
+        self.parent_id = parent_id
+        self.icon_url = icon_url
+        self.children = []
+
+
+class CategoryTree:
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.roots = sorted(
+            (n for n in nodes.values() if n.parent_id is None or n.parent_id not in nodes),
+            key=lambda n: n.id,
+        )
+        for node in sorted(nodes.values(), key=lambda n: n.id):
+            parent = nodes.get(node.parent_id)
+            if parent is not None:
+                parent.children.append(node)
+
+        self._ancestors = {}
+        self._subtree = {}
+        self._active = {}
+        for root in self.roots:
+            self._walk(root, (), True, set())
+        # обратное к subtree_ids: в поддеревья каких категорий входит данная
+        self._containers = {}
+        for pk, subtree in self._subtree.items():
+            for member in subtree[1:]:
+                self._containers.setdefault(member, []).append(pk)
+
+    def _walk(self, node, ancestors, parent_active, seen):
+        if node.id in seen:  # защита от циклов в parent
+            return ()
+        seen.add(node.id)
+        active = parent_active and node.is_active
+        self._active[node.id] = active
+        self._ancestors[node.id] = ancestors
+        subtree = [node.id]
+        for child in node.children:
+            child_ids = self._walk(child, (node.id,) + ancestors, active, seen)
+            if child.is_active:
+                subtree.extend(child_ids)
+        self._subtree[node.id] = tuple(subtree)
+        return self._subtree[node.id]
+
+    @classmethod
+    def build(cls):
+        storage = Category._meta.get_field("icon").storage
+        rows = Category.objects.values_list("id", "name", "slug", "is_active", "parent_id", "icon")
+        return cls({
+            pk: CategoryNode(pk, name, slug, is_active, parent_id, storage.url(icon) if icon else None)
+            for pk, name, slug, is_active, parent_id, icon in rows
+        })
+
+    def is_active(self, category_id):
+        return self._active.get(category_id, False)
+
+    def ancestor_ids(self, category_id):
+        """Предки от ближайшего к корню (без самой категории)."""
+        return self._ancestors.get(category_id, ())
+
+    def container_ids(self, category_id):
+        """Категории, чьё subtree_ids() включает данную (кроме неё самой)."""
+        return tuple(self._containers.get(category_id, ()))
+
+    def subtree_ids(self, category_id):
+        """Сама категория и все её активные потомки."""
+        return self._subtree.get(category_id, (category_id,))
+
+    def active_ids(self):
+        return [pk for pk, active in self._active.items() if active]
+
+    # --------- формат /api/categories ---------
+    @staticmethod
+    def _image(node, request):
+        url = node.icon_url
+        if url and request is not None:
+            url = request.build_absolute_uri(url)
+        return {"src": url, "alt": node.name or ""}
+
+    def as_payload(self, request=None):
+        return [
+            {
+                "id": root.id,
+                "name": root.name,
+                "slug": root.slug,
+                "is_active": root.is_active,
+                "parent": root.parent_id,
+                "image": self._image(root, request),
+                "subcategories": [
+                    {
+                        "id": child.id,
+                        "name": child.name,
+                        "slug": child.slug,
+                        "image": self._image(child, request),
+                    }
+                    for child in root.children if child.is_active
+                ],
+            }
+            for root in self.roots if root.is_active and root.parent_id is None
+        ]
+
+
+_snapshot = LocalSnapshot("category-tree", CategoryTree.build)
+
+
+def get_tree():
+    return _snapshot.get()
+
+
+def invalidate():
+    _snapshot.invalidate()
+    # /api/categories и списки каталога по поддеревьям
+    responsecache.invalidate("categories")
@@ -0,0 +1,179 @@
+# catalog/conditional.py
+"""
+Условные GET (ETag / Last-Modified / 304) для каталога и карточки товара.
+
+Валидаторы считаются без основного запроса:
+
+* карточка товара (/api/product/<id>) — по Product.updated_at, одна выборка
+  по первичному ключу. updated_at обновляет auto_now при save() товара и
+  touch_products() при изменении связанного: картинок, характеристик,
+  отзывов (рейтинг), тегов, остатка после checkout;
+* список (/api/catalog) — по версиям каталога в общем кеше (алиас
+  ``shared``, один на все процессы): общей и по категориям. Версия — метка времени в наносекундах последнего изменения
+  товаров категории, поэтому из неё же получается Last-Modified. Для
+  списка с ?category= берутся версии всех категорий поддерева (один
+  get_many), без категории — общая версия.
+
+Версии поднимаются после коммита (products_changed): товар сохранён,
+удалён, перенесён в другую категорию, изменились связанные данные, остаток
+или резерв (фильтр «в наличии»), поисковый индекс. Поднять их может любой
+процесс — веб-воркер или runworker (catalog/tasks.py), — остальные видят
+новую версию при следующем запросе.
+
+Last-Modified — секунда, округлённая вверх: ответ с ним не старше ни одного
+изменения до этой секунды включительно. Пока она не прошла, в неё может
+попасть ещё одно изменение с тем же Last-Modified — такой ответ уходит
+только с ETag, и If-Modified-Since для него не проверяется.
+
+Те же события сбрасывают записи кеша ответов (megano/responsecache.py) с
+тегами catalog, category:<id> и product:<id>.
+
+В ETag входят также нормализованные параметры запроса, хост (абсолютные URL картинок) и
+согласованный формат ответа (JSON/MessagePack), поэтому ответы отдаются
+с Vary: Accept и Cache-Control: no-cache — кешировать можно, но каждый раз
+с проверкой.
+"""
+import hashlib
+import math
+import time
+
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from megano import responsecache
+from .cache import shared_cache
+from .models import Category, Product
+
+ALL = "all"
+
+
+def _key(scope):
+    return f"catalog:lastmod:{scope}"
+
+
+# --------- версии каталога ---------
+def get_versions(scopes):
+    """{scope: метка времени, нс} — ALL или id категорий; недостающие заводятся текущим временем."""
+    keys = {scope: _key(scope) for scope in scopes}
+    found = shared_cache.get_many(keys.values())
+    missing = [key for key in keys.values() if key not in found]
+    if missing:
+        now = time.time_ns()
+        for key in missing:
+            shared_cache.add(key, now, None)
+        # другой процесс мог успеть раньше — берём то, что легло в кеш
+        found.update(shared_cache.get_many(missing))
+        for key in missing:
+            found.setdefault(key, now)
+    return {scope: found[key] for scope, key in keys.items()}
+
+
+def bump(category_ids, product_ids=()):
+    """Списки этих категорий (и общий) и карточки этих товаров изменились."""
+    now = time.time_ns()
+    category_ids = set(category_ids)
+    scopes = [ALL, *category_ids]
+    shared_cache.set_many({_key(scope): now for scope in scopes}, None)
+    responsecache.invalidate(
+        "catalog",
+        *[f"category:{pk}" for pk in category_ids],
+        *[f"product:{pk}" for pk in set(product_ids)],
+    )
+
+
+def products_changed(product_ids=(), category_ids=()):
+    """
+    После коммита поднять версии категорий этих товаров (и явно переданных
+    category_ids — например, старой категории перенесённого или удалённого товара).
+    """
+    product_ids, category_ids = list(product_ids), set(category_ids)
+
+    def _bump():
+        if product_ids:
+            category_ids.update(
+                Product.objects.filter(pk__in=product_ids).values_list("category_id", flat=True)
+            )
+        bump(category_ids, product_ids)
+
+    transaction.on_commit(_bump)
+
+
+def touch_products(product_ids):
+    """Связанные данные товаров изменились: updated_at = сейчас, версии — после коммита."""
+    product_ids = list(product_ids)
+    if product_ids:
+        Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+        products_changed(product_ids)
+
+
+def invalidate_all():
+    """Все товары разом (массовые UPDATE мимо сигналов)."""
+    Product.objects.update(updated_at=timezone.now())
+    bump(Category.objects.values_list("id", flat=True), Product.objects.values_list("id", flat=True))
+
+
+# --------- валидаторы ---------
+def _etag(*parts):
+    return '"' + hashlib.md5("|".join(map(str, parts)).encode()).hexdigest() + '"'
+
+
+def _representation(request):
+    # тело зависит от формата ответа и хоста (абсолютные URL картинок)
+    return f"{request.accepted_media_type}|{request.scheme}://{request.get_host()}"
+
+
+def _last_modified(seconds):
+    """Last-Modified (секунды, округлённые вверх) или None, если эта секунда ещё идёт."""
+    return seconds if seconds <= time.time() else None
+
+
+def product_validators(request, product_id):
+    """(etag, last_modified) карточки товара или None, если товара нет."""
+    updated_at = Product.objects.filter(pk=product_id).values_list("updated_at", flat=True).first()
+    if updated_at is None:
+        return None
+    last_modified = _last_modified(math.ceil(updated_at.timestamp()))
+    return _etag("product", product_id, updated_at.isoformat(), _representation(request)), last_modified
+
+
+def catalog_validators(request, subtree=None):
+    """(etag, last_modified) страницы каталога; subtree — id категорий фильтра или None."""
+    # несуществующая категория (пустое поддерево) — по общей версии
+    versions = get_versions(sorted(subtree) if subtree else [ALL])
+    # id поддерева тоже в ETag: дерево категорий могло поменяться
+    query = responsecache.normalize_query(request.query_params)
+    last_modified = _last_modified(-(-max(versions.values()) // 10 ** 9))
+    return _etag("catalog", query, sorted(versions.items()), _representation(request)), last_modified
+
+
+def applies(request):
+    """Только GET/HEAD и не browsable API (в её HTML есть пользователь и CSRF-токен)."""
+    return request.method in ("GET", "HEAD") and request.accepted_renderer.format != "api"
+
+
+def not_modified(request, etag, last_modified):
+    """
+    304 (или 412 на If-Match), если ответ определяется заголовками запроса,
+    иначе None — тогда строится обычный ответ.
+    """
+    headers = _with_validators(HttpResponse(), etag, last_modified)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified, response=headers)
+    return None if response is headers else response
+
+
+def _with_validators(response, etag, last_modified):
+    response.headers["ETag"] = etag
+    if last_modified is not None:
+        response.headers["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    if 200 <= response.status_code < 300:
+        _with_validators(response, etag, last_modified)
+    return response
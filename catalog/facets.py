@@ -0,0 +1,254 @@
+# catalog/facets.py
+"""
+Фасеты для /api/products/filters: бренды, мин/макс цены, гистограмма цен,
+счётчики freeDelivery/available и тегов — отдельно для каждой категории
+и для всего каталога. Категория включает товары всех своих подкатегорий.
+
+Индекс строится из БД один раз (два запроса), хранится в памяти процесса
+и обновляется инкрементально сигналами Product/тегов (catalog/signals.py).
+
+Изменённые товары публикуются в общем кеше: каждое изменение — номер в
+общем счётчике и запись со списком id. Остальные процессы раз в
+CHECK_INTERVAL секунд сверяют счётчик и перечитывают только эти товары
+(те же два запроса, но по списку id). Полная перестройка — при
+invalidate() (поменялось дерево категорий, бренд или тег), по TTL и
+если журнал не догнать: пропущено больше MAX_REPLAY изменений или
+записи уже вытеснены.
+"""
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+
+from . import categories
+from .cache import CHECK_INTERVAL, LocalSnapshot, shared_cache
+from .models import Product
+
+ALL = None  # ключ «весь каталог»
+
+SEQ_KEY = "catalog:facets:seq"
+MAX_REPLAY = 200  # изменений, которые процесс догоняет по журналу, а не перестройкой
+
+
+def _histogram(prices, bins):
+    if not prices:
+        return []
+    low, high = min(prices), max(prices)
+    if low == high:
+        return [{"from": low, "to": high, "count": sum(prices.values())}]
+    step = (high - low) / bins
+    counts = [0] * bins
+    for price, qty in prices.items():
+        idx = min(int((price - low) / step), bins - 1)
+        counts[idx] += qty
+    cent = Decimal("0.01")
+    return [
+        {
+            "from": (low + step * i).quantize(cent),
+            "to": (low + step * (i + 1)).quantize(cent) if i < bins - 1 else high,
+            "count": counts[i],
+        }
+        for i in range(bins)
+    ]
+
+
+class FacetBucket:
+    """Агрегаты по одному набору товаров (категория или весь каталог)."""
+
+    def __init__(self):
+        self.total = 0
+        self.brands = Counter()
+        self.prices = Counter()
+        self.tags = Counter()
+        self.free_delivery = 0
+        self.available = 0
+        self._payload = None
+
+    def apply(self, snap, sign):
+        _category, brand, price, free_delivery, available, tags = snap
+        self.total += sign
+        self.brands[brand] += sign
+        self.prices[price] += sign
+        self.free_delivery += sign * free_delivery
+        self.available += sign * available
+        for tag in tags:
+            self.tags[tag] += sign
+        if sign < 0:
+            for counter in (self.brands, self.prices, self.tags):
+                for key in [k for k, v in counter.items() if v <= 0]:
+                    del counter[key]
+        self._payload = None
+
+    def as_dict(self, bins):
+        if self._payload is None:
+            self._payload = {
+                "brands": [
+                    {"name": name, "products_count": cnt}
+                    for name, cnt in sorted(self.brands.items())
+                ],
+                "min_price": min(self.prices) if self.prices else 0,
+                "max_price": max(self.prices) if self.prices else 0,
+                "price_histogram": _histogram(self.prices, bins),
+                "free_delivery_count": self.free_delivery,
+                "available_count": self.available,
+                "tags": [
+                    {"name": name, "products_count": cnt}
+                    for name, cnt in sorted(self.tags.items())
+                ],
+                "products_count": self.total,
+            }
+        return self._payload
+
+
+class FacetIndex:
+    def __init__(self, tree=None, seq=0):
+        self._lock = threading.Lock()
+        self._products = {}
+        self._buckets = {ALL: FacetBucket()}
+        self._tree = tree
+        # номер последнего изменения из журнала, которое уже учтено
+        self.seq = seq
+        self.checked_at = time.monotonic()
+
+    @staticmethod
+    def load_snapshots(product_ids=None):
+        """{id: (category_id, brand, price, free_delivery, available, tags)}"""
+        qs = Product.objects.all()
+        through = Product.tags.through.objects.all()
+        if product_ids is not None:
+            qs = qs.filter(pk__in=product_ids)
+            through = through.filter(product_id__in=product_ids)
+        tags = {}
+        for pid, name in through.values_list("product_id", "tag__name"):
+            tags.setdefault(pid, []).append(name)
+        rows = qs.values_list(
+            "id", "category_id", "brand__name", "price", "free_delivery", "count", "reserved_count"
+        )
+        return {
+            pid: (cat, brand or "", price, bool(free), count > reserved, tuple(tags.get(pid, ())))
+            for pid, cat, brand, price, free, count, reserved in rows
+        }
+
+    @classmethod
+    def build(cls):
+        # номер — до чтения товаров: изменения во время сборки применятся повторно
+        index = cls(categories.get_tree(), current_seq())
+        for pid, snap in cls.load_snapshots().items():
+            index._add(pid, snap)
+        return index
+
+    def _bucket_keys(self, snap):
+        # товар учитывается в своей категории и в тех предках, чей фильтр
+        # каталога (subtree_ids) его включает
+        category_id = snap[0]
+        containers = self._tree.container_ids(category_id) if self._tree else ()
+        return (ALL, category_id) + containers
+
+    def _add(self, pid, snap):
+        self._products[pid] = snap
+        for key in self._bucket_keys(snap):
+            self._buckets.setdefault(key, FacetBucket()).apply(snap, +1)
+
+    def _remove(self, pid):
+        snap = self._products.pop(pid, None)
+        if snap is not None:
+            for key in self._bucket_keys(snap):
+                self._buckets[key].apply(snap, -1)
+
+    def refresh_products(self, product_ids):
+        """Перечитать товары из БД и применить разницу (удалённые — вычесть)."""
+        snaps = self.load_snapshots(product_ids)
+        with self._lock:
+            for pid in product_ids:
+                self._remove(pid)
+                if pid in snaps:
+                    self._add(pid, snaps[pid])
+
+    def facets(self, category_id=ALL):
+        bins = getattr(settings, "CATALOG_FACETS_HISTOGRAM_BINS", 10)
+        with self._lock:
+            bucket = self._buckets.get(category_id) or FacetBucket()
+            return bucket.as_dict(bins)
+
+
+_snapshot = LocalSnapshot(
+    "facets", FacetIndex.build,
+    ttl=getattr(settings, "CATALOG_FACETS_TTL", 300),
+)
+
+
+# --------- журнал изменений в общем кеше ---------
+def _change_key(seq):
+    return f"catalog:facets:change:{seq}"
+
+
+def current_seq():
+    return shared_cache.get(SEQ_KEY) or 0
+
+
+def _publish(product_ids):
+    """Записать изменение в журнал; возвращает его номер."""
+    shared_cache.add(SEQ_KEY, 0, None)
+    try:
+        seq = shared_cache.incr(SEQ_KEY)
+    except ValueError:  # вытеснен между add() и incr()
+        seq = time.time_ns()
+        shared_cache.set(SEQ_KEY, seq, None)
+    # записи нужны, пока их не догнали все процессы; дольше TTL индекс не живёт
+    shared_cache.set(_change_key(seq), product_ids, _snapshot.ttl * 2)
+    return seq
+
+
+def _catch_up(index):
+    """
+    Применить изменения других процессов. False — журнал не догнать,
+    индекс надо перестроить.
+    """
+    now = time.monotonic()
+    if now - index.checked_at < CHECK_INTERVAL:
+        return True
+    index.checked_at = now
+    seq = current_seq()
+    if seq == index.seq:
+        return True
+    if seq < index.seq or seq - index.seq > MAX_REPLAY:
+        return False
+    keys = [_change_key(n) for n in range(index.seq + 1, seq + 1)]
+    changes = shared_cache.get_many(keys)
+    if len(changes) != len(keys):
+        return False
+    index.refresh_products(sorted({pid for ids in changes.values() for pid in ids}))
+    index.seq = max(index.seq, seq)
+    return True
+
+
+def get_facets(category_id=ALL):
+    index = _snapshot.get()
+    if not _catch_up(index):
+        # только у себя: остальные процессы догоняют журнал сами
+        _snapshot.forget()
+        index = _snapshot.get()
+    return index.facets(category_id)
+
+
+def refresh_products(product_ids):
+    """Товары изменились: у себя — сразу, остальным — через журнал."""
+    product_ids = list(product_ids)
+    seq = _publish(product_ids)
+    index = _snapshot.peek()
+    if index is not None:
+        index.refresh_products(product_ids)
+        if index.seq == seq - 1:
+            # пропусков нет — своё изменение не перечитывать
+            index.seq = seq
+
+
+def remove_products(product_ids):
+    # удалённых товаров в БД нет — refresh_products их вычитает
+    refresh_products(product_ids)
+
+
+def invalidate():
+    _snapshot.invalidate()
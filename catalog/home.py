@@ -0,0 +1,50 @@
+# catalog/home.py
+"""
+Данные главной страницы (/api/home).
+
+Любое изменение товаров, картинок, тегов, отзывов, категорий или баннеров,
+пересчёт рейтингов (catalog/rankings.py) и остатки после checkout
+поднимают версию — старые записи кеша просто перестают читаться.
+
+ETag считается по самому ответу: хеш данных, посчитанный один раз при
+сборке, плюс формат ответа. Поэтому он меняется вместе с телом, даже если
+какое-то изменение прошло мимо версии.
+"""
+import hashlib
+import json
+
+from django.utils.http import parse_etags
+
+from .cache import SharedVersion
+
+version = SharedVersion("home")
+
+
+def invalidate():
+    version.bump()
+
+
+def cache_key(request):
+    # в карточках абсолютные URL картинок — ключ зависит от хоста
+    raw = f"{version.get()}:{request.scheme}:{request.get_host()}"
+    return "catalog:home:" + hashlib.md5(raw.encode()).hexdigest()
+
+
+def digest(data):
+    """Хеш данных ответа — сохраняется в кеше вместе с ними."""
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def etag(request, data_digest):
+    raw = f"{data_digest}:{request.accepted_media_type}"
+    return f'"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+
+def not_modified(request, current):
+    """Есть ли current среди ETag в If-None-Match (слабое сравнение, как в Django)."""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return "*" in etags or current in {tag.removeprefix("W/") for tag in etags}
@@ -0,0 +1,94 @@
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from catalog.models import Category, Product, ProductImage, Tag
+from catalog.serializers import PRODUCT_SHORT_VALUES, ProductShortSerializer, product_short_cards
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает сериализацию страницы каталога: ProductShortSerializer по "
+        "моделям с prefetch и быстрый путь из .values(). Создаёт временные товары "
+        "и удаляет их."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=200, help="страниц на каждый способ")
+        parser.add_argument("--page-size", type=int, default=20)
+        parser.add_argument("--images", type=int, default=3, help="картинок у товара")
+        parser.add_argument("--tags", type=int, default=3, help="тегов у товара")
+
+    def handle(self, *args, pages, page_size, images, tags, **options):
+        category, _ = Category.objects.get_or_create(slug="bench-short", defaults={"name": "Bench"})
+        tag_objs = [
+            Tag.objects.get_or_create(slug=f"bench-short-{i}", defaults={"name": f"Bench short {i}"})[0]
+            for i in range(tags)
+        ]
+        products = [
+            Product.objects.create(
+                category=category, title=f"Bench short {i}", slug=f"bench-short-{i}",
+                price=Decimal("123.45") + i, count=i, rating=Decimal("4.5"),
+            )
+            for i in range(page_size)
+        ]
+        ids = [p.pk for p in products]
+        ProductImage.objects.bulk_create([
+            ProductImage(product=p, src=f"catalog/product-images/bench-{p.pk}-{n}.png", alt=p.title)
+            for p in products for n in range(images)
+        ])
+        for p in products:
+            p.tags.set(tag_objs)
+        # абсолютные URL картинок строятся от хоста запроса — берём разрешённый
+        host = next((h for h in settings.ALLOWED_HOSTS if h != "*" and not h.startswith(".")), "localhost")
+        request = Request(APIRequestFactory().get("/api/catalog", HTTP_HOST=host))
+        base = Product.objects.filter(pk__in=ids).order_by("-created_at", "-id")
+
+        def serializer_page():
+            page = list(base.select_related("category", "brand").prefetch_related("images", "tags"))
+            return ProductShortSerializer(page, many=True, context={"request": request}).data
+
+        def values_page():
+            return product_short_cards(base.values(*PRODUCT_SHORT_VALUES), request)
+
+        def measure(build):
+            with CaptureQueriesContext(connection) as queries:
+                build()
+            build()  # прогрев
+            started_cpu, started = time.process_time(), time.perf_counter()
+            for _ in range(pages):
+                build()
+            return (
+                (time.process_time() - started_cpu) / pages * 1000,
+                (time.perf_counter() - started) / pages * 1000,
+                len(queries.captured_queries),
+            )
+
+        try:
+            render = JSONRenderer().render
+            if render(serializer_page()) != render(values_page()):
+                self.stdout.write(self.style.ERROR("Output differs from ProductShortSerializer"))
+                return
+            slow = measure(serializer_page)
+            fast = measure(values_page)
+            for label, (cpu, wall, queries) in (("serializer", slow), ("values()", fast)):
+                self.stdout.write(
+                    f"{label:>10}: {cpu:.2f} ms CPU, {wall:.2f} ms wall, {queries} queries "
+                    f"per page of {page_size}"
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f"Identical output; {slow[0] - fast[0]:.2f} ms CPU saved per page "
+                f"({slow[0] / fast[0]:.1f}x)"
+            ))
+        finally:
+            Product.objects.filter(pk__in=ids).delete()
+            Tag.objects.filter(pk__in=[t.pk for t in tag_objs]).delete()
+            if not category.products.exists():
+                category.delete()
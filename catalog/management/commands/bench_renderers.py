@@ -0,0 +1,105 @@
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from django.test import Client
+from rest_framework.renderers import JSONRenderer
+
+from catalog.models import Category, Product, ProductImage, Tag
+from megano import renderers
+from orders.models import Order, OrderItem
+from orders.serializers import OrderDetailSerializer, OrderListSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает время рендеринга больших ответов API: JSONRenderer DRF, "
+        "FastJSONRenderer (orjson) и MessagePack. Создаёт временные товары и "
+        "заказы и удаляет их."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=200, help="рендерингов каждого ответа")
+        parser.add_argument("--products", type=int, default=100, help="товаров на странице каталога")
+        parser.add_argument("--orders", type=int, default=100)
+        parser.add_argument("--lines", type=int, default=5, help="позиций в заказе")
+
+    def handle(self, *args, rounds, products, orders, lines, **options):
+        category, _ = Category.objects.get_or_create(slug="bench-render", defaults={"name": "Bench"})
+        tag, _ = Tag.objects.get_or_create(slug="bench-render", defaults={"name": "Bench render"})
+        items = [
+            Product.objects.create(
+                category=category, title=f"Товар {i}", slug=f"bench-render-{i}",
+                price=Decimal("1234.50") + i, count=10, rating=Decimal("4.5"),
+            )
+            for i in range(products)
+        ]
+        ids = [p.pk for p in items]
+        ProductImage.objects.bulk_create([
+            ProductImage(product=p, src=f"catalog/product-images/bench-{p.pk}.png", alt=p.title)
+            for p in items
+        ])
+        tag.products.set(items)
+        order_objs = [
+            Order.objects.create(
+                session_key=f"bench-render-{n}", full_name="Иван Петров", phone="+70000000000",
+                email="bench@example.com", address="Москва", total_amount=Decimal("6172.50") * lines,
+            )
+            for n in range(orders)
+        ]
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order, product=items[(n + k) % len(items)], qty=k + 1,
+                price_at_order=items[(n + k) % len(items)].price,
+                title=items[(n + k) % len(items)].title, slug=items[(n + k) % len(items)].slug,
+                category_id=category.pk,
+            )
+            for n, order in enumerate(order_objs) for k in range(lines)
+        ])
+
+        try:
+            host = next((h for h in settings.ALLOWED_HOSTS if h != "*" and not h.startswith(".")), "localhost")
+            response = Client(HTTP_HOST=host).get(
+                "/api/catalog", {"category": category.pk, "limit": products, "sort": "price"}
+            )
+            history = Order.objects.filter(pk__in=[o.pk for o in order_objs])
+            payloads = {
+                f"catalog limit={products}": response.data,
+                f"order history x{orders}": OrderListSerializer(history, many=True).data,
+                f"order details x{orders}": OrderDetailSerializer(
+                    history.prefetch_related(Prefetch("items", queryset=OrderItem.objects.order_by("id"))),
+                    many=True,
+                ).data,
+            }
+            candidates = [("DRF JSONRenderer", JSONRenderer()), ("FastJSONRenderer", renderers.FastJSONRenderer())]
+            if renderers.msgpack is not None:
+                candidates.append(("MessagePack", renderers.MessagePackRenderer()))
+            if renderers.orjson is None:
+                self.stdout.write(self.style.WARNING("orjson is not installed: FastJSONRenderer falls back to DRF"))
+
+            for label, data in payloads.items():
+                self.stdout.write(f"{label}:")
+                baseline = None
+                for name, renderer in candidates:
+                    body = renderer.render(data)
+                    started = time.perf_counter()
+                    for _ in range(rounds):
+                        renderer.render(data)
+                    elapsed = (time.perf_counter() - started) / rounds * 1000
+                    baseline = baseline or elapsed
+                    same = ""
+                    if renderer.media_type == "application/json" and name != candidates[0][0]:
+                        same = ", same bytes" if body == candidates[0][1].render(data) else ", DIFFERENT BYTES"
+                    self.stdout.write(
+                        f"  {name:>17}: {elapsed:7.3f} ms, {len(body):>7} bytes, "
+                        f"{baseline / elapsed:4.1f}x{same}"
+                    )
+            self.stdout.write(self.style.SUCCESS("Done"))
+        finally:
+            Order.objects.filter(pk__in=[o.pk for o in order_objs]).delete()
+            Product.objects.filter(pk__in=ids).delete()
+            tag.delete()
+            if not category.products.exists():
+                category.delete()
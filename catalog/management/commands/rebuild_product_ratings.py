@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from catalog import cards, conditional, ratings
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает reviews_count, rating_sum и rating товаров по отзывам."
+
+    def handle(self, *args, **options):
+        total = ratings.rebuild()
+        # рейтинг входит в карточки товаров и в ETag детальной карточки
+        cards.invalidate_all()
+        conditional.invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f"Updated {total} products"))
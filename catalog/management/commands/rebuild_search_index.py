@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from catalog import search
+
+
+class Command(BaseCommand):
+    help = "Перестраивает полнотекстовый индекс товаров (catalog_product_search)."
+
+    def handle(self, *args, **options):
+        total = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} products"))
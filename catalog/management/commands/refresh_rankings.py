@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from catalog import rankings
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает рейтинги популярных и лимитированных товаров (для cron)."
+
+    def handle(self, *args, **options):
+        data = rankings.refresh()
+        self.stdout.write(self.style.SUCCESS(
+            f"Ranked {len(data['popular'])} popular, "
+            f"{len(data['limited'])} limited, {len(data['categories'])} categories"
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from megano import responsecache
+
+
+class Command(BaseCommand):
+    help = (
+        "Статистика кеша ответов для анонимных GET (megano/responsecache.py): "
+        "попадания, промахи, устаревшие записи, запросы, дождавшиеся чужого "
+        "пересчёта. --reset обнуляет счётчики."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="обнулить счётчики")
+
+    def handle(self, *args, reset, **options):
+        if reset:
+            responsecache.metrics.reset()
+            self.stdout.write(self.style.SUCCESS("Counters reset"))
+            return
+
+        totals = responsecache.metrics.totals()
+        served = totals["hit"] + totals["coalesced"]
+        requests = served + totals["miss"]
+        for name in responsecache.Metrics.NAMES:
+            self.stdout.write(f"{name:>10}: {totals[name]}")
+        ratio = served / requests * 100 if requests else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Hit ratio {ratio:.1f}% of {requests} cacheable requests "
+            f"(backend '{responsecache.get_config()['CACHE']}')"
+        ))
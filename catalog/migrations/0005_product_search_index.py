@@ -0,0 +1,85 @@
+# Полнотекстовый индекс товаров (см. catalog/search.py). SQL и сборка
+# документов — копия на момент миграции: catalog.search может меняться.
+
+from django.db import migrations
+
+SEARCH_TABLE = 'catalog_product_search'
+BATCH_SIZE = 500
+
+CREATE_INDEX = {
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "title, short_description, description, brand, tags, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    ],
+    'postgresql': [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        "product_id bigint PRIMARY KEY REFERENCES catalog_product(id) "
+        "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+        "document tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx "
+        f"ON {SEARCH_TABLE} USING GIN (document)",
+    ],
+}
+
+INSERT_DOCUMENT = {
+    'sqlite': (
+        f"INSERT INTO {SEARCH_TABLE}"
+        "(rowid, title, short_description, description, brand, tags) "
+        "VALUES (%s, %s, %s, %s, %s, %s)"
+    ),
+    'postgresql': (
+        f"INSERT INTO {SEARCH_TABLE} (product_id, document) VALUES (%s, "
+        "setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'B') || "
+        "setweight(to_tsvector('simple', %s), 'D') || "
+        "setweight(to_tsvector('simple', %s), 'C') || "
+        "setweight(to_tsvector('simple', %s), 'C')) "
+        "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document"
+    ),
+}
+
+
+def documents(Product, product_ids):
+    rows = (
+        Product.objects
+        .filter(pk__in=product_ids)
+        .values_list('id', 'title', 'short_description', 'description', 'brand__name')
+    )
+    tags = {}
+    through = Product.tags.through.objects.filter(product_id__in=product_ids)
+    for pid, name in through.values_list('product_id', 'tag__name'):
+        tags.setdefault(pid, []).append(name)
+    return [
+        (pid, title, short or '', desc or '', brand or '', ' '.join(tags.get(pid, ())))
+        for pid, title, short, desc, brand in rows
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_INDEX:
+        return  # прочие СУБД ищут через icontains, индекс не нужен
+    Product = apps.get_model('catalog', 'Product')
+    ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+    with schema_editor.connection.cursor() as cursor:
+        for sql in CREATE_INDEX[vendor]:
+            cursor.execute(sql)
+        for start in range(0, len(ids), BATCH_SIZE):
+            cursor.executemany(INSERT_DOCUMENT[vendor], documents(Product, ids[start:start + BATCH_SIZE]))
+
+
+def drop_search_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_product_count_product_free_delivery_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
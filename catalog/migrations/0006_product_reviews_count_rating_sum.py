@@ -0,0 +1,46 @@
+# Generated by Django 5.2.5 on 2026-10-17 05:55
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+BATCH_SIZE = 500
+
+
+def fill_ratings(apps, schema_editor):
+    # то же, что catalog.ratings.rebuild() на момент миграции
+    Product = apps.get_model('catalog', 'Product')
+    Review = apps.get_model('catalog', 'Review')
+    stats = {
+        row['product']: (row['cnt'], row['total'])
+        for row in Review.objects.order_by().values('product').annotate(cnt=Count('id'), total=Sum('rating'))
+    }
+    products = list(Product.objects.filter(pk__in=stats).only('pk'))
+    for product in products:
+        product.reviews_count, product.rating_sum = stats[product.pk]
+        product.rating = (Decimal(product.rating_sum) / product.reviews_count).quantize(
+            Decimal('0.1'), ROUND_HALF_UP
+        )
+    Product.objects.bulk_update(products, ['reviews_count', 'rating_sum', 'rating'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, verbose_name='Сумма оценок'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Кол-во отзывов'),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-17 05:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# картинки, которые раньше были зашиты в BannersView
+STATIC_IMAGES = [
+    'frontend/assets/img/content/home/slider.png',
+    'frontend/assets/img/content/home/bigGoods.png',
+    'frontend/assets/img/content/home/videoca.png',
+]
+
+
+def seed_banners(apps, schema_editor):
+    Category = apps.get_model('catalog', 'Category')
+    Banner = apps.get_model('catalog', 'Banner')
+    roots = Category.objects.filter(is_active=True, parent__isnull=True).order_by('id')[:3]
+    Banner.objects.bulk_create([
+        Banner(category=cat, static_image=STATIC_IMAGES[i], sort_index=i)
+        for i, cat in enumerate(roots)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_product_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Banner',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(blank=True, default='', help_text='Если пусто — название категории', max_length=200, verbose_name='Заголовок')),
+                ('image', models.ImageField(blank=True, upload_to='catalog/banners/', verbose_name='Картинка')),
+                ('static_image', models.CharField(blank=True, default='', help_text='Путь в static, если картинка не загружена', max_length=255, verbose_name='Статичная картинка')),
+                ('sort_index', models.PositiveIntegerField(default=0, verbose_name='Индекс сортировки')),
+                ('is_active', models.BooleanField(default=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='banners', to='catalog.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Баннер',
+                'verbose_name_plural': 'Баннеры',
+                'ordering': ('sort_index', 'id'),
+            },
+        ),
+        migrations.RunPython(seed_banners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-17 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_banner'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_available_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_cat_available_idx',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reserved_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Зарезервировано'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('count__gt', models.F('reserved_count'))), fields=['created_at', 'id'], name='product_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('count__gt', models.F('reserved_count'))), fields=['category', 'created_at', 'id'], name='product_cat_available_idx'),
+        ),
+    ]
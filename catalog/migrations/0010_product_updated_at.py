@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-17 09:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def from_created_at(apps, schema_editor):
+    # для существующих товаров точного времени нет — берём дату создания
+    Product = apps.get_model('catalog', 'Product')
+    Product.objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_product_reserved_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменён'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(from_created_at, migrations.RunPython.noop),
+    ]
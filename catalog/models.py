@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F, Q
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 
@@ -52,15 +53,42 @@ class Product(models.Model):
     sort_index = models.PositiveIntegerField("Индекс сортировки", default=0)
     purchases_count = models.PositiveIntegerField("Кол-во покупок", default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # меняется и при изменении картинок, характеристик, отзывов, тегов и остатка
+    # (catalog/conditional.py) — по нему ETag/Last-Modified карточки товара
+    updated_at = models.DateTimeField("Изменён", auto_now=True)
 
     count = models.PositiveIntegerField(verbose_name='Количество', default=0)
+    # сколько из count удержано корзинами (orders.reservations); свободно count - reserved_count
+    reserved_count = models.PositiveIntegerField(verbose_name='Зарезервировано', default=0)
     full_description = models.TextField(verbose_name='Полное описание', blank=True, default='')
     free_delivery = models.BooleanField(verbose_name='Бесплатная доставка', default=False)
+    # рейтинг денормализован: сумма и количество оценок ведутся вместе с отзывами
     rating = models.DecimalField(max_digits=3, decimal_places=1, default=0)
+    reviews_count = models.PositiveIntegerField("Кол-во отзывов", default=0)
+    rating_sum = models.PositiveIntegerField("Сумма оценок", default=0)
 
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = "Продукт"
+        # индексы под сортировки каталога (поле, id) — с категорией и без,
+        # плюс частичные под «в наличии» (свободный остаток) и limited edition
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='product_cat_created_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx'),
+            models.Index(fields=['rating', 'id'], name='product_rating_idx'),
+            models.Index(fields=['category', 'rating', 'id'], name='product_cat_rating_idx'),
+            models.Index(fields=['reviews_count', 'id'], name='product_reviews_idx'),
+            models.Index(fields=['category', 'reviews_count', 'id'], name='product_cat_reviews_idx'),
+            models.Index(fields=['purchases_count', 'id'], name='product_popular_idx'),
+            models.Index(fields=['created_at', 'id'], condition=Q(count__gt=F('reserved_count')),
+                         name='product_available_idx'),
+            models.Index(fields=['category', 'created_at', 'id'],
+                         condition=Q(count__gt=F('reserved_count')),
+                         name='product_cat_available_idx'),
+            models.Index(fields=['id'], condition=Q(is_limited=True), name='product_limited_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -132,4 +160,24 @@ class Tag(models.Model):
 
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+class Banner(models.Model):
+    """Баннер на главной: категория + картинка, цена «от» считается по поддереву."""
+    category = models.ForeignKey(Category, verbose_name="Категория",
+                                 on_delete=models.CASCADE, related_name='banners')
+    title = models.CharField("Заголовок", max_length=200, blank=True, default='',
+                             help_text='Если пусто — название категории')
+    image = models.ImageField("Картинка", upload_to='catalog/banners/', blank=True)
+    static_image = models.CharField("Статичная картинка", max_length=255, blank=True, default='',
+                                    help_text='Путь в static, если картинка не загружена')
+    sort_index = models.PositiveIntegerField("Индекс сортировки", default=0)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        verbose_name = 'Баннер'
+        verbose_name_plural = "Баннеры"
+        ordering = ('sort_index', 'id')
+
+    def __str__(self):
+        return self.title or str(self.category)
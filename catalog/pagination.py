@@ -0,0 +1,134 @@
+# catalog/pagination.py
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _field(row, name):
+    # строка страницы — модель или словарь из .values()
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset-пагинация (seek method): вместо OFFSET фильтруем по значениям
+    ключа сортировки последней/первой строки страницы, COUNT(*) не считаем.
+
+    Курсор непрозрачный (base64 JSON): значения полей сортировки, признак
+    направления и сама сортировка — курсор от другой сортировки отклоняется.
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    page_size = 20
+    max_page_size = 100
+    default_ordering = ("-created_at", "-id")
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = tuple(queryset.query.order_by) or self.default_ordering
+        # стабильный порядок нужен обязательно — добавляем id, если его нет
+        if ordering[-1].lstrip("-") not in ("id", "pk"):
+            ordering += ("-id",)
+        return tuple(
+            ("-id" if f.startswith("-") else "id") if f.lstrip("-") == "pk" else f
+            for f in ordering
+        )
+
+    # --------- курсор ---------
+    def encode_cursor(self, row, reverse):
+        payload = {
+            "o": list(self.ordering),
+            "v": [_encode_value(_field(row, f.lstrip("-"))) for f in self.ordering],
+            "r": reverse,
+        }
+        raw = json.dumps(payload, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    def decode_cursor(self, request):
+        raw = request.query_params.get(self.cursor_query_param)
+        if not raw:
+            return None
+        try:
+            padded = raw + "=" * (-len(raw) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values, reverse = payload["v"], bool(payload["r"])
+            if tuple(payload["o"]) != self.ordering or len(values) != len(self.ordering):
+                raise ValueError
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def keyset_filter(self, values, reverse):
+        """
+        (f1, f2, ...) «после» (v1, v2, ...) с учётом направления каждого поля:
+        f1 > v1 OR (f1 = v1 AND f2 > v2) OR ...
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            descending = field.startswith("-")
+            lookup = "lt" if descending != reverse else "gt"
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return condition
+
+    # --------- API пагинатора ---------
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        cursor = self.decode_cursor(request)
+
+        reverse = False
+        if cursor is not None:
+            values, reverse = cursor
+            queryset = queryset.filter(self.keyset_filter(values, reverse))
+
+        if reverse:
+            ordering = [f[1:] if f.startswith("-") else f"-{f}" for f in self.ordering]
+        else:
+            ordering = self.ordering
+        rows = list(queryset.order_by(*ordering)[: self.page_size + 1])
+
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, cursor is not None
+
+        self.next_cursor = self.encode_cursor(rows[-1], False) if rows and has_next else None
+        self.prev_cursor = self.encode_cursor(rows[0], True) if rows and has_prev else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            "items": data,
+            "nextCursor": self.next_cursor,
+            "prevCursor": self.prev_cursor,
+        })
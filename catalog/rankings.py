@@ -0,0 +1,146 @@
+# catalog/rankings.py
+"""
+Рейтинги товаров для /api/products/popular и /api/products/limited.
+
+Готовые списки id (популярные — общий и по категориям, лимитированные)
+лежат в общем кеше (алиас ``shared``); вьюхе остаётся достать список и
+взять карточки из catalog/cards.py. Списки, блокировка пересчёта и
+счётчик покупок общие для всех процессов, поэтому пересчёт по cron
+(`python manage.py refresh_rankings`) и сброс из любого процесса сразу
+видят все веб-воркеры.
+
+Checkout увеличивает purchases_count тем же UPDATE, что списывает остаток,
+и сообщает о покупках через note_purchases(). После REFRESH_THRESHOLD
+покупок (по всем процессам) или по истечении TTL рейтинги пересчитываются.
+"""
+import time
+
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from . import categories, home
+from .cache import shared_cache
+from .models import Product
+
+CACHE_KEY = "catalog:rankings"
+LOCK_KEY = "catalog:rankings:lock"
+PURCHASES_KEY = "catalog:rankings:purchases"
+
+DEFAULTS = {
+    "SIZE": 12,
+    "TTL": 300,               # сек., после — пересчёт при чтении
+    "REFRESH_THRESHOLD": 100, # покупок между пересчётами рейтингов
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CATALOG_RANKINGS", {})}
+
+
+# --------- пересчёт ---------
+def popular_queryset():
+    return (
+        Product.objects
+        .filter(category__is_active=True)
+        .order_by("-purchases_count", "-id")
+    )
+
+
+def limited_queryset():
+    return (
+        Product.objects
+        .filter(is_limited=True, category__is_active=True)
+        .order_by("-id")
+    )
+
+
+def _category_rankings(size):
+    """Топ по каждой категории с учётом подкатегорий — одним оконным запросом."""
+    leaf_tops = (
+        Product.objects
+        .filter(category__is_active=True)
+        .annotate(position=Window(
+            RowNumber(),
+            partition_by=F("category_id"),
+            order_by=[F("purchases_count").desc(), F("id").desc()],
+        ))
+        .filter(position__lte=size)
+        .values_list("id", "category_id", "purchases_count")
+    )
+    per_category = {}
+    for pid, category_id, purchases in leaf_tops:
+        per_category.setdefault(category_id, []).append((purchases, pid))
+
+    tree = categories.get_tree()
+    ranked = {}
+    for category_id in tree.active_ids():
+        # топ поддерева = топ объединения топов входящих в него категорий
+        candidates = [
+            item for pk in tree.subtree_ids(category_id) for item in per_category.get(pk, ())
+        ]
+        candidates.sort(reverse=True)
+        if candidates:
+            ranked[category_id] = [pid for _, pid in candidates[:size]]
+    return ranked
+
+
+def refresh():
+    size = get_config()["SIZE"]
+    data = {
+        "built_at": time.time(),
+        "popular": list(popular_queryset().values_list("id", flat=True)[:size]),
+        "limited": list(limited_queryset().values_list("id", flat=True)[:size]),
+        "categories": _category_rankings(size),
+    }
+    previous = shared_cache.get(CACHE_KEY)
+    shared_cache.set(CACHE_KEY, data, None)
+    if previous is not None and any(previous[name] != data[name] for name in ("popular", "limited")):
+        # популярные и лимитированные на главной поменялись
+        home.invalidate()
+    return data
+
+
+def get_rankings():
+    data = shared_cache.get(CACHE_KEY)
+    if data is not None and time.time() - data["built_at"] < get_config()["TTL"]:
+        return data
+    # пересчитывает один запрос, остальные пока отдают старые списки
+    if data is None or shared_cache.add(LOCK_KEY, 1, 30):
+        try:
+            return refresh()
+        finally:
+            shared_cache.delete(LOCK_KEY)
+    return data
+
+
+def invalidate():
+    """Пометить списки устаревшими: один запрос пересчитает, остальные отдадут старые."""
+    data = shared_cache.get(CACHE_KEY)
+    if data is not None:
+        data["built_at"] = 0
+        shared_cache.set(CACHE_KEY, data, None)
+
+
+def popular_ids(category_id=None):
+    data = get_rankings()
+    if category_id is None:
+        return data["popular"]
+    return data["categories"].get(category_id, [])
+
+
+def limited_ids():
+    return get_rankings()["limited"]
+
+
+# --------- покупки ---------
+def note_purchases(counts):
+    """{product_id: qty} — покупки, уже учтённые в purchases_count (checkout)."""
+    shared_cache.add(PURCHASES_KEY, 0, None)
+    try:
+        total = shared_cache.incr(PURCHASES_KEY, sum(counts.values()))
+    except ValueError:  # вытеснен между add() и incr()
+        return
+    if total >= get_config()["REFRESH_THRESHOLD"]:
+        shared_cache.set(PURCHASES_KEY, 0, None)
+        invalidate()
@@ -0,0 +1,73 @@
+# catalog/ratings.py
+"""
+Денормализованные reviews_count / rating_sum / rating у Product.
+
+apply_review() вызывается сигналами Review в той же транзакции, что и
+создание/удаление отзыва; rebuild() пересчитывает всё пачкой
+(`python manage.py rebuild_product_ratings`). Средняя в обоих случаях
+считается одной функцией average() — в Decimal, с округлением половины
+вверх, а не float-округлением базы данных.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 500
+
+
+def average(rating_sum, reviews_count):
+    if not reviews_count:
+        return Decimal("0")
+    return (Decimal(rating_sum) / reviews_count).quantize(Decimal("0.1"), ROUND_HALF_UP)
+
+
+def apply_review(product_id, rating, sign):
+    """Добавить (sign=1) или вычесть (sign=-1) одну оценку."""
+    from .models import Product
+
+    with transaction.atomic():
+        row = (
+            Product.objects.select_for_update()
+            .filter(pk=product_id)
+            .values_list("reviews_count", "rating_sum")
+            .first()
+        )
+        if row is None:  # товар удаляется вместе с отзывами
+            return
+        reviews_count = max(row[0] + sign, 0)
+        rating_sum = max(row[1] + sign * rating, 0)
+        Product.objects.filter(pk=product_id).update(
+            reviews_count=reviews_count,
+            rating_sum=rating_sum,
+            rating=average(rating_sum, reviews_count),
+        )
+
+
+def rebuild():
+    from .models import Product, Review
+
+    stats = (
+        Review.objects
+        .filter(product=OuterRef("pk"))
+        .order_by()
+        .values("product")
+        .annotate(cnt=Count("id"), total=Sum("rating"))
+    )
+    with transaction.atomic():
+        updated = Product.objects.update(
+            reviews_count=Coalesce(Subquery(stats.values("cnt")), Value(0)),
+            rating_sum=Coalesce(Subquery(stats.values("total")), Value(0)),
+        )
+        Product.objects.filter(reviews_count=0).update(rating=0)
+        rated = Product.objects.filter(reviews_count__gt=0).only("pk", "reviews_count", "rating_sum")
+        batch = []
+        for product in rated.iterator(chunk_size=BATCH_SIZE):
+            product.rating = average(product.rating_sum, product.reviews_count)
+            batch.append(product)
+            if len(batch) == BATCH_SIZE:
+                Product.objects.bulk_update(batch, ["rating"])
+                batch = []
+        Product.objects.bulk_update(batch, ["rating"])
+    return updated
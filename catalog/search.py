@@ -0,0 +1,258 @@
+# catalog/search.py
+"""
+Полнотекстовый поиск по товарам.
+
+Индекс живёт в отдельной таблице catalog_product_search:
+  * SQLite   — виртуальная таблица FTS5 (rowid = id товара, ранжирование bm25);
+  * Postgres — таблица с колонкой tsvector и GIN-индексом (ts_rank).
+Для прочих СУБД — запасной вариант через icontains.
+
+Индексируются title, short_description, description, имя бренда и имена тегов.
+Синхронизация — сигналами из catalog/signals.py, полная перестройка —
+`python manage.py rebuild_search_index`.
+"""
+import re
+
+from django.db import connection as default_connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = "catalog_product_search"
+MAX_TOKENS = 8
+BATCH_SIZE = 500
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or "").lower())[:MAX_TOKENS]
+
+
+def _documents(product_ids):
+    """(id, title, short_description, description, brand, tags) для индекса."""
+    from .models import Product
+
+    rows = (
+        Product.objects
+        .filter(pk__in=product_ids)
+        .values_list("id", "title", "short_description", "description", "brand__name")
+    )
+    tags = {}
+    through = Product.tags.through.objects.filter(product_id__in=product_ids)
+    for pid, name in through.values_list("product_id", "tag__name"):
+        tags.setdefault(pid, []).append(name)
+    return [
+        (pid, title, short or "", desc or "", brand or "", " ".join(tags.get(pid, ())))
+        for pid, title, short, desc, brand in rows
+    ]
+
+
+class BaseSearchBackend:
+    """Общий интерфейс: создание индекса, обновление строк, поиск."""
+
+    def create_index(self, cursor):
+        pass
+
+    def drop_index(self, cursor):
+        pass
+
+    def write(self, cursor, documents):
+        pass
+
+    def delete(self, cursor, product_ids):
+        pass
+
+    def filter_queryset(self, qs, text):
+        raise NotImplementedError
+
+    def annotate_rank(self, qs, text):
+        """Аннотация search_rank: меньше — релевантнее (для order_by по возрастанию)."""
+        return qs
+
+
+class SqliteFTSBackend(BaseSearchBackend):
+    # веса колонок для bm25: title, short_description, description, brand, tags
+    weights = (10.0, 4.0, 1.0, 3.0, 3.0)
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "title, short_description, description, brand, tags, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def write(self, cursor, documents):
+        self.delete(cursor, [doc[0] for doc in documents])
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE}"
+            "(rowid, title, short_description, description, brand, tags) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            documents,
+        )
+
+    def delete(self, cursor, product_ids):
+        ids = list(product_ids)
+        if ids:
+            marks = ", ".join(["%s"] * len(ids))
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({marks})", ids)
+
+    @staticmethod
+    def to_query(text):
+        # каждый токен — префиксный поиск, между токенами неявный AND
+        return " ".join(f'"{token}"*' for token in tokenize(text))
+
+    def filter_queryset(self, qs, text):
+        query = self.to_query(text)
+        if not query:
+            return qs
+        return qs.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", (query,)
+        ))
+
+    def annotate_rank(self, qs, text):
+        query = self.to_query(text)
+        if not query:
+            return qs
+        weights = ", ".join(str(w) for w in self.weights)
+        table = qs.model._meta.db_table
+        return qs.annotate(search_rank=RawSQL(
+            f"SELECT bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = {table}.id",
+            (query,), output_field=FloatField(),
+        ))
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    config = "simple"
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "product_id bigint PRIMARY KEY REFERENCES catalog_product(id) "
+            "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx "
+            f"ON {SEARCH_TABLE} USING GIN (document)"
+        )
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def write(self, cursor, documents):
+        cfg = self.config
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (product_id, document) VALUES (%s, "
+            f"setweight(to_tsvector('{cfg}', %s), 'A') || "
+            f"setweight(to_tsvector('{cfg}', %s), 'B') || "
+            f"setweight(to_tsvector('{cfg}', %s), 'D') || "
+            f"setweight(to_tsvector('{cfg}', %s), 'C') || "
+            f"setweight(to_tsvector('{cfg}', %s), 'C')) "
+            "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+            documents,
+        )
+
+    def delete(self, cursor, product_ids):
+        ids = list(product_ids)
+        if ids:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE product_id = ANY(%s)", (ids,))
+
+    @staticmethod
+    def to_query(text):
+        return " & ".join(f"{token}:*" for token in tokenize(text))
+
+    def filter_queryset(self, qs, text):
+        query = self.to_query(text)
+        if not query:
+            return qs
+        return qs.filter(id__in=RawSQL(
+            f"SELECT product_id FROM {SEARCH_TABLE} "
+            f"WHERE document @@ to_tsquery('{self.config}', %s)", (query,)
+        ))
+
+    def annotate_rank(self, qs, text):
+        query = self.to_query(text)
+        if not query:
+            return qs
+        table = qs.model._meta.db_table
+        return qs.annotate(search_rank=RawSQL(
+            f"SELECT -ts_rank(document, to_tsquery('{self.config}', %s)) "
+            f"FROM {SEARCH_TABLE} WHERE product_id = {table}.id",
+            (query,), output_field=FloatField(),
+        ))
+
+
+class FallbackSearchBackend(BaseSearchBackend):
+    """Без индекса: icontains по тем же полям (каждый токен — AND)."""
+
+    def filter_queryset(self, qs, text):
+        for token in tokenize(text):
+            qs = qs.filter(
+                Q(title__icontains=token)
+                | Q(short_description__icontains=token)
+                | Q(description__icontains=token)
+                | Q(brand__name__icontains=token)
+                | Q(tags__name__icontains=token)
+            ).distinct()
+        return qs
+
+
+_BACKENDS = {
+    "sqlite": SqliteFTSBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_backend(connection=None):
+    connection = connection or default_connection
+    return _BACKENDS.get(connection.vendor, FallbackSearchBackend)()
+
+
+# --------- синхронизация индекса ---------
+def index_products(product_ids, connection=None):
+    connection = connection or default_connection
+    ids = list(product_ids)
+    backend = get_backend(connection)
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            documents = _documents(batch)
+            # удалённые/несуществующие id просто вычищаем из индекса
+            missing = set(batch) - {doc[0] for doc in documents}
+            backend.delete(cursor, missing)
+            backend.write(cursor, documents)
+
+
+def remove_products(product_ids, connection=None):
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        get_backend(connection).delete(cursor, product_ids)
+
+
+def rebuild_index(connection=None):
+    from .models import Product
+
+    connection = connection or default_connection
+    backend = get_backend(connection)
+    with connection.cursor() as cursor:
+        backend.drop_index(cursor)
+        backend.create_index(cursor)
+    ids = Product.objects.order_by("id").values_list("id", flat=True)
+    index_products(ids, connection=connection)
+    return len(ids)
+
+
+# --------- использование во вьюхах ---------
+def filter_queryset(qs, text):
+    # в запросе одни знаки (кавычки, *, -) — искать нечего, а не «всё подряд»
+    if not tokenize(text):
+        return qs.none()
+    return get_backend().filter_queryset(qs, text)
+
+
+def annotate_rank(qs, text):
+    return get_backend().annotate_rank(qs, text)
@@ -1,6 +1,10 @@
 # catalog/serializers.py
 
+from functools import lru_cache
+
 from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import filepath_to_uri
 from urllib.parse import urljoin
 from rest_framework import serializers
 
@@ -244,3 +248,110 @@ class ProductFullSerializer(ProductShortSerializer):
             for r in qs
         ]
 
+
+# --------------------------
+# БЫСТРЫЙ ПУТЬ ДЛЯ СПИСКОВ ProductShort
+# --------------------------
+# Для страниц каталога и подборок: карточки собираются из строк .values()
+# без модельных объектов и без DRF-сериализации поле за полем. Картинки и
+# теги — по одному запросу на страницу. Результат совпадает с
+# ProductShortSerializer байт в байт (catalog/tests.py), порядок картинок
+# и тегов — по id, как отдаёт prefetch.
+
+PRODUCT_SHORT_VALUES = ("id", "category_id", "price", "count", "created_at", "title", "rating")
+
+
+@lru_cache(maxsize=None)
+def _short_fields():
+    # те же поля, что у сериализатора: форматирование цены, рейтинга и даты не расходится
+    fields = ProductShortSerializer().fields
+    return (
+        fields["id"].to_representation,
+        fields["category"].to_representation,
+        fields["price"].to_representation,
+        fields["count"].to_representation,
+        fields["date"].to_representation,
+        fields["title"].to_representation,
+        fields["rating"].to_representation,
+    )
+
+
+class MediaURLs:
+    """
+    URL картинки по имени файла — как ProductImageSerializer.get_src, но
+    абсолютный префикс MEDIA_URL считается один раз на запрос.
+    """
+
+    def __init__(self, storage, request=None):
+        self.storage = storage
+        self.request = request
+        self.prefix = None
+        base = getattr(storage, "base_url", None)
+        if isinstance(storage, FileSystemStorage) and base:
+            if request is None or not base.startswith("/"):
+                self.prefix = base
+            elif not base.startswith("//") and "/./" not in base and "/../" not in base:
+                self.prefix = request.build_absolute_uri(base)
+
+    def __call__(self, name):
+        if not name:
+            return None
+        path = filepath_to_uri(name).lstrip("/")
+        if self.prefix is not None and "./" not in path:
+            return self.prefix + path
+        # нестандартное хранилище или путь с ./ — как в сериализаторе
+        url = self.storage.url(name)
+        if self.request is not None and url.startswith("/"):
+            return self.request.build_absolute_uri(url)
+        return url
+
+
+def product_short_cards(rows, request=None):
+    """
+    Карточки ProductShort из строк Product.objects.values(*PRODUCT_SHORT_VALUES)
+    в порядке rows. Плюс один запрос картинок и один — имён тегов.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    ids = [row["id"] for row in rows]
+
+    media_url = MediaURLs(ProductImage._meta.get_field("src").storage, request)
+    images = {pk: [] for pk in ids}
+    for product_id, src, alt in (
+        ProductImage.objects.filter(product_id__in=ids)
+        .order_by("product_id", "id")
+        .values_list("product_id", "src", "alt")
+    ):
+        images[product_id].append({"src": media_url(src), "alt": alt})
+
+    tags = {pk: [] for pk in ids}
+    for product_id, name in (
+        Product.tags.through.objects.filter(product_id__in=ids)
+        .order_by("product_id", "tag_id")
+        .values_list("product_id", "tag__name")
+    ):
+        tags[product_id].append(name)
+
+    pk_repr, category_repr, price_repr, count_repr, date_repr, title_repr, rating_repr = _short_fields()
+    return [
+        {
+            "id": pk_repr(row["id"]),
+            "category": category_repr(row["category_id"]),
+            "price": price_repr(row["price"]),
+            "count": count_repr(row["count"]),
+            "date": date_repr(row["created_at"]),
+            "title": title_repr(row["title"]),
+            "images": images[row["id"]],
+            "tags": tags[row["id"]],
+            "rating": rating_repr(row["rating"]),
+        }
+        for row in rows
+    ]
+
+
+def product_short_by_ids(ids, request=None, queryset=None):
+    """Карточки ProductShort по списку id в том же порядке (три запроса)."""
+    queryset = queryset if queryset is not None else Product.objects.all()
+    rows = {row["id"]: row for row in queryset.filter(pk__in=ids).values(*PRODUCT_SHORT_VALUES)}
+    return product_short_cards([rows[pk] for pk in ids if pk in rows], request)
@@ -0,0 +1,197 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed, pre_delete, pre_save
+from django.dispatch import receiver
+
+from megano import responsecache
+
+from . import banners, cards, categories, conditional, facets, home, rankings, ratings, search, tasks
+from .models import Product, ProductImage, Banner, Brand, Category, FeatureValue, Features, Review, Tag
+
+
+def _on_commit(func, *args):
+    transaction.on_commit(lambda: func(*args))
+
+
+# --------- товары: поисковый индекс и фасеты ---------
+@receiver(pre_save, sender=Product)
+def remember_product_category(sender, instance, raw=False, **kwargs):
+    # товар, перенесённый в другую категорию, пропадает из списка старой
+    if instance.pk and not raw:
+        instance._category_before = (
+            Product.objects.filter(pk=instance.pk).values_list("category_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_products([instance.pk])
+    before = getattr(instance, "_category_before", None)
+    conditional.products_changed([instance.pk], [instance.category_id, *([before] if before else [])])
+    _on_commit(cards.invalidate, [instance.pk])
+    _on_commit(facets.refresh_products, [instance.pk])
+    _on_commit(banners.invalidate)
+    _on_commit(rankings.invalidate)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+    conditional.products_changed([instance.pk], [instance.category_id])
+    _on_commit(cards.invalidate, [instance.pk])
+    _on_commit(facets.remove_products, [instance.pk])
+    _on_commit(banners.invalidate)
+    _on_commit(rankings.invalidate)
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def product_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == "pre_clear":
+        # tag.products.clear() — запоминаем товары, пока связи ещё есть
+        instance._cleared_product_ids = list(instance.products.values_list("id", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == "post_clear":
+        product_ids = getattr(instance, "_cleared_product_ids", [])
+    else:
+        product_ids = list(pk_set or [])
+    search.index_products(product_ids)
+    conditional.touch_products(product_ids)
+    _on_commit(cards.invalidate, product_ids)
+    _on_commit(facets.refresh_products, product_ids)
+
+
+# --------- картинки товара: входят в карточку ---------
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        conditional.touch_products([instance.product_id])
+        _on_commit(cards.invalidate, [instance.product_id])
+
+
+# --------- характеристики: входят в детальную карточку ---------
+@receiver(post_save, sender=FeatureValue)
+@receiver(post_delete, sender=FeatureValue)
+def feature_value_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        conditional.touch_products([instance.product_id])
+
+
+@receiver(post_save, sender=Features)
+def feature_renamed(sender, instance, created, raw=False, **kwargs):
+    if not (raw or created):
+        conditional.touch_products(instance.values.values_list("product_id", flat=True))
+
+
+# --------- бренды и теги: имена входят в индекс и фасеты ---------
+# у бренда/тега могут быть тысячи товаров — индекс обновляет фоновая задача,
+# поставленная в той же транзакции
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Tag)
+def related_name_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    product_ids = list(instance.products.values_list("id", flat=True))
+    if product_ids:
+        tasks.reindex_products.enqueue(product_ids)
+        if sender is Tag:
+            # имена тегов есть в карточках
+            conditional.touch_products(product_ids)
+            _on_commit(cards.invalidate, product_ids)
+    _on_commit(facets.invalidate)
+
+
+@receiver(pre_delete, sender=Brand)
+@receiver(pre_delete, sender=Tag)
+def remember_related_products(sender, instance, **kwargs):
+    instance._related_product_ids = list(instance.products.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Tag)
+def related_deleted(sender, instance, **kwargs):
+    product_ids = getattr(instance, "_related_product_ids", [])
+    if product_ids:
+        tasks.reindex_products.enqueue(product_ids)
+        if sender is Tag:
+            conditional.touch_products(product_ids)
+            _on_commit(cards.invalidate, product_ids)
+    _on_commit(facets.invalidate)
+
+
+# --------- отзывы: денормализованный рейтинг ---------
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._rating_before = (
+            Review.objects.filter(pk=instance.pk).values_list("product_id", "rating").first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    before = getattr(instance, "_rating_before", None)
+    if before is not None:
+        ratings.apply_review(before[0], before[1], -1)
+        conditional.touch_products([before[0]])
+        _on_commit(cards.invalidate, [before[0]])
+    ratings.apply_review(instance.product_id, instance.rating, +1)
+    # рейтинг в карточке, сам отзыв — в детальной
+    conditional.touch_products([instance.product_id])
+    _on_commit(cards.invalidate, [instance.product_id])
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    ratings.apply_review(instance.product_id, instance.rating, -1)
+    conditional.touch_products([instance.product_id])
+    _on_commit(cards.invalidate, [instance.product_id])
+
+
+# --------- категории: дерево в памяти ---------
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _on_commit(categories.invalidate)
+    conditional.products_changed(category_ids=[instance.pk])
+    # фасеты и баннеры агрегируются по поддеревьям — структура могла поменяться
+    _on_commit(facets.invalidate)
+    _on_commit(banners.invalidate)
+    _on_commit(rankings.invalidate)
+
+
+# --------- баннеры ---------
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+def banner_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _on_commit(banners.invalidate)
+
+
+# --------- список тегов (/api/tags) в кеше ответов ---------
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_list_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _on_commit(responsecache.invalidate, "tags")
+
+
+# --------- главная страница (/api/home) ---------
+def home_data_changed(sender, raw=False, **kwargs):
+    if not raw:
+        _on_commit(home.invalidate)
+
+
+for _model in (Product, ProductImage, Tag, Review, Category, Banner):
+    post_save.connect(home_data_changed, sender=_model, dispatch_uid=f"home-save-{_model.__name__}")
+    post_delete.connect(home_data_changed, sender=_model, dispatch_uid=f"home-delete-{_model.__name__}")
+m2m_changed.connect(home_data_changed, sender=Product.tags.through, dispatch_uid="home-product-tags")
@@ -0,0 +1,12 @@
+"""Фоновые задачи каталога (см. taskqueue.queue)."""
+from taskqueue.queue import task
+
+from . import conditional, search
+
+
+@task()
+def reindex_products(product_ids):
+    """Переиндексировать товары в поиске (удалённые id вычищаются из индекса)."""
+    search.index_products(product_ids)
+    # результаты поиска в каталоге поменялись
+    conditional.products_changed(product_ids)
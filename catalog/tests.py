@@ -1,3 +1,903 @@
-from django.test import TestCase
+import base64
+import json
+import random
+import time
+import uuid
+from io import BytesIO, StringIO
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from megano import renderers, responsecache
+from taskqueue.queue import run_pending
+from . import banners as banners_module, cards, conditional, facets, home, rankings, ratings, search
+from .cache import LocalSnapshot, SharedVersion, forget_snapshots, shared_cache
+from .models import Banner, Brand, Category, Product, ProductImage, Review, Tag
+from .tasks import reindex_products
+from .serializers import (
+    PRODUCT_SHORT_VALUES, ProductShortSerializer, product_short_by_ids, product_short_cards,
+)
+from .views import ProductListView
+
+
+def clear_caches():
+    for cache in caches.all(initialized_only=True):
+        cache.clear()
+    forget_snapshots()
+
+
+@skipUnless(connection.vendor == "sqlite", "планы запросов проверяются на SQLite")
+class CatalogQueryPlanTests(TestCase):
+    """
+    EXPLAIN QUERY PLAN для каждой формы запроса каталога: товары должны
+    читаться по индексу, а сортировка — без временного B-дерева.
+    """
+    products_count = 3000
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(5)
+        roots = [
+            Category.objects.create(name=f"Root {i}", slug=f"root-{i}")
+            for i in range(4)
+        ]
+        cls.categories = roots + [
+            Category.objects.create(name=f"Sub {i}", slug=f"sub-{i}", parent=roots[i % 4])
+            for i in range(12)
+        ]
+        brands = [Brand.objects.create(name=f"Brand {i}") for i in range(20)]
+        now = timezone.now()
+        Product.objects.bulk_create([
+            Product(
+                category=rnd.choice(cls.categories),
+                brand=rnd.choice(brands),
+                title=f"Product {i}",
+                slug=f"product-{i}",
+                price=Decimal(rnd.randint(100, 200000)) / 100,
+                count=rnd.choice([0, 0, 1, 5, 20]),
+                free_delivery=rnd.random() < 0.3,
+                is_limited=rnd.random() < 0.05,
+                purchases_count=rnd.randint(0, 500),
+                reviews_count=rnd.randint(0, 50),
+                rating=Decimal(rnd.randint(10, 50)) / 10,
+                created_at=now - timedelta(minutes=i),
+            )
+            for i in range(cls.products_count)
+        ], batch_size=500)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def catalog_queryset(self, **params):
+        request = Request(APIRequestFactory().get("/api/catalog", params))
+        view = ProductListView()
+        view.setup(request)
+        view.request = request
+        view.format_kwarg = None
+        return view.get_queryset()
+
+    def assertIndexedPlan(self, queryset, label):
+        plan = queryset.explain()
+        for line in plan.splitlines():
+            self.assertNotIn("TEMP B-TREE", line, f"{label}: сортировка без индекса\n{plan}")
+            if "catalog_product" in line and "SCAN" in line:
+                self.assertIn("USING", line, f"{label}: полный просмотр таблицы\n{plan}")
+
+    def test_catalog_sorts(self):
+        category = self.categories[5]
+        for sort in ("date", "price", "rating", "reviews"):
+            for sort_type in ("dec", "inc"):
+                for extra in ({}, {"category": category.pk}):
+                    params = {"sort": sort, "sortType": sort_type, **extra}
+                    qs = self.catalog_queryset(**params)[:20]
+                    self.assertIndexedPlan(qs, params)
+
+    def test_catalog_filters(self):
+        category = self.categories[5]
+        shapes = [
+            {"filter[available]": "true"},
+            {"filter[available]": "true", "category": category.pk},
+            {"filter[freeDelivery]": "true"},
+            {"filter[minPrice]": "10", "filter[maxPrice]": "500", "sort": "price"},
+            {"filter[minPrice]": "10", "category": category.pk, "sort": "price", "sortType": "inc"},
+        ]
+        for params in shapes:
+            self.assertIndexedPlan(self.catalog_queryset(**params)[:20], params)
+
+    def test_rankings(self):
+        self.assertIndexedPlan(rankings.popular_queryset()[:12], "popular")
+        self.assertIndexedPlan(rankings.limited_queryset()[:12], "limited")
+        ids = list(Product.objects.values_list("id", flat=True)[:12])
+        self.assertIndexedPlan(Product.objects.filter(pk__in=ids), "hydrate")
+
+
+class ProductShortFastPathTests(TestCase):
+    """Быстрый путь из .values() отдаёт те же байты, что ProductShortSerializer."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Root", slug="root")
+        tags = [Tag.objects.create(name=f"Tag {i}", slug=f"tag-{i}") for i in range(4)]
+        now = timezone.now()
+        cls.products = [
+            Product.objects.create(
+                category=category, title=f"Товар «{i}»", slug=f"product-{i}",
+                price=Decimal("1999.9") + i, count=i, rating=Decimal("4.25") if i else 0,
+            )
+            for i in range(6)
+        ]
+        Product.objects.filter(pk=cls.products[2].pk).update(created_at=now.replace(microsecond=0))
+        names = [
+            "catalog/product-images/a.png",
+            "catalog/product-images/фото товара.jpg",
+            "catalog/product-images/with:colon & spaces?.png",
+            "",
+        ]
+        for i, product in enumerate(cls.products[:-1]):
+            for name in names[: i % 4 + 1]:
+                ProductImage.objects.create(product=product, src=name, alt=f"alt {i}")
+            product.tags.set(tags[i % 3:])
+        # порядок добавления тегов не совпадает с их id
+        cls.products[1].tags.remove(tags[1])
+        cls.products[1].tags.add(tags[1])
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def assertSameAsSerializer(self, request):
+        products = Product.objects.order_by("-id").prefetch_related("images", "tags")
+        context = {"request": request} if request else {}
+        expected = self.render(ProductShortSerializer(products, many=True, context=context).data)
+        rows = Product.objects.order_by("-id").values(*PRODUCT_SHORT_VALUES)
+        with self.assertNumQueries(3):
+            actual = self.render(product_short_cards(rows, request))
+        self.assertEqual(actual, expected)
+
+    def test_parity_with_request(self):
+        request = Request(APIRequestFactory().get("/api/catalog"))
+        self.assertSameAsSerializer(request)
+
+    def test_parity_without_request(self):
+        self.assertSameAsSerializer(None)
+
+    def test_by_ids_keeps_order(self):
+        ids = [self.products[3].pk, 0, self.products[0].pk]
+        cards = product_short_by_ids(ids)
+        self.assertEqual([card["id"] for card in cards], [self.products[3].pk, self.products[0].pk])
+        self.assertEqual(product_short_cards([]), [])
+
+
+class CatalogPaginationTests(TestCase):
+    """Курсорный режим каталога обходит те же товары в том же порядке, что и номера страниц."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Root", slug="root")
+        now = timezone.now()
+        for i in range(11):
+            Product.objects.create(
+                category=category, title=f"Product {i}", slug=f"product-{i}",
+                # повторы значений — порядок внутри них держит id
+                price=Decimal(100 + i % 4), rating=Decimal(i % 3), reviews_count=i % 5,
+            )
+        Product.objects.filter(title__in=["Product 3", "Product 4", "Product 5"]).update(created_at=now)
+
+    def get(self, **params):
+        response = self.client.get("/api/catalog", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, page):
+        return [card["id"] for card in page["items"]]
+
+    def test_legacy_shape_by_default(self):
+        page = self.get(limit=4)
+        self.assertEqual(set(page), {"items", "currentPage", "lastPage"})
+        self.assertEqual((page["currentPage"], page["lastPage"]), (1, 3))
+
+    def test_cursor_walk_matches_pages(self):
+        for sort in ("date", "price", "rating", "reviews"):
+            for sort_type in ("dec", "inc"):
+                params = {"sort": sort, "sortType": sort_type, "limit": 4}
+                expected, number = [], 1
+                while True:
+                    page = self.get(currentPage=number, **params)
+                    expected += self.ids(page)
+                    if number >= page["lastPage"]:
+                        break
+                    number += 1
+
+                walked, cursor = [], None
+                while True:
+                    page = self.get(**params, **({"cursor": cursor} if cursor else {"pagination": "cursor"}))
+                    self.assertEqual(set(page), {"items", "nextCursor", "prevCursor"})
+                    walked += self.ids(page)
+                    cursor = page["nextCursor"]
+                    if cursor is None:
+                        break
+                self.assertEqual(walked, expected, params)
+                self.assertEqual(len(walked), 11)
+
+    def test_prev_cursor(self):
+        first = self.get(pagination="cursor", limit=4, sort="price")
+        second = self.get(cursor=first["nextCursor"], limit=4, sort="price")
+        third = self.get(cursor=second["nextCursor"], limit=4, sort="price")
+        self.assertEqual(self.get(cursor=third["prevCursor"], limit=4, sort="price"), second)
+        self.assertEqual(self.ids(self.get(cursor=second["prevCursor"], limit=4, sort="price")), self.ids(first))
+        self.assertIsNone(first["prevCursor"])
+
+    def test_tampered_cursor(self):
+        cursor = self.get(pagination="cursor", limit=4, sort="price")["nextCursor"]
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        # курсор от другой сортировки
+        payload["o"] = ["-rating", "-id"]
+        forged = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+        for bad in (forged, cursor[:-3], "!!!", "e30"):  # e30 — «{}»
+            response = self.client.get("/api/catalog", {"cursor": bad, "limit": 4, "sort": "price"})
+            self.assertEqual(response.status_code, 404, bad)
+
+
+class SearchTests(TestCase):
+    """Поиск в каталоге: префиксы, бренд, релевантность и синхронизация индекса."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", slug="laptops")
+        asus, lenovo = Brand.objects.create(name="Asus"), Brand.objects.create(name="Lenovo")
+
+        def product(title, brand, description=""):
+            return Product.objects.create(
+                category=category, brand=brand, title=title, slug=title.lower().replace(" ", "-"),
+                description=description, price=Decimal(10),
+            )
+
+        cls.zenbook = product("Ноутбук Zenbook 14", asus)
+        cls.vivobook = product("Vivobook 15", asus)
+        cls.thinkpad = product("ThinkPad X1", lenovo)
+        cls.mouse = product("Мышь беспроводная", None, "Подходит к ThinkPad и другим ноутбукам")
+
+    def setUp(self):
+        clear_caches()
+
+    def search(self, text, **params):
+        response = self.client.get("/api/catalog", {"filter": text, **params})
+        self.assertEqual(response.status_code, 200, text)
+        return [card["id"] for card in response.json()["items"]]
+
+    def indexed_ids(self):
+        column = "rowid" if connection.vendor == "sqlite" else "product_id"
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {column} FROM {search.SEARCH_TABLE}")
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_prefix(self):
+        self.assertEqual(self.search("zenb"), [self.zenbook.pk])
+        self.assertEqual(self.search("ноут zen"), [self.zenbook.pk])
+        self.assertEqual(set(self.search("think")), {self.thinkpad.pk, self.mouse.pk})
+
+    def test_brand(self):
+        self.assertEqual(set(self.search("asus")), {self.zenbook.pk, self.vivobook.pk})
+
+    @skipUnless(connection.vendor in ("sqlite", "postgresql"), "ранжирование — только с индексом")
+    def test_relevance(self):
+        # в названии весит больше, чем в описании
+        self.assertEqual(self.search("thinkpad"), [self.thinkpad.pk, self.mouse.pk])
+        # явная сортировка важнее релевантности
+        self.assertEqual(self.search("thinkpad", sort="date", sortType="inc"), [self.thinkpad.pk, self.mouse.pk])
+        self.assertEqual(self.search("thinkpad", sort="date"), [self.mouse.pk, self.thinkpad.pk])
+
+    def test_syntax_characters(self):
+        for text in ('"', "*", "-", '"*-', "NEAR", "NEAR(", 'zen"', "-zen*"):
+            ids = self.search(text)
+            if "zen" in text:
+                self.assertEqual(ids, [self.zenbook.pk], text)
+            else:
+                self.assertEqual(ids, [], text)
+
+    def test_saved_product_is_reindexed(self):
+        self.zenbook.title = "Chromebook Plus"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.zenbook.save()
+        self.assertEqual(self.search("chromeb"), [self.zenbook.pk])
+        self.assertEqual(self.search("zenbook"), [])
+
+        created = Product.objects.create(
+            category=self.zenbook.category, title="Chromebook Go", slug="chromebook-go", price=Decimal(10),
+        )
+        self.assertEqual(set(self.search("chromebook")), {self.zenbook.pk, created.pk})
+
+    @skipUnless(connection.vendor in ("sqlite", "postgresql"), "отдельная таблица индекса")
+    def test_deleted_product_leaves_index(self):
+        pk = self.vivobook.pk
+        self.assertIn(pk, self.indexed_ids())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vivobook.delete()
+        self.assertNotIn(pk, self.indexed_ids())
+        self.assertEqual(self.search("vivobook"), [])
+
+
+class FacetTests(TestCase):
+    """Фасеты по поддеревьям категорий; изменения доходят до других процессов через журнал."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name="Root", slug="root")
+        cls.child = Category.objects.create(name="Child", slug="child", parent=cls.root)
+        cls.other = Category.objects.create(name="Other", slug="other")
+        asus = Brand.objects.create(name="Asus")
+        hot = Tag.objects.create(name="Hot", slug="hot")
+
+        def product(category, price, **fields):
+            return Product.objects.create(
+                category=category, title=f"Product {price}", slug=f"product-{price}", price=Decimal(price), **fields,
+            )
+
+        cls.in_root = product(cls.root, 10, brand=asus, count=1)
+        cls.in_child = product(cls.child, 20, brand=asus, free_delivery=True)
+        cls.elsewhere = product(cls.other, 30, count=5)
+        cls.in_child.tags.add(hot)
+
+    def setUp(self):
+        clear_caches()
+
+    def get(self, category=None):
+        response = self.client.get("/api/products/filters", {"category": category} if category else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_subtree_counts(self):
+        root = self.get(self.root.pk)
+        self.assertEqual(root["products_count"], 2)
+        self.assertEqual(root["brands"], [{"name": "Asus", "products_count": 2}])
+        self.assertEqual((root["min_price"], root["max_price"]), (10, 20))
+        self.assertEqual((root["free_delivery_count"], root["available_count"]), (1, 1))
+        self.assertEqual(root["tags"], [{"name": "Hot", "products_count": 1}])
+
+        child = self.get(self.child.pk)
+        self.assertEqual((child["products_count"], child["available_count"]), (1, 0))
+        self.assertEqual(self.get()["products_count"], 3)
+
+    def test_unknown_category(self):
+        empty = self.get(10 ** 6)
+        self.assertEqual((empty["products_count"], empty["brands"], empty["price_histogram"]), (0, [], []))
+        self.assertEqual(self.client.get("/api/products/filters", {"category": "abc"}).status_code, 400)
+
+    def test_save_updates_counts(self):
+        self.get(self.root.pk)
+        self.elsewhere.category = self.child
+        with self.captureOnCommitCallbacks(execute=True):
+            self.elsewhere.save()
+        root = self.get(self.root.pk)
+        self.assertEqual((root["products_count"], root["available_count"], root["max_price"]), (3, 2, 30))
+        self.assertEqual(self.get(self.other.pk)["products_count"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.in_root.delete()
+        self.assertEqual(self.get(self.root.pk)["products_count"], 2)
+
+    def test_other_process_replays_changes(self):
+        other = facets.FacetIndex.build()  # индекс другого процесса
+        self.in_root.price = Decimal(15)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.in_root.save()
+        other.checked_at = 0
+        # номер журнала, его записи и два запроса по изменённым товарам — без полной перестройки
+        with self.assertNumQueries(4):
+            self.assertTrue(facets._catch_up(other))
+        self.assertEqual(other.facets(self.root.pk)["min_price"], 15)
+        self.assertEqual(other.seq, facets.current_seq())
+
+    def test_lost_changes_force_rebuild(self):
+        other = facets.FacetIndex.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.in_root.save()
+        shared_cache.delete(facets._change_key(facets.current_seq()))
+        other.checked_at = 0
+        self.assertFalse(facets._catch_up(other))
+
+
+class ResponseCacheTests(TestCase):
+    """Кеш ответов: повтор из общего кеша, сброс по тегам, общие счётчики."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Root", slug="root")
+        Tag.objects.create(name="Hot", slug="hot")
+        cls.products = [
+            Product.objects.create(
+                category=category, title=f"Product {i}", slug=f"product-{i}", price=Decimal(10 + i), count=1,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        clear_caches()
+        responsecache.metrics.reset()
+
+    def test_replay(self):
+        first = self.client.get("/api/catalog")
+        self.assertEqual(first["X-Cache"], "MISS")
+        # запись и версии тегов — два чтения общего кеша, без запросов к каталогу
+        with self.assertNumQueries(2):
+            second = self.client.get("/api/catalog")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+        not_modified = self.client.get("/api/catalog", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["X-Cache"], "HIT")
+
+    def test_query_variants_share_entry(self):
+        self.client.get("/api/catalog", {"filter[name]": "Product", "sort": "price"})
+        response = self.client.get("/api/catalog", {"sort": "price", "name": "Product"})
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    def test_tag_invalidation(self):
+        product = self.products[0]
+        detail = f"/api/product/{product.pk}"
+        for url in (detail, "/api/catalog", "/api/tags"):
+            self.client.get(url)
+
+        product.title = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        response = self.client.get(detail)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["title"], "Renamed")
+        self.assertEqual(self.client.get("/api/catalog")["X-Cache"], "MISS")
+        # теги, которых правка не касается, не сдвигаются
+        self.assertEqual(self.client.get(f"/api/product/{self.products[1].pk}")["X-Cache"], "MISS")
+        self.assertEqual(self.client.get("/api/tags")["X-Cache"], "HIT")
+
+    def test_authenticated_not_cached(self):
+        self.client.get("/api/catalog")
+        response = self.client.get("/api/catalog", HTTP_AUTHORIZATION="Token x")
+        self.assertNotIn("X-Cache", response)
+
+    def test_stats_are_shared(self):
+        for _ in range(3):
+            self.client.get("/api/tags")
+        responsecache.metrics.flush()
+        stored = caches[settings.RESPONSE_CACHE["CACHE"]].get_many(
+            [f"responsecache:stats:{name}" for name in ("hit", "miss", "store")]
+        )
+        self.assertEqual(stored, {"responsecache:stats:hit": 2, "responsecache:stats:miss": 1,
+                                  "responsecache:stats:store": 1})
+
+        out = StringIO()
+        call_command("responsecache_stats", stdout=out)
+        self.assertIn("Hit ratio 66.7% of 3 cacheable requests", out.getvalue())
+
+    def test_wait_backs_off(self):
+        cache = responsecache.get_cache()
+        add = cache.add
+        # пересчёт держит другой запрос и не заканчивает его
+        held = mock.patch.object(cache, "add", lambda key, *args, **kwargs: False if key.endswith(":lock")
+                                 else add(key, *args, **kwargs))
+        self.now, sleeps = 0.0, []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            self.now += seconds
+
+        clock = mock.Mock(monotonic=lambda: self.now, sleep=sleep, time_ns=time.time_ns)
+        with held, mock.patch.object(responsecache, "time", clock):
+            response = self.client.get("/api/catalog")
+        self.assertEqual(response["X-Cache"], "MISS")
+        config = responsecache.get_config()
+        self.assertEqual(sleeps[:4], [0.02, 0.04, 0.08, 0.16])
+        self.assertEqual(max(sleeps), config["MAX_POLL_INTERVAL"])
+        self.assertAlmostEqual(sum(sleeps), config["WAIT"])
+        self.assertLess(len(sleeps), 15)
+
+    def test_refuses_local_memory_backend(self):
+        with override_settings(RESPONSE_CACHE={**settings.RESPONSE_CACHE, "CACHE": "default"}):
+            with self.assertRaises(ImproperlyConfigured):
+                responsecache.ResponseCacheMiddleware(lambda request: None)
+
+
+class LocalSnapshotTests(TestCase):
+    """Снимок перестраивается, когда версию в общем кеше поднял другой процесс."""
+
+    def setUp(self):
+        clear_caches()
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return self.builds
+
+    def test_rebuilds_on_foreign_bump(self):
+        snapshot = LocalSnapshot("test-foreign", self.build, check_interval=0)
+        self.assertEqual(snapshot.get(), 1)
+        self.assertEqual(snapshot.get(), 1)
+        # другой процесс: своя копия снимка, та же версия в общем кеше
+        SharedVersion("snapshot:test-foreign").bump()
+        self.assertEqual(snapshot.get(), 2)
+
+    def test_version_checks_are_throttled(self):
+        snapshot = LocalSnapshot("test-throttled", self.build, check_interval=60)
+        snapshot.get()
+        SharedVersion("snapshot:test-throttled").bump()
+        with self.assertNumQueries(0):
+            self.assertEqual(snapshot.get(), 1)
+        # свой invalidate() действует сразу
+        snapshot.invalidate()
+        self.assertEqual(snapshot.get(), 2)
+
+
+class ConditionalVersionTests(TestCase):
+    """Версии каталога общие для процессов: их двигает и фоновый воркер."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Root", slug="root")
+        cls.product = Product.objects.create(
+            category=category, title="Product", slug="product", price=Decimal(10), count=1,
+        )
+
+    def setUp(self):
+        clear_caches()
+
+    def test_versions_outlive_process_memory(self):
+        versions = conditional.get_versions([conditional.ALL, self.product.category_id])
+        caches["default"].clear()
+        self.assertEqual(conditional.get_versions([conditional.ALL, self.product.category_id]), versions)
+
+    def test_worker_reindex_moves_catalog_etag(self):
+        etag = self.client.get("/api/catalog")["ETag"]
+        reindex_products.enqueue([self.product.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(run_pending(), 1)
+        # у веб-процесса своя память: от воркера ему доходит только общий кеш
+        caches["default"].clear()
+        forget_snapshots()
+        response = self.client.get("/api/catalog", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class LastModifiedTests(TestCase):
+    """Last-Modified округляется вверх и не отдаётся, пока его секунда не прошла."""
+
+    START = 1_700_000_000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Root", slug="root")
+        Product.objects.create(category=cls.category, title="Product", slug="product", price=Decimal(10), count=1)
+        cls.user = User.objects.create_user("reader", password="secret")
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_login(self.user)
+        self.now = self.START
+        clock = mock.Mock()
+        clock.time.side_effect = lambda: self.now
+        clock.time_ns.side_effect = lambda: round(self.now * 10 ** 9)
+        patcher = mock.patch.object(conditional, "time", clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def change(self, at):
+        self.now = at
+        conditional.bump([self.category.pk])
+
+    def get(self, at, **headers):
+        self.now = at
+        return self.client.get("/api/catalog", headers=headers)
+
+    def test_rounds_up_and_waits_for_the_second(self):
+        self.change(self.START + 0.3)
+        # в эту же секунду может прийти ещё изменение — остаётся только ETag
+        response = self.get(self.START + 0.4)
+        self.assertIn("ETag", response)
+        self.assertNotIn("Last-Modified", response)
+
+        response = self.get(self.START + 1.5)
+        last_modified = response["Last-Modified"]
+        self.assertEqual(last_modified, http_date(self.START + 1))
+        self.assertEqual(self.get(self.START + 1.6, if_modified_since=last_modified).status_code, 304)
+
+        self.change(self.START + 1.7)
+        response = self.get(self.START + 2.5, if_modified_since=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Last-Modified"], http_date(self.START + 2))
+
+
+class CardCacheTests(TestCase):
+    """Карточки: сброс по версии товара, запоздалое заполнение не перекрывает сброс."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Root", slug="root")
+        cls.products = [
+            Product.objects.create(
+                category=category, title=f"Product {i}", slug=f"product-{i}", price=Decimal(10), count=1,
+            )
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        clear_caches()
+
+    def test_invalidate_drops_only_given_products(self):
+        first, second = self.products
+        cards.get_cards([first.pk, second.pk])
+        Product.objects.filter(pk__in=[first.pk, second.pk]).update(title="Changed")
+        cards.invalidate([first.pk])
+        titles = [card["title"] for card in cards.get_cards([first.pk, second.pk])]
+        self.assertEqual(titles, ["Changed", "Product 1"])
+
+    def test_late_fill_does_not_overwrite_invalidation(self):
+        product = self.products[0]
+        build = cards.product_short_by_ids
+
+        def racing_build(ids):
+            built = build(ids)
+            # пока карточка строилась, товар изменили и сбросили его карточку
+            Product.objects.filter(pk=product.pk).update(title="Renamed")
+            cards.invalidate([product.pk])
+            return built
+
+        with mock.patch.object(cards, "product_short_by_ids", racing_build):
+            self.assertEqual(cards.get_cards([product.pk])[0]["title"], "Product 0")
+        self.assertEqual(cards.get_cards([product.pk])[0]["title"], "Renamed")
+
+    def test_versions_are_kept_apart_and_expire(self):
+        first, second = self.products
+        shared_cache.set("catalog:version:test", 1, None)
+        versions = caches["card_versions"]
+        with mock.patch.object(versions, "set_many", wraps=versions.set_many) as set_many:
+            cards.get_cards([first.pk, second.pk])
+        # недостающие версии — одной записью и со сроком жизни
+        set_many.assert_called_once()
+        self.assertEqual(len(set_many.call_args.args[0]), 2)
+        self.assertEqual(set_many.call_args.args[1], cards.get_config()["VERSION_TTL"])
+
+        # вытеснение версий карточек не трогает общий кеш, карточки строятся заново
+        Product.objects.filter(pk=first.pk).update(title="Changed")
+        versions.clear()
+        self.assertEqual(shared_cache.get("catalog:version:test"), 1)
+        self.assertEqual(cards.get_cards([first.pk])[0]["title"], "Changed")
+
+
+class HomeETagTests(TestCase):
+    """ETag главной меняется вместе с телом ответа."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Root", slug="root")
+        cls.products = [
+            Product.objects.create(
+                category=category, title=f"Product {i}", slug=f"product-{i}", price=Decimal(10),
+                count=1, purchases_count=i,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        clear_caches()
+
+    def test_if_none_match(self):
+        etag = self.client.get("/api/home")["ETag"]
+        self.assertEqual(self.client.get("/api/home", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get("/api/home", HTTP_IF_NONE_MATCH=f'"other", W/{etag}').status_code, 304)
+        self.assertEqual(self.client.get("/api/home", HTTP_IF_NONE_MATCH="*").status_code, 304)
+        # тег, внутри которого есть текущий, — другой тег
+        wrong = f'"x{etag[1:-1]}x"'
+        self.assertEqual(self.client.get("/api/home", HTTP_IF_NONE_MATCH=wrong).status_code, 200)
+
+    def test_rankings_refresh_moves_etag(self):
+        before = self.client.get("/api/home")
+        Product.objects.filter(pk=self.products[0].pk).update(purchases_count=100)
+        rankings.refresh()
+        after = self.client.get("/api/home", HTTP_IF_NONE_MATCH=before["ETag"])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after.json()["popular"][0]["id"], self.products[0].pk)
+        self.assertNotEqual(after["ETag"], before["ETag"])
+
+    def test_same_body_same_etag(self):
+        first = self.client.get("/api/home")["ETag"]
+        # версия сдвинулась, а данные те же
+        home.invalidate()
+        self.assertEqual(self.client.get("/api/home")["ETag"], first)
+
+
+class RankingsRefreshTests(TestCase):
+    """Рейтинги общие для процессов и помечаются устаревшими после REFRESH_THRESHOLD покупок."""
+
+    def setUp(self):
+        clear_caches()
+
+    @override_settings(CATALOG_RANKINGS={**settings.CATALOG_RANKINGS, "REFRESH_THRESHOLD": 3})
+    def test_refresh_threshold(self):
+        rankings.get_rankings()
+        rankings.note_purchases({1: 2})
+        self.assertGreater(shared_cache.get(rankings.CACHE_KEY)["built_at"], 0)
+        # вторая покупка — из другого процесса: счётчик общий
+        caches["default"].clear()
+        rankings.note_purchases({2: 1})
+        self.assertEqual(shared_cache.get(rankings.CACHE_KEY)["built_at"], 0)
+        # счётчик начинается заново
+        rankings.get_rankings()
+        rankings.note_purchases({1: 2})
+        self.assertGreater(shared_cache.get(rankings.CACHE_KEY)["built_at"], 0)
+
+    def test_command_reaches_other_processes(self):
+        category = Category.objects.create(name="Root", slug="root")
+        first, second = [
+            Product.objects.create(
+                category=category, title=f"Product {i}", slug=f"product-{i}", price=Decimal(10),
+                purchases_count=purchases,
+            )
+            for i, purchases in enumerate((5, 1))
+        ]
+
+        def popular():
+            return [card["id"] for card in self.client.get("/api/products/popular").json()]
+
+        self.assertEqual(popular(), [first.pk, second.pk])
+        Product.objects.filter(pk=second.pk).update(purchases_count=10)
+        self.assertEqual(popular(), [first.pk, second.pk])  # до пересчёта — прежние списки
+
+        # команда из cron — другой процесс со своим LocMemCache
+        other_process = {**settings.CACHES, "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "cron",
+        }}
+        with override_settings(CACHES=other_process):
+            call_command("refresh_rankings", stdout=StringIO())
+        self.assertEqual(popular(), [second.pk, first.pk])
+
+
+class RatingRebuildTests(TestCase):
+    """rebuild() даёт те же рейтинги, что и пооценочный apply_review()."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(4)
+        category = Category.objects.create(name="Root", slug="root")
+        users = [User.objects.create_user(f"user-{i}") for i in range(20)]
+        marks = [
+            [],
+            [4, 5],              # 4.5
+            [1, 2, 2, 2],        # 1.75 -> 1.8
+            [3] * 7 + [2] * 13,  # 2.35 -> 2.4, во float 2.3499…
+            [2] * 7 + [3] * 13,  # 2.65 -> 2.7, во float 2.6499…
+            *[[rnd.randint(1, 5) for _ in range(rnd.randint(1, 20))] for _ in range(30)],
+        ]
+        for i, product_marks in enumerate(marks):
+            product = Product.objects.create(
+                category=category, title=f"Product {i}", slug=f"product-{i}", price=Decimal(10),
+            )
+            for user, mark in zip(users, product_marks):
+                Review.objects.create(product=product, user=user, rating=mark, text="…")
+
+    def ratings(self):
+        return dict(Product.objects.values_list("pk", "rating"))
+
+    def test_rebuild_matches_incremental(self):
+        incremental = self.ratings()
+        self.assertIn(Decimal("2.7"), incremental.values())
+        Product.objects.update(rating=0, rating_sum=0, reviews_count=0)
+        ratings.rebuild()
+        self.assertEqual(self.ratings(), incremental)
+
+
+class BannerFallbackTests(TestCase):
+    """Без строк Banner /api/banners показывает корневые категории, с ними — только их."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.roots = [Category.objects.create(name=f"Root {i}", slug=f"root-{i}") for i in range(4)]
+        child = Category.objects.create(name="Child", slug="child", parent=cls.roots[0])
+        Product.objects.create(category=child, title="Cheap", slug="cheap", price=Decimal("5.00"))
+        Product.objects.create(category=cls.roots[0], title="Dear", slug="dear", price=Decimal("50.00"))
+
+    def setUp(self):
+        clear_caches()
+
+    def test_fresh_install(self):
+        banners = self.client.get("/api/banners").json()
+        self.assertEqual([b["category"] for b in banners], [c.pk for c in self.roots[:banners_module.DEFAULT_COUNT]])
+        self.assertEqual(banners[0]["price"], 5.0)
+        self.assertEqual(banners[1]["price"], 0)
+        self.assertTrue(banners[0]["images"][0]["src"].endswith(banners_module.DEFAULT_IMAGES[0]))
+
+    def test_configured_banners_replace_fallback(self):
+        self.client.get("/api/banners")
+        with self.captureOnCommitCallbacks(execute=True):
+            Banner.objects.create(category=self.roots[3], title="Sale")
+        banners = self.client.get("/api/banners").json()
+        self.assertEqual([(b["category"], b["title"]) for b in banners], [(self.roots[3].pk, "Sale")])
+
+        # все баннеры выключены — это настройка, а не свежая установка
+        with self.captureOnCommitCallbacks(execute=True):
+            Banner.objects.update(is_active=False)
+            banners_module.invalidate()
+        self.assertEqual(self.client.get("/api/banners").json(), [])
+
+
+class RendererTests(TestCase):
+    """FastJSONRenderer даёт те же байты, что JSONRenderer DRF; парсер — те же данные и ошибки."""
+
+    PAYLOAD = {
+        "price": Decimal("1234.50"),
+        "created_at": datetime(2026, 1, 2, 3, 4, 5, 123456, tzinfo=dt_timezone.utc),
+        "local": datetime(2026, 1, 2, 3, 4, 5, tzinfo=dt_timezone(timedelta(hours=3))),
+        "date": date(2026, 1, 2),
+        "id": uuid.UUID(int=42),
+        "title": "Ноутбук\u2028«Pro»",
+        1: [None, True, 1.5, {"nested": Decimal("0.1")}],
+    }
+
+    def render(self, renderer, data, accept="application/json"):
+        return renderer.render(data, accept, {})
+
+    def test_same_bytes(self):
+        fast, drf = renderers.FastJSONRenderer(), JSONRenderer()
+        for data in (self.PAYLOAD, [], {}, "строка", 2 ** 70):  # 2 ** 70 orjson не берёт
+            self.assertEqual(self.render(fast, data), self.render(drf, data))
+        self.assertEqual(self.render(fast, None), b"")
+
+    def test_indent_falls_back(self):
+        accept = "application/json; indent=4"
+        body = self.render(renderers.FastJSONRenderer(), self.PAYLOAD, accept)
+        self.assertEqual(body, self.render(JSONRenderer(), self.PAYLOAD, accept))
+        self.assertIn(b"\n    ", body)
+
+    def test_without_orjson(self):
+        with mock.patch.object(renderers, "orjson", None):
+            body = self.render(renderers.FastJSONRenderer(), self.PAYLOAD)
+        self.assertEqual(body, self.render(JSONRenderer(), self.PAYLOAD))
+
+    def test_parser(self):
+        fast, drf = renderers.FastJSONParser(), JSONParser()
+        for raw in ('{"id": 1, "count": 2.5, "title": "Ноутбук"}', '{"big": %d}' % 2 ** 70):
+            self.assertEqual(fast.parse(BytesIO(raw.encode())), drf.parse(BytesIO(raw.encode())))
+        with self.assertRaises(ParseError) as fast_error:
+            fast.parse(BytesIO(b'{"id": '))
+        with self.assertRaises(ParseError) as drf_error:
+            drf.parse(BytesIO(b'{"id": '))
+        self.assertEqual(str(fast_error.exception), str(drf_error.exception))
+
+    def test_api_response(self):
+        category = Category.objects.create(name="Root", slug="root")
+        for i in range(3):
+            Product.objects.create(
+                category=category, title=f"Товар {i}", slug=f"product-{i}", price=Decimal("99.90") + i,
+            )
+        response = self.client.get("/api/catalog", HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    @skipUnless(renderers.msgpack, "msgpack не установлен")
+    def test_msgpack(self):
+        # ключи-числа MessagePack сохраняет, JSON делает строками
+        payload = {key: value for key, value in self.PAYLOAD.items() if isinstance(key, str)}
+        body = self.render(renderers.MessagePackRenderer(), payload, "application/msgpack")
+        data = renderers.MessagePackParser().parse(BytesIO(body))
+        self.assertEqual(data, renderers.FastJSONParser().parse(BytesIO(self.render(JSONRenderer(), payload))))
+
+    def test_bench_command(self):
+        out = StringIO()
+        call_command("bench_renderers", rounds=1, products=3, orders=2, lines=2, stdout=out)
+        self.assertNotIn("DIFFERENT BYTES", out.getvalue())
+        self.assertEqual(out.getvalue().count("same bytes"), 3)
+        self.assertFalse(Product.objects.exists())
@@ -3,7 +3,7 @@ from .views import (
     CategoryListView, ProductListView, ProductFiltersView,
     LimitedProductsView, PopularProductsView,
     ProductDetailByIdView, ProductReviewCreateView,
-    TagListView, BannersView,
+    TagListView, BannersView, HomeView,
 )
 
 urlpatterns = [
@@ -13,6 +13,7 @@ urlpatterns = [
     path("products/limited", LimitedProductsView.as_view(), name="product-limited"),
     path("products/popular", PopularProductsView.as_view(), name="product-popular"),
     path("banners", BannersView.as_view(), name="banners"),
+    path("home", HomeView.as_view(), name="home"),
 
 
     path("product/<int:pk>/review", ProductReviewCreateView.as_view(), name="product-review"),
@@ -1,6 +1,9 @@
 # catalog/views.py
 
 import json
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models import Q, Count, Min, Max, F, Prefetch
 from django.db.models.functions import Coalesce
 from django.templatetags.static import static
@@ -14,14 +17,15 @@ from rest_framework.pagination import PageNumberPagination
 from math import ceil
 
 
-from .models import Product, Category, FeatureValue, Review, Tag
+from megano import diagnostics, responsecache
+from .models import Product, FeatureValue, Review, Tag
+from .pagination import KeysetPagination
+from . import banners, cards, categories, conditional, facets, home, rankings, search
 from .serializers import (
     CategorySerializer,
-    ProductShortSerializer,
     ProductFullSerializer,
     ReviewCreateSerializer,
     TagSerializer,
-    ProductImageSerializer,   # для префетча не нужен, но импорт не мешает
 )
 
 # --------- helpers ---------
@@ -37,57 +41,53 @@ class CategoryListView(ListAPIView):
     permission_classes = [permissions.AllowAny]
     pagination_class = None  # фронт ждёт простой массив
 
-    def get_queryset(self):
-        return (
-            Category.objects.filter(is_active=True, parent__isnull=True)
-            .prefetch_related('children')
-            .order_by('id')
-        )
+    def list(self, request, *args, **kwargs):
+        # дерево уже в памяти — запросов к БД нет
+        return Response(categories.get_tree().as_payload(request))
 
 class CatalogPagination(PageNumberPagination):
     page_size_query_param = "limit"  # фронт передаёт параметр limit
     page_query_param = "currentPage"  # фронт передаёт currentPage
     page_size = 20  # значение по умолчанию
 
+
+class CatalogCursorPagination(KeysetPagination):
+    """
+    Курсорный режим каталога (?pagination=cursor или ?cursor=...):
+    без COUNT(*) и OFFSET, ответ {items, nextCursor, prevCursor}.
+    """
+    page_size = CatalogPagination.page_size
+
+
 class ProductListView(ListAPIView):
     """
     GET /api/catalog — список товаров с фильтрами и пагинацией по Swagger.
+    По умолчанию currentPage/lastPage, курсорный режим — по запросу.
     """
-    serializer_class = ProductShortSerializer
     permission_classes = [permissions.AllowAny]
     pagination_class = CatalogPagination
+    cursor_pagination_class = CatalogCursorPagination
 
-    import json
+    def use_cursor_pagination(self):
+        params = self.request.query_params
+        return params.get("pagination") == "cursor" or "cursor" in params
 
-    def get_queryset(self):
-        qs = (
-            Product.objects
-            .select_related("category", "brand")
-            .prefetch_related("images", "tags", "feature_value")
-            .annotate(
-                reviews_count=Count("reviews", distinct=True),
-                popularity=Coalesce(F("purchases_count"), 0),
-            )
-        )
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            if self.use_cursor_pagination():
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
-        params = self.request.GET.copy()
-        # Поддержка поиска по названию товара
-        search_name = (
-                params.get('filter[name]') or
-                params.get('filter') or
-                params.get('name')
-        )
+    import json
 
-        if search_name:
-            print("SEARCH:", search_name)  # временно, чтобы убедиться
-            qs = qs.filter(title__icontains=search_name.strip())
+    def get_params(self):
+        params = self.request.GET.copy()
 
         # 🔹 Преобразуем filter[name], filter[minPrice] и т.д. в обычный словарь
-        filter_data = params.get('filter', {})
-        # поддержка поиска по названию ?filter=Asus
-        if isinstance(filter_data, str):
-            qs = qs.filter(title__icontains=filter_data)
-
+        filter_data = {}
         for key, value in params.items():
             if key.startswith("filter[") and key.endswith("]"):
                 field = key[len("filter["):-1]
@@ -95,18 +95,53 @@ class ProductListView(ListAPIView):
 
         # 🔹 Объединяем в один словарь для удобства
         params.update(filter_data)
+        return params, filter_data
 
+    @staticmethod
+    def get_subtree(params):
+        """id категории фильтра и её активных подкатегорий; None — без фильтра."""
         cat = params.get("category")
-        name = params.get("name")
+        if not cat:
+            return None
+        try:
+            return categories.get_tree().subtree_ids(int(cat))
+        except ValueError:
+            return ()
+
+    def get_queryset(self):
+        qs = (
+            Product.objects
+            .select_related("category", "brand")
+            .prefetch_related("images", "tags", "feature_value")
+            .annotate(
+                popularity=Coalesce(F("purchases_count"), 0),
+            )
+        )
+
+        params, filter_data = self.get_params()
+
+        # 🔹 Поиск: ?filter=Asus, ?filter[name]=..., ?name=... — один запрос к FTS-индексу
+        search_terms = []
+        for value in params.getlist("filter") + params.getlist("name"):
+            value = value.strip()
+            if value and value not in search_terms:
+                search_terms.append(value)
+        search_text = " ".join(search_terms)
+
+        subtree = self.get_subtree(params)
         min_price = params.get("minPrice")
         max_price = params.get("maxPrice")
         free_delivery = _parse_bool(params.get("freeDelivery"))
         available = _parse_bool(params.get("available"))
 
-        if cat:
-            qs = qs.filter(category_id=cat)
-        if name:
-            qs = qs.filter(title__icontains=name)
+        if search_text:
+            qs = search.filter_queryset(qs, search_text)
+        if subtree is not None:
+            # категория вместе со всеми активными подкатегориями — одним IN
+            if len(subtree) == 1:
+                qs = qs.filter(category_id=subtree[0])
+            else:
+                qs = qs.filter(category_id__in=subtree)
         if min_price:
             qs = qs.filter(price__gte=min_price)
         if max_price:
@@ -114,14 +149,11 @@ class ProductListView(ListAPIView):
         if free_delivery:
             qs = qs.filter(free_delivery=True)
         if available:
-            qs = qs.filter(count__gt=0)
-            # поддержка поиска по полю title (?filter=MacBook)
-            search_text = params.get("filter")
-            if search_text:
-                qs = qs.filter(title__icontains=search_text)
-
-        # 🔹 Сортировка
-        sort_field = params.get("sort", "date")
+            # свободный остаток: без удержанных корзинами единиц
+            qs = qs.filter(count__gt=F("reserved_count"))
+
+        # 🔹 Сортировка (при поиске без явного sort — по релевантности)
+        sort_field = params.get("sort", "relevance" if search_text else "date")
         sort_type = params.get("sortType", "dec")
 
         mapping = {
@@ -131,92 +163,120 @@ class ProductListView(ListAPIView):
             "date": "created_at",
         }
 
+        if sort_field == "relevance" and search_text:
+            qs = search.annotate_rank(qs, search_text)
+            if "search_rank" in qs.query.annotations:
+                qs = qs.order_by("search_rank", "-id")
+
         if sort_field in mapping:
+            # id сортируется в ту же сторону, что и поле, — тогда один
+            # составной индекс (поле, id) обслуживает оба направления
             field = mapping[sort_field]
             if sort_type == "dec":
-                field = f"-{field}"
-            qs = qs.order_by(field, "-id")
-
-        print("FILTER DATA:", filter_data)
-        print("FINAL PARAMS:", params)
-        print("RESULT COUNT:", qs.count())
-        print("ALL PRODUCTS COUNT:", Product.objects.count())
-        print("ACTIVE PRODUCTS COUNT:", Product.objects.filter(count__gt=0).count())
-
+                qs = qs.order_by(f"-{field}", "-id")
+            else:
+                qs = qs.order_by(field, "id")
+
+        diagnostics.record(
+            self.request,
+            catalog_filters=filter_data,
+            catalog_search=search_text,
+            catalog_sort=[sort_field, sort_type],
+        )
         return qs
 
+    def get_rows(self, queryset):
+        """
+        Страница — только id (и поля сортировки, по ним строится курсор);
+        карточки берутся из кеша catalog/cards.py.
+        """
+        order_fields = [f.lstrip("-") for f in queryset.query.order_by if f.lstrip("-") != "id"]
+        return queryset.select_related(None).prefetch_related(None).values("id", *order_fields)
+
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
+        # ETag по версиям каталога — 304 до запроса страницы (catalog/conditional.py)
+        validators = None
+        subtree = self.get_subtree(self.get_params()[0])
+        if conditional.applies(request):
+            validators = conditional.catalog_validators(request, subtree)
+            response = conditional.not_modified(request, *validators)
+            if response is not None:
+                return response
+        response = self.build_list(request)
+        # теги для кеша ответов (megano/responsecache.py)
+        if subtree is None:
+            responsecache.add_tags(response, "catalog")
+        else:
+            responsecache.add_tags(response, "categories", *[f"category:{pk}" for pk in subtree])
+        return conditional.set_validators(response, *validators) if validators else response
+
+    def build_list(self, request):
+        queryset = self.get_rows(self.get_queryset())
         page = self.paginate_queryset(queryset)
 
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
+            items = cards.get_cards([row["id"] for row in page], request)
             pagination = self.paginator
+            if isinstance(pagination, KeysetPagination):
+                diagnostics.record(request, catalog_page_items=len(page))
+                return pagination.get_paginated_response(items)
+            # count уже посчитан пагинатором — отдельный COUNT не нужен
+            diagnostics.record(request, catalog_result_count=pagination.page.paginator.count)
             return Response({
-                "items": serializer.data,
+                "items": items,
                 "currentPage": pagination.page.number,
                 "lastPage": pagination.page.paginator.num_pages,
             })
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response({"items": serializer.data})
+        return Response({"items": cards.get_cards([row["id"] for row in queryset], request)})
 
 
-# --------- фильтры каталога (минимум бренды/цены) ---------
+# --------- фильтры каталога (фасеты из памяти) ---------
 class ProductFiltersView(APIView):
     """
-    GET /api/products/filters/ — бренды и мин/макс цены (для фронта).
+    GET /api/products/filters/ — бренды, мин/макс цены, гистограмма цен,
+    счётчики freeDelivery/available и теги. ?category= — по категории
+    вместе с подкатегориями.
     """
     permission_classes = [permissions.AllowAny]
 
     def get(self, request):
-        agg = Product.objects.aggregate(
-            min_price=Min("price"),
-            max_price=Max("price"),
-        )
-        # бренды с количеством товаров
-        brands_qs = (
-            Product.objects.values("brand__name")
-            .annotate(products_count=Count("id"))
-            .order_by("brand__name")
-        )
-        brands = [
-            {"name": b["brand__name"] or "", "products_count": b["products_count"]}
-            for b in brands_qs
-        ]
-        data = {"brands": brands, "min_price": agg["min_price"] or 0, "max_price": agg["max_price"] or 0}
-        return Response(data)
+        category = request.query_params.get("category")
+        try:
+            category_id = int(category) if category else facets.ALL
+        except ValueError:
+            return Response({"detail": "category must be an integer"}, status=400)
+        return Response(facets.get_facets(category_id))
 
 
 # --------- популярные/лимитированные (ProductShort) ---------
 class LimitedProductsView(ListAPIView):
-    serializer_class = ProductShortSerializer
+    """
+    GET /api/products/limited — готовый список id из catalog/rankings.py,
+    карточки из кеша catalog/cards.py.
+    """
     permission_classes = [permissions.AllowAny]
     pagination_class = None
 
-    def get_queryset(self):
-        return (
-            Product.objects
-            .filter(is_limited=True, category__is_active=True)
-            .select_related("category", "brand")
-            .prefetch_related("images", "tags")
-            .order_by("-id")[:12]
-        )
+    def list(self, request, *args, **kwargs):
+        return Response(cards.get_cards(rankings.limited_ids(), request))
 
 
 class PopularProductsView(ListAPIView):
-    serializer_class = ProductShortSerializer
+    """
+    GET /api/products/popular[?category=] — готовый список id из
+    catalog/rankings.py (общий или по категории), карточки из кеша catalog/cards.py.
+    """
     permission_classes = [permissions.AllowAny]
     pagination_class = None
 
-    def get_queryset(self):
-        return (
-            Product.objects
-            .filter(category__is_active=True)
-            .select_related("category", "brand")
-            .prefetch_related("images", "tags")
-            .order_by("-purchases_count")[:12]
-        )
+    def list(self, request, *args, **kwargs):
+        category = request.query_params.get("category")
+        try:
+            category_id = int(category) if category else None
+        except ValueError:
+            category_id = None
+        return Response(cards.get_cards(rankings.popular_ids(category_id), request))
 
 
 # --------- теги ---------
@@ -228,10 +288,26 @@ class TagListView(ListAPIView):
 
 # --------- детальная карточка (ProductFull) ---------
 class ProductDetailByIdView(RetrieveAPIView):
+    """
+    GET /api/product/<id> — ETag/Last-Modified по Product.updated_at:
+    на If-None-Match 304 отдаётся до основного запроса и сериализации.
+    """
     serializer_class = ProductFullSerializer
     lookup_field = "pk"
     permission_classes =  [permissions.AllowAny]
 
+    def retrieve(self, request, *args, **kwargs):
+        validators = None
+        if conditional.applies(request):
+            validators = conditional.product_validators(request, kwargs[self.lookup_field])
+        if validators is not None:
+            response = conditional.not_modified(request, *validators)
+            if response is not None:
+                return response
+        response = super().retrieve(request, *args, **kwargs)
+        responsecache.add_tags(response, f"product:{kwargs[self.lookup_field]}")
+        return conditional.set_validators(response, *validators) if validators else response
+
     def get_queryset(self):
         reviews_qs = Review.objects.select_related("user").order_by("-created_at")
 
@@ -270,41 +346,54 @@ class ProductReviewCreateView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         product = self.get_product()
-        serializer.save(product=product, user=self.request.user)
+        # отзыв и пересчёт reviews_count/rating (сигнал) — одной транзакцией
+        with transaction.atomic():
+            serializer.save(product=product, user=self.request.user)
 
 
 # --------- баннеры для главной ---------
 class BannersView(APIView):
+    """
+    GET /api/banners — баннеры из модели Banner, цена «от» по поддереву
+    категории; в тёплом состоянии отдаётся из памяти без запросов.
+    """
     permission_classes = [permissions.AllowAny]
 
     def get(self, request, *args, **kwargs):
-        static_imgs = [
-            "frontend/assets/img/content/home/slider.png",
-            "frontend/assets/img/content/home/bigGoods.png",
-            "frontend/assets/img/content/home/videoca.png",
-        ]
-
-        categories = (
-            Category.objects
-            .filter(is_active=True, parent__isnull=True)
-            .order_by("id")[:3]
-        )
+        return Response(banners.get_banners())
+
 
-        banners = []
-        for i, cat in enumerate(categories):
-            # находим минимальную цену среди всех товаров в категории
-            products = Product.objects.filter(category=cat)
-            min_price = products.aggregate(Min("price"))["price__min"]
-
-            img_path = static_imgs[i % len(static_imgs)]
-            banners.append({
-                "id": cat.id,
-                "title": cat.name,
-                "price": min_price or 0,
-                "images": [{"src": static(img_path), "alt": cat.name}],
-                "link": f"/catalog?category={cat.id}",
-                "category": cat.id,
-                "category_slug": getattr(cat, "slug", "") or "",
-            })
 
-        return Response(banners)
\ No newline at end of file
+# --------- главная страница одним запросом ---------
+class HomeView(APIView):
+    """
+    GET /api/home — categories, banners, popular, limited и tags одним ответом.
+    Популярные и лимитированные — карточки из кеша catalog/cards.py;
+    результат кешируется целиком, ETag — по хешу данных (catalog/home.py).
+    """
+    permission_classes = [permissions.AllowAny]
+    cache_timeout = getattr(settings, "CATALOG_HOME_CACHE_TTL", 60)
+
+    def build(self, request):
+        popular_ids = rankings.popular_ids()
+        limited_ids = rankings.limited_ids()
+        return {
+            "categories": categories.get_tree().as_payload(request),
+            "banners": banners.get_banners(),
+            "popular": cards.get_cards(popular_ids, request),
+            "limited": cards.get_cards(limited_ids, request),
+            "tags": TagSerializer(Tag.objects.order_by("name"), many=True).data,
+        }
+
+    def get(self, request, *args, **kwargs):
+        key = home.cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            data = self.build(request)
+            entry = {"data": data, "digest": home.digest(data)}
+            cache.set(key, entry, self.cache_timeout)
+
+        etag = home.etag(request, entry["digest"])
+        if home.not_modified(request, etag):
+            return Response(status=304, headers={"ETag": etag})
+        return Response(entry["data"], headers={"ETag": etag})
@@ -0,0 +1,101 @@
+"""
+Диагностика SQL по запросу.
+
+Для выбранного запроса (пришёл разрешённый заголовок диагностики или
+включена выборка и запрос в неё попал) замеряется каждый SQL-запрос, а в
+логгер ``megano.diagnostics`` пишется одна JSON-строка вместе с полями,
+которые view добавила через ``record()``. Остальные запросы проходят без
+изменений.
+
+Настройки — ``settings.QUERY_DIAGNOSTICS``:
+
+    ENABLED       писать выборку запросов с долей SAMPLE_RATE
+    SAMPLE_RATE   доля записываемых запросов при ENABLED (0.0 - 1.0)
+    HEADER        заголовок, включающий запись для одного запроса
+    ALLOW_HEADER  учитывать HEADER вообще (на публичном сервере — выключено)
+    SLOW_QUERIES  сколько самых медленных SQL-запросов включать в строку
+"""
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger("megano.diagnostics")
+
+DEFAULTS = {
+    "ENABLED": False,
+    "SAMPLE_RATE": 0.0,
+    "HEADER": "X-Query-Diagnostics",
+    "ALLOW_HEADER": False,
+    "SLOW_QUERIES": 5,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "QUERY_DIAGNOSTICS", {})}
+
+
+def record(request, **fields):
+    """Добавляет поля к диагностике текущего запроса (если она выключена — ничего)."""
+    data = getattr(request, "_diagnostics", None)
+    if data is not None:
+        data.update(fields)
+
+
+class QueryRecorder:
+    """Обёртка для ``connection.execute_wrapper``: собирает пары (sql, длительность)."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+
+class QueryDiagnosticsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = get_config()
+        self.sample_rate = config["SAMPLE_RATE"] if config["ENABLED"] else 0.0
+        self.header = config["HEADER"] if config["ALLOW_HEADER"] else None
+        self.slow_queries = config["SLOW_QUERIES"]
+
+    def should_record(self, request):
+        if self.header and request.headers.get(self.header):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if not self.should_record(request):
+            return self.get_response(request)
+
+        request._diagnostics = {}
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        slowest = sorted(recorder.queries, key=lambda q: q[1], reverse=True)
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "params": {k: request.GET.getlist(k) for k in request.GET},
+            "status": response.status_code,
+            "duration_ms": round(elapsed * 1000, 2),
+            "queries": len(recorder.queries),
+            "sql_ms": round(sum(d for _, d in recorder.queries) * 1000, 2),
+            "slowest": [
+                {"sql": sql[:500], "ms": round(d * 1000, 2)}
+                for sql, d in slowest[: self.slow_queries]
+            ],
+            **request._diagnostics,
+        }, default=str, ensure_ascii=False))
+        return response
@@ -0,0 +1,121 @@
+"""
+Быстрые рендереры и парсеры API.
+
+JSONRenderer DRF кодирует через stdlib ``json`` и для каждой цены
+(Decimal) и даты вызывает Python-колбэк ``JSONEncoder.default``.
+FastJSONRenderer берёт orjson, если он установлен: даты, UUID и
+dataclass кодируются в C, Decimal — одним колбэком. Для ответов API
+байты те же, что у JSONRenderer с настройками проекта (компактно, UTF-8,
+``Z`` для UTC, U+2028/U+2029 экранированы). Без orjson, для ответа с
+отступами (``Accept: application/json; indent=4``, browsable API) и для
+данных, которые orjson не принимает (целые больше 64 бит), работает
+обычный JSONRenderer.
+
+FastJSONParser разбирает тело запроса через orjson, а всё, что orjson
+отверг, отдаёт стандартному парсеру — сообщения об ошибках и крайние
+случаи (огромные целые) не меняются.
+
+MessagePackRenderer и MessagePackParser добавляют ``application/msgpack``
+для клиентов с ``Accept: application/msgpack``. Нужен необязательный
+пакет ``msgpack``; в настройках классы появляются, только если он
+установлен. Decimal упаковывается как float, даты — теми же строками,
+что в JSON, поэтому оба формата несут одинаковые значения.
+
+Выбираются в ``REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES']`` и
+``DEFAULT_PARSER_CLASSES``; ``manage.py bench_renderers`` сравнивает их.
+"""
+import io
+from decimal import Decimal
+
+from django.conf import settings
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # необязательная зависимость
+    msgpack = None
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    """Типы, которых не знают быстрые кодировщики, — так же, как JSONEncoder DRF."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return _encoder.default(obj)
+
+
+# ==============================
+# JSON
+# ==============================
+class FastJSONRenderer(renderers.JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=_default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # как JSONRenderer: вывод остаётся строгим подмножеством JavaScript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        parser_context = parser_context or {}
+        raw = stream.read()
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if encoding.lower().replace('-', '') == 'utf8':
+            try:
+                return orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                pass
+        # другие кодировки и битое тело — стандартный парсер и его сообщение об ошибке
+        return super().parse(io.BytesIO(raw), media_type, parser_context)
+
+
+# ==============================
+# MessagePack
+# ==============================
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # datetime=False: даты проходят через _default и становятся ISO-строками, как в JSON
+        return msgpack.packb(data, default=_default, use_bin_type=True, datetime=False)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except ValueError as exc:
+            raise ParseError(f'MessagePack parse error - {exc or type(exc).__name__}')
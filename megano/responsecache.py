@@ -0,0 +1,327 @@
+"""
+Серверный кеш ответов анонимным GET.
+
+Эндпоинты каталога отдают всем анонимным посетителям одни и те же байты,
+поэтому ResponseCacheMiddleware сохраняет отрендеренный ответ и отдаёт его
+повторно, не вызывая view, сериализаторы и запросы к таблицам каталога.
+Кешируются только URL с именами из ``ROUTES`` и только если:
+
+* метод GET;
+* пользователь анонимный и заголовка Authorization нет;
+* ответ 200 с разрешённым Content-Type (не HTML browsable API — в нём
+  CSRF-токен).
+
+Ключ — маршрут, схема, хост, путь, заголовок Accept и нормализованная
+строка запроса. normalize_query() сортирует параметры и сворачивает
+``filter[x]`` в ``x`` так же, как их читают view каталога, поэтому
+``?filter[name]=a`` и ``?name=a`` попадают в одну запись.
+
+У записей есть теги: статические у маршрута (``ROUTES``) и добавленные
+view через add_tags(), например ``category:7`` или ``product:42``. Версия
+тега — метка времени в том же кеше. Запись помнит версии своих тегов и
+устаревает, как только любая из них сдвинется. invalidate() сдвигает их,
+так что правка одного товара сбрасывает только записи, где он есть.
+Каталог вызывает invalidate() после коммита (catalog/conditional.py,
+catalog/signals.py) — в том числе из фонового воркера (catalog/tasks.py).
+
+Пропавшую запись пересчитывает один запрос, остальные ждут его
+(single-flight). Блокировка — ключ ``cache.add()``; ожидающие опрашивают
+кеш до ``WAIT`` секунд и забирают пересчёт себе, если блокировка исчезла
+без записи. Пауза между опросами растёт вдвое от ``POLL_INTERVAL`` до
+``MAX_POLL_INTERVAL``: быстрый пересчёт забирается сразу, а долгий не
+стоит общему кешу десятков чтений в секунду на каждый ждущий запрос. Попадания, промахи, устаревшие записи и дождавшиеся запросы
+считаются в процессе и пачками сбрасываются в кеш, поэтому ``manage.py
+responsecache_stats`` показывает их по всем процессам. Каждый ответ
+несёт ``X-Cache: HIT`` или ``MISS``.
+
+Бэкенд (``CACHE``) — алиас из ``settings.CACHES``, общий для всех
+процессов: база данных, Redis, memcached. Версии тегов, записи и счётчики
+должны видеть и веб-воркеры, и runworker, поэтому с LocMemCache middleware
+не включается (ImproperlyConfigured).
+
+Настройки — ``settings.RESPONSE_CACHE``.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe, urlencode
+
+from megano import diagnostics
+
+DEFAULTS = {
+    "ENABLED": True,
+    "CACHE": "shared",           # алиас в settings.CACHES, общий для процессов
+    "TIMEOUT": 300,              # сек. жизни записи, даже если теги не двигались
+    "ROUTES": {},                # имя URL -> статические теги
+    "CONTENT_TYPES": ("application/json", "application/msgpack"),
+    "LOCK_TIMEOUT": 10,          # сек., сколько пересчёт держит блокировку single-flight
+    "WAIT": 2,                   # сек., сколько запрос ждёт чужой пересчёт
+    "POLL_INTERVAL": 0.02,       # сек., первая пауза между опросами, дальше вдвое больше
+    "MAX_POLL_INTERVAL": 0.25,   # сек., предел паузы
+    "HEADER": "X-Cache",
+    "STATS_FLUSH": 100,          # событий до сброса счётчиков в кеш
+}
+
+PREFIX = "responsecache"
+CONDITIONAL_HEADERS = ("HTTP_IF_NONE_MATCH", "HTTP_IF_MODIFIED_SINCE")
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "RESPONSE_CACHE", {})}
+
+
+def get_cache():
+    return caches[get_config()["CACHE"]]
+
+
+# ==============================
+# Ключи и теги
+# ==============================
+def normalize_query(query_dict):
+    """
+    Каноническая строка запроса: ``filter[x]`` свёрнут в ``x`` (после обычных
+    значений, только последнее — как их сливают view каталога), ключи
+    отсортированы, порядок повторяющихся значений сохранён.
+    """
+    params = query_dict.copy()
+    aliases = {}
+    for key in list(params):
+        if key.startswith("filter[") and key.endswith("]"):
+            aliases[key[len("filter["):-1]] = params[key]
+            del params[key]
+    params.update(aliases)
+    return urlencode(sorted(params.lists()), doseq=True)
+
+
+def add_tags(response, *tags):
+    """Теги ответа view — в дополнение к статическим тегам маршрута."""
+    response.cache_tags = [*getattr(response, "cache_tags", []), *tags]
+    return response
+
+
+def _tag_key(tag):
+    return f"{PREFIX}:tag:{tag}"
+
+
+def tag_versions(tags, cache=None, default=None):
+    """
+    {тег: версия}. Тегам без версии достаётся ``default`` (кладётся в кеш,
+    если никто не успел раньше), при default=None они пропускаются.
+    """
+    cache = cache or get_cache()
+    keys = {tag: _tag_key(tag) for tag in tags}
+    found = cache.get_many(keys.values())
+    missing = [key for key in keys.values() if key not in found]
+    if missing and default is not None:
+        for key in missing:
+            cache.add(key, default, None)
+        found.update(cache.get_many(missing))
+    return {tag: found[key] for tag, key in keys.items() if key in found}
+
+
+def invalidate(*tags):
+    """Все записи с любым из этих тегов устаревают."""
+    if tags and get_config()["ENABLED"]:
+        now = time.time_ns()
+        get_cache().set_many({_tag_key(tag): now for tag in tags}, None)
+
+
+# ==============================
+# Метрики
+# ==============================
+class Metrics:
+    """Счётчики процесса; пачками добавляются к общим счётчикам в кеше."""
+
+    NAMES = ("hit", "miss", "stale", "coalesced", "store", "skip")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = Counter()
+
+    def count(self, name):
+        with self._lock:
+            self._pending[name] += 1
+            if sum(self._pending.values()) < get_config()["STATS_FLUSH"]:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        cache = get_cache()
+        for name, value in pending.items():
+            key = f"{PREFIX}:stats:{name}"
+            cache.add(key, 0, None)
+            try:
+                cache.incr(key, value)
+            except ValueError:  # вытеснен между add() и incr()
+                cache.set(key, value, None)
+
+    def totals(self):
+        """Общие счётчики плюс ещё не сброшенные счётчики этого процесса."""
+        stored = get_cache().get_many([f"{PREFIX}:stats:{name}" for name in self.NAMES])
+        with self._lock:
+            pending = Counter(self._pending)
+        return {name: stored.get(f"{PREFIX}:stats:{name}", 0) + pending[name] for name in self.NAMES}
+
+    def reset(self):
+        with self._lock:
+            self._pending.clear()
+        get_cache().delete_many([f"{PREFIX}:stats:{name}" for name in self.NAMES])
+
+
+metrics = Metrics()
+
+
+# ==============================
+# Middleware
+# ==============================
+class ResponseCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = get_config()
+        if not config["ENABLED"]:
+            raise MiddlewareNotUsed
+        self.alias = config["CACHE"]
+        if isinstance(caches[self.alias], LocMemCache):
+            raise ImproperlyConfigured(
+                f"RESPONSE_CACHE['CACHE'] = {self.alias!r} is a per-process LocMemCache: "
+                "tag versions moved by other processes would never reach it. "
+                "Use a cache shared by all processes (database, Redis, memcached)."
+            )
+        self.routes = config["ROUTES"]
+        self.timeout = config["TIMEOUT"]
+        self.content_types = tuple(config["CONTENT_TYPES"])
+        self.lock_timeout = config["LOCK_TIMEOUT"]
+        self.wait = config["WAIT"]
+        self.poll_interval = config["POLL_INTERVAL"]
+        self.max_poll_interval = config["MAX_POLL_INTERVAL"]
+        self.header = config["HEADER"]
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # выставляет process_view() при промахе
+        state = getattr(request, "_response_cache", None)
+        if state is None:
+            return response
+        try:
+            if self.store(request, response, state):
+                metrics.count("store")
+            else:
+                metrics.count("skip")
+        finally:
+            if state["locked"]:
+                self.cache.delete(state["key"] + ":lock")
+        diagnostics.record(request, response_cache="miss")
+        return self.conditional(request, response, "MISS", state["conditional"])
+
+    @property
+    def cache(self):
+        # соединения с кешем — свои у каждого потока
+        return caches[self.alias]
+
+    def cacheable(self, request):
+        match = request.resolver_match
+        if request.method != "GET" or match is None or match.url_name not in self.routes:
+            return False
+        return "Authorization" not in request.headers and not request.user.is_authenticated
+
+    def make_key(self, request):
+        raw = "|".join([
+            request.scheme,
+            request.get_host(),
+            request.path,
+            request.headers.get("Accept", "").replace(" ", ""),
+            normalize_query(request.GET),
+        ])
+        return f"{PREFIX}:{request.resolver_match.url_name}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.cacheable(request):
+            return None
+        key = self.make_key(request)
+        entry = self.cache.get(key)
+        if entry is not None:
+            if self.is_fresh(entry):
+                metrics.count("hit")
+                return self.replay(request, entry)
+            metrics.count("stale")
+
+        # single flight: пересчитывает один запрос, остальные ждут его запись
+        locked = self.cache.add(key + ":lock", 1, self.lock_timeout)
+        if not locked:
+            deadline = time.monotonic() + self.wait
+            delay = self.poll_interval
+            while True:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                time.sleep(min(delay, left))
+                delay = min(delay * 2, self.max_poll_interval)
+                entry = self.cache.get(key)
+                if entry is not None and self.is_fresh(entry):
+                    metrics.count("coalesced")
+                    return self.replay(request, entry)
+                if self.cache.add(key + ":lock", 1, self.lock_timeout):
+                    # другой запрос закончил, не сохранив запись (ошибка, 304): пересчитываем сами
+                    locked = True
+                    break
+        metrics.count("miss")
+        request._response_cache = {
+            "key": key,
+            "locked": locked,
+            "started": time.time_ns(),
+            # для записи view должна отдать полный 200; на If-* ответим после
+            "conditional": {name: request.META.pop(name) for name in CONDITIONAL_HEADERS if name in request.META},
+        }
+        return None
+
+    def is_fresh(self, entry):
+        tags = entry["tags"]
+        return not tags or tag_versions(tags, self.cache) == tags
+
+    def store(self, request, response, state):
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return False
+        if not response.get("Content-Type", "").startswith(self.content_types):
+            return False
+        match = request.resolver_match
+        tags = [*self.routes[match.url_name], *getattr(response, "cache_tags", [])]
+        # нетронутые теги считаются изменёнными перед вызовом view; тег, сдвинутый
+        # во время вызова, значит, что тело уже могло устареть — не сохраняем
+        versions = tag_versions(dict.fromkeys(tags), self.cache, default=state["started"] - 1)
+        if len(versions) != len(set(tags)) or any(v >= state["started"] for v in versions.values()):
+            return False
+        self.cache.set(state["key"], {
+            "content": response.content,
+            "headers": list(response.items()),
+            "tags": versions,
+        }, self.timeout)
+        return True
+
+    def replay(self, request, entry):
+        response = HttpResponse(entry["content"])
+        for name, value in entry["headers"]:
+            response.headers[name] = value
+        diagnostics.record(request, response_cache="hit")
+        return self.conditional(request, response, "HIT")
+
+    def conditional(self, request, response, outcome, headers=None):
+        """304 клиенту, у которого уже есть этот ETag / Last-Modified; ставит X-Cache."""
+        if headers:
+            request.META.update(headers)
+        if response.status_code == 200:
+            last_modified = parse_http_date_safe(response.get("Last-Modified", ""))
+            response = get_conditional_response(
+                request, etag=response.get("ETag"), last_modified=last_modified, response=response
+            )
+        response.headers[self.header] = outcome
+        return response
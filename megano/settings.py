@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import importlib.util
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,16 +44,19 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'catalog.apps.CatalogConfig',
     'orders',
+    'taskqueue.apps.TaskQueueConfig',
     'corsheaders',
 ]
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'megano.diagnostics.QueryDiagnosticsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'megano.responsecache.ResponseCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -84,6 +88,15 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # checkout пишет в транзакции: берём блокировку записи сразу и ждём её,
+        # а не падаем с "database is locked" при повышении уровня блокировки
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # тестовая база — файл: в общей памяти (по умолчанию) параллельные
+        # транзакции сразу падают с "table is locked" вместо ожидания блокировки
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -129,10 +142,25 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Рендерер/парсер JSON на orjson (megano/renderers.py); без orjson — стандартные DRF.
+# application/msgpack (Accept/Content-Type) — только если установлен msgpack.
+_MSGPACK = importlib.util.find_spec('msgpack') is not None
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'COERCE_DECIMAL_TO_STRING': False,
+    'DEFAULT_RENDERER_CLASSES': [
+        'megano.renderers.FastJSONRenderer',
+        *(['megano.renderers.MessagePackRenderer'] if _MSGPACK else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'megano.renderers.FastJSONParser',
+        *(['megano.renderers.MessagePackParser'] if _MSGPACK else []),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 CORS_ALLOWED_ORIGINS = [
@@ -152,3 +180,133 @@ CSRF_TRUSTED_ORIGINS = [
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Фасеты /api/products/filters (catalog/facets.py)
+CATALOG_FACETS_TTL = 300  # сек., страховка для согласованности между процессами
+CATALOG_FACETS_HISTOGRAM_BINS = 10
+
+# Диагностика SQL по запросу (megano/diagnostics.py)
+QUERY_DIAGNOSTICS = {
+    'ENABLED': False,        # выборочная запись SAMPLE_RATE доли запросов
+    'SAMPLE_RATE': 0.01,
+    'HEADER': 'X-Query-Diagnostics',
+    'ALLOW_HEADER': DEBUG,   # заголовок учитывается только в DEBUG
+    'SLOW_QUERIES': 5,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'diagnostics': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'megano.diagnostics': {'handlers': ['diagnostics'], 'level': 'INFO', 'propagate': False},
+        'taskqueue': {'handlers': ['diagnostics'], 'level': 'INFO', 'propagate': False},
+    },
+}
+CATALOG_HOME_CACHE_TTL = 60  # сек., кеш ответа /api/home
+
+# Рейтинги популярных/лимитированных товаров (catalog/rankings.py)
+CATALOG_RANKINGS = {
+    'SIZE': 12,
+    'TTL': 300,
+    'REFRESH_THRESHOLD': 100,
+}
+
+# Кеш карточек товаров ProductShort по id (catalog/cards.py)
+CATALOG_CARDS = {
+    'TTL': 300,
+    'VERSION_TTL': 3600,
+}
+
+# Кеши. 'default' — память процесса, только для того, что можно потерять
+# и пересчитать локально. 'shared' — общий для всех процессов (веб-воркеры и
+# runworker): версии каталога, теги и записи кеша ответов, счётчики.
+# 'card_versions' — тоже общий, версии карточек по одной на товар: отдельно,
+# чтобы их вытеснение не задевало версии и теги в 'shared'. Таблицы
+# создаются `python manage.py createcachetable`; в продакшене лучше Redis:
+# 'shared': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#            'LOCATION': 'redis://localhost:6379/2'},
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'megano_cache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    'card_versions': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'megano_card_versions',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+# Кеш ответов каталога для анонимных GET (megano/responsecache.py). CACHE —
+# алиас из CACHES, общий для всех процессов (LocMemCache не допускается).
+# Теги сбрасываются сигналами.
+RESPONSE_CACHE = {
+    'CACHE': 'shared',
+    'TIMEOUT': 300,
+    'ROUTES': {
+        'product-list': [],
+        'product-detail-by-id': [],
+        'category-list': ['categories'],
+        'tag-list': ['tags'],
+        'banners': ['banners'],
+    },
+}
+
+# Кеш строк корзины в общем кеше (orders/views.py); товары — из кеша карточек
+BASKET_CACHE_TTL = 300
+
+# Хранилище корзины (orders/cart.py). ORMCartStorage — таблица CartItem;
+# KeyValueCartStorage — хеши с TTL в памяти процесса или в Redis ('url').
+CART_STORAGE = {
+    'BACKEND': 'orders.cart.ORMCartStorage',
+    'OPTIONS': {},
+    # 'BACKEND': 'orders.cart.KeyValueCartStorage',
+    # 'OPTIONS': {'url': 'redis://localhost:6379/1', 'ttl': 7 * 24 * 3600},
+    # корзина гостей в подписанной cookie — без строк в django_session:
+    # 'GUEST_BACKEND': 'orders.cart.SignedCookieCartStorage',
+    # 'GUEST_OPTIONS': {'max_lines': 30},
+}
+
+# Заголовок Idempotency-Key для оформления и оплаты заказов (orders/idempotency.py)
+IDEMPOTENCY = {
+    'TTL': 24 * 3600,
+    'LOCK_TIMEOUT': 60,
+    'LRU_SIZE': 1024,
+}
+
+# Резерв товара при добавлении в корзину (orders/reservations.py);
+# просроченные снимает фоновая задача (runworker) или
+# `python manage.py release_expired_reservations`
+STOCK_RESERVATIONS = {
+    'TTL': 15 * 60,
+    'BATCH_SIZE': 500,
+}
+
+# Оплата заказов в фоне (orders/payments.py, задача orders.tasks.charge_payment). FakePaymentGateway — локальная
+# заглушка платёжного шлюза: случайная задержка, сбои и отказы.
+PAYMENTS = {
+    'GATEWAY': 'orders.payments.FakePaymentGateway',
+    'OPTIONS': {'latency': (0.2, 1.5), 'failure_rate': 0.1, 'decline_rate': 0.05},
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 2.0,
+    'LEASE': 60,
+}
+
+# Фоновые задачи в таблице БД (taskqueue/queue.py); обработчики —
+# `python manage.py runworker`, статистика — `python manage.py taskstats`
+TASK_QUEUE = {
+    'WORKERS': 2,
+    'BATCH_SIZE': 10,
+    'POLL_INTERVAL': 0.5,
+    'LEASE': 300,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 2.0,
+}
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import CartItem, Order, OrderItem
+from .models import CartItem, IdempotencyKey, Order, OrderItem, Payment, StockReservation
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
@@ -52,3 +52,34 @@ class OrderItemAdmin(admin.ModelAdmin):
     search_fields = ('order__id', 'product__title')
     list_filter = ('order__status', )
     ordering = ('-order__created_at', )
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('key', 'scope', 'status_code', 'created_at', 'expires_at')
+    search_fields = ('key', 'scope')
+    readonly_fields = ('scope', 'key', 'fingerprint', 'status_code', 'response', 'created_at', 'expires_at')
+    ordering = ('-created_at', )
+    list_per_page = 50
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('product', 'owner', 'qty', 'expires_at')
+    list_select_related = ('product', )
+    search_fields = ('product__title', 'owner')
+    readonly_fields = ('product', 'owner', 'qty', 'expires_at')
+    ordering = ('expires_at', )
+    list_per_page = 50
+
+
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order', 'amount', 'status', 'attempts', 'next_attempt_at', 'created_at')
+    list_filter = ('status', )
+    list_select_related = ('order', )
+    search_fields = ('order__id', 'transaction_id')
+    readonly_fields = ('order', 'amount', 'attempts', 'transaction_id', 'last_error',
+                       'locked_until', 'created_at', 'updated_at')
+    ordering = ('-created_at', )
+    list_per_page = 50
@@ -0,0 +1,488 @@
+"""
+Cart storage backends.
+
+The basket and checkout talk to a storage object instead of the CartItem
+table directly. Two implementations ship with the project:
+
+* ``ORMCartStorage`` - the original behaviour, one CartItem row per line.
+* ``KeyValueCartStorage`` - carts as hashes with a TTL in a Redis-style
+  key-value store. By default this is an in-process store. With
+  ``OPTIONS['url']`` it uses a real Redis server through redis-py. Basket
+  traffic never touches the relational DB, and CartItem rows are not
+  written at all: checkout turns the lines straight into OrderItems.
+
+* ``SignedCookieCartStorage`` - guest carts only: the lines live in a
+  signed cookie, so anonymous shoppers need neither a session row nor
+  any server-side cart state. Meant for small carts (``max_lines``).
+
+Selected with ``settings.CART_STORAGE = {'BACKEND': ..., 'OPTIONS': {...}}``;
+``GUEST_BACKEND``/``GUEST_OPTIONS`` optionally override it for anonymous
+visitors.
+
+Guests get a session only on the first mutation (``create=True``): read
+paths answer with an empty cart instead of writing a django_session row.
+"""
+import threading
+import time
+import uuid
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core import signing
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import CartItem
+
+
+class CartOwner(NamedTuple):
+    """Who the cart belongs to: ('user', user_id) or ('session', session_key)."""
+    kind: str
+    key: str
+
+    def __str__(self):
+        return f'{self.kind}:{self.key}'
+
+
+class CartLine(NamedTuple):
+    product_id: int
+    qty: int
+    price_at_add: Decimal
+
+
+def cart_owner(request, create=False):
+    """
+    Returns the cart owner for the request. A guest without a session gets
+    None, unless create=True, in which case the session is saved first.
+    """
+    if request.user.is_authenticated:
+        return CartOwner('user', str(request.user.pk))
+    if not request.session.session_key:
+        if not create:
+            return None
+        request.session.save()
+    return CartOwner('session', request.session.session_key)
+
+
+class CartStorageError(Exception):
+    """The storage cannot accept the change (e.g. the cookie cart is full)."""
+
+
+class BaseCartStorage:
+    uses_session = True
+    # the cart lives in the orders database: checkout empties it in the
+    # order's transaction instead of restoring the lines on failure
+    transactional = False
+
+    def __init__(self, **options):
+        self.options = options
+
+    def bind(self, request):
+        """Storage to use for this request (request-scoped backends override it)."""
+        return self
+
+    def save(self, response):
+        """Called with every response of a cart view."""
+
+    def lines(self, owner):
+        """Cart lines, most recently changed first."""
+        raise NotImplementedError
+
+    def add(self, owner, product, qty):
+        """Adds qty of product (price is fixed on first add). Returns the new qty."""
+        raise NotImplementedError
+
+    def remove(self, owner, product_id, qty):
+        """Removes qty of product. Returns the remaining qty, or None if it was not in the cart."""
+        raise NotImplementedError
+
+    def pop_all(self, owner):
+        """Atomically reads and empties the cart (used by checkout)."""
+        raise NotImplementedError
+
+    def restore(self, owner, lines):
+        """Puts lines back after a failed checkout (storages that are not transactional)."""
+        raise NotImplementedError
+
+
+# ==============================
+# CartItem table
+# ==============================
+class ORMCartStorage(BaseCartStorage):
+    transactional = True
+
+    @staticmethod
+    def queryset(owner):
+        qs = CartItem.objects.all()
+        if owner.kind == 'user':
+            return qs.filter(user_id=owner.key)
+        return qs.filter(session_key=owner.key)
+
+    @staticmethod
+    def _owner_fields(owner):
+        if owner.kind == 'user':
+            return {'user_id': owner.key}
+        return {'session_key': owner.key}
+
+    def lines(self, owner):
+        return [
+            CartLine(pid, qty, price)
+            for pid, qty, price in self.queryset(owner)
+            .order_by('-update_at')
+            .values_list('product_id', 'qty', 'price_at_add')
+        ]
+
+    def add(self, owner, product, qty):
+        obj, created = CartItem.objects.get_or_create(
+            product=product, **self._owner_fields(owner),
+            defaults={'price_at_add': getattr(product, 'price', 0), 'qty': qty},
+        )
+        if not created:
+            obj.qty += qty
+            obj.save()
+        return obj.qty
+
+    def remove(self, owner, product_id, qty):
+        item = self.queryset(owner).filter(product_id=product_id).first()
+        if item is None:
+            return None
+        new_qty = item.qty - qty
+        if new_qty > 0:
+            item.qty = new_qty
+            item.save()
+            return new_qty
+        item.delete()
+        return 0
+
+    def pop_all(self, owner):
+        with transaction.atomic():
+            qs = self.queryset(owner).select_for_update()
+            lines = [
+                CartLine(pid, qty, price)
+                for pid, qty, price in qs.order_by('-update_at')
+                .values_list('product_id', 'qty', 'price_at_add')
+            ]
+            qs.delete()
+        return lines
+
+    def restore(self, owner, lines):
+        CartItem.objects.bulk_create([
+            CartItem(product_id=line.product_id, qty=line.qty,
+                     price_at_add=line.price_at_add, **self._owner_fields(owner))
+            for line in lines
+        ])
+
+
+# ==============================
+# Key-value store (Redis hashes)
+# ==============================
+class LocalKeyValueStore:
+    """
+    In-process stand-in for the few Redis hash commands the cart needs.
+    Good for a single process and for tests; use Redis with several workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._expires = {}
+
+    def _get(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get(key) or {})
+
+    def hincrby(self, key, field, amount):
+        with self._lock:
+            data = self._get(key)
+            if data is None:
+                data = self._data[key] = {}
+            data[field] = int(data.get(field, 0)) + amount
+            return data[field]
+
+    def hsetnx(self, key, field, value):
+        with self._lock:
+            data = self._get(key)
+            if data is None:
+                data = self._data[key] = {}
+            if field in data:
+                return 0
+            data[field] = value
+            return 1
+
+    def hset(self, key, field, value):
+        with self._lock:
+            data = self._get(key)
+            if data is None:
+                data = self._data[key] = {}
+            data[field] = value
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            data = self._get(key) or {}
+            for field in fields:
+                data.pop(field, None)
+            if not data:
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if self._get(key) is not None:
+                self._expires[key] = time.monotonic() + seconds
+
+    def hgetall_and_delete(self, key):
+        with self._lock:
+            data = self._get(key) or {}
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+            return dict(data)
+
+
+class RedisKeyValueStore:
+    """The same interface on top of redis-py (optional dependency)."""
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def hgetall_and_delete(self, key):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(key)
+        pipe.delete(key)
+        data, _ = pipe.execute()
+        return data
+
+
+class KeyValueCartStorage(BaseCartStorage):
+    """
+    One hash per cart: ``q:<id>`` quantity, ``p:<id>`` price at add,
+    ``t:<id>`` last change time. The whole hash expires after ``ttl``
+    seconds without changes, so abandoned guest carts clean themselves up.
+    """
+    _local_store = None
+
+    def __init__(self, url=None, ttl=7 * 24 * 3600, prefix='cart', **options):
+        super().__init__(**options)
+        self.ttl = ttl
+        self.prefix = prefix
+        if url:
+            self.store = RedisKeyValueStore(url)
+        else:
+            if KeyValueCartStorage._local_store is None:
+                KeyValueCartStorage._local_store = LocalKeyValueStore()
+            self.store = KeyValueCartStorage._local_store
+
+    def _key(self, owner):
+        return f'{self.prefix}:{owner}'
+
+    @staticmethod
+    def _parse(data):
+        lines = []
+        for field, qty in data.items():
+            if not field.startswith('q:') or int(qty) <= 0:
+                continue
+            pid = field[2:]
+            lines.append((
+                float(data.get(f't:{pid}', 0)),
+                CartLine(int(pid), int(qty), Decimal(data.get(f'p:{pid}', '0'))),
+            ))
+        lines.sort(key=lambda item: item[0], reverse=True)
+        return [line for _, line in lines]
+
+    def lines(self, owner):
+        return self._parse(self.store.hgetall(self._key(owner)))
+
+    def add(self, owner, product, qty):
+        key = self._key(owner)
+        pid = product.pk
+        self.store.hsetnx(key, f'p:{pid}', str(getattr(product, 'price', 0)))
+        new_qty = self.store.hincrby(key, f'q:{pid}', qty)
+        self.store.hset(key, f't:{pid}', repr(time.time()))
+        self.store.expire(key, self.ttl)
+        return int(new_qty)
+
+    def remove(self, owner, product_id, qty):
+        key = self._key(owner)
+        if f'q:{product_id}' not in self.store.hgetall(key):
+            return None
+        new_qty = int(self.store.hincrby(key, f'q:{product_id}', -qty))
+        if new_qty > 0:
+            self.store.hset(key, f't:{product_id}', repr(time.time()))
+            self.store.expire(key, self.ttl)
+            return new_qty
+        self.store.hdel(key, f'q:{product_id}', f'p:{product_id}', f't:{product_id}')
+        return 0
+
+    def pop_all(self, owner):
+        return self._parse(self.store.hgetall_and_delete(self._key(owner)))
+
+    def restore(self, owner, lines):
+        key = self._key(owner)
+        for line in lines:
+            self.store.hsetnx(key, f'p:{line.product_id}', str(line.price_at_add))
+            self.store.hincrby(key, f'q:{line.product_id}', line.qty)
+            self.store.hset(key, f't:{line.product_id}', repr(time.time()))
+        self.store.expire(key, self.ttl)
+
+
+# ==============================
+# Signed cookie (guests)
+# ==============================
+class SignedCookieCartStorage(BaseCartStorage):
+    """
+    The cart is a signed, compressed {"id": cart id, "l": [[id, qty, price,
+    time], ...]} in a cookie. Prices cannot be tampered with, and nothing
+    but stock reservations (keyed by the cart id) is stored on the server
+    until checkout.
+    """
+    uses_session = False
+
+    def __init__(self, cookie_name='cart', max_age=30 * 24 * 3600, max_lines=30, **options):
+        super().__init__(**options)
+        self.cookie_name = cookie_name
+        self.max_age = max_age
+        self.max_lines = max_lines
+
+    def bind(self, request):
+        return BoundCookieCart(self, request)
+
+
+class BoundCookieCart(BaseCartStorage):
+    uses_session = False
+    salt = 'orders.cart'
+
+    def __init__(self, config, request):
+        super().__init__()
+        self.config = config
+        self.changed = False
+        raw = request.COOKIES.get(config.cookie_name)
+        try:
+            data = signing.loads(raw, salt=self.salt, max_age=config.max_age) if raw else {}
+        except signing.BadSignature:
+            data, self.changed = {}, True
+        # a new cart id lives only in this response's cookie until the client sends it back
+        self.is_new = not data.get('id')
+        self.owner = CartOwner('cookie', data.get('id') or uuid.uuid4().hex)
+        self._lines = {
+            int(pid): [int(qty), str(price), float(ts)] for pid, qty, price, ts in data.get('l', ())
+        }
+
+    def lines(self, owner=None):
+        rows = sorted(self._lines.items(), key=lambda item: item[1][2], reverse=True)
+        return [CartLine(pid, qty, Decimal(price)) for pid, (qty, price, _) in rows]
+
+    def add(self, owner, product, qty):
+        line = self._lines.get(product.pk)
+        if line is None:
+            if len(self._lines) >= self.config.max_lines:
+                raise CartStorageError('Basket is full')
+            line = self._lines[product.pk] = [0, str(getattr(product, 'price', 0)), 0.0]
+        line[0] += qty
+        line[2] = time.time()
+        self.changed = True
+        return line[0]
+
+    def remove(self, owner, product_id, qty):
+        line = self._lines.get(product_id)
+        if line is None:
+            return None
+        self.changed = True
+        line[0] -= qty
+        if line[0] > 0:
+            line[2] = time.time()
+            return line[0]
+        del self._lines[product_id]
+        return 0
+
+    def pop_all(self, owner=None):
+        lines = self.lines()
+        self._lines = {}
+        self.changed = True
+        return lines
+
+    def restore(self, owner, lines):
+        now = time.time()
+        for line in lines:
+            self._lines[line.product_id] = [line.qty, str(line.price_at_add), now]
+        self.changed = True
+
+    def save(self, response):
+        if not self.changed:
+            return
+        # an emptied cart keeps its id: a retried checkout is recognised by it
+        data = {'id': self.owner.key, 'l': [[pid, *line] for pid, line in self._lines.items()]}
+        response.set_cookie(
+            self.config.cookie_name,
+            signing.dumps(data, salt=self.salt, compress=True),
+            max_age=self.config.max_age,
+            httponly=True,
+            samesite='Lax',
+        )
+
+
+_storages = {}
+
+
+@receiver(setting_changed)
+def _reset_storages(setting, **kwargs):
+    if setting == 'CART_STORAGE':
+        _storages.clear()
+
+
+def _load(kind):
+    if kind not in _storages:
+        config = getattr(settings, 'CART_STORAGE', {})
+        if kind == 'guest':
+            backend, options = config.get('GUEST_BACKEND'), config.get('GUEST_OPTIONS', {})
+        else:
+            backend, options = config.get('BACKEND', 'orders.cart.ORMCartStorage'), config.get('OPTIONS', {})
+        _storages[kind] = import_string(backend)(**options) if backend else None
+    return _storages[kind]
+
+
+def get_storage(request=None):
+    """
+    The configured storage; with a request, the one for this visitor
+    (guest backend for anonymous users), bound once per request.
+    """
+    if request is None:
+        return _load('default')
+    storage = getattr(request, '_cart_storage', None)
+    if storage is None:
+        storage = None if request.user.is_authenticated else _load('guest')
+        storage = (storage or _load('default')).bind(request)
+        request._cart_storage = storage
+    return storage
+
+
+def get_cart(request, create=False):
+    """
+    (storage, owner) for the request. owner is None for a guest who has no
+    cart yet; create=True starts a session for session-keyed backends.
+    """
+    storage = get_storage(request)
+    if not storage.uses_session and not request.user.is_authenticated:
+        return storage, storage.owner
+    return storage, cart_owner(request, create)
+
+
+def save_cart(request, response):
+    """Lets a request-scoped storage (cookie cart) write itself to the response."""
+    storage = getattr(request, '_cart_storage', None)
+    if storage is not None:
+        storage.save(response)
+    return response
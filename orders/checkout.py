@@ -0,0 +1,159 @@
+"""
+Checkout pipeline.
+
+Placing an order is one transaction:
+
+1. lock the product rows in product id order (``select_for_update``), so
+   concurrent checkouts of overlapping carts always lock in the same
+   order and cannot deadlock;
+2. take the stock with a single conditional UPDATE, which decrements
+   ``count`` and increments ``purchases_count`` only for rows where the
+   free stock plus the cart's own reservation (orders.reservations)
+   covers the line. The same statement releases those reservations from
+   ``reserved_count``. If fewer rows are updated than there are lines, the
+   whole transaction rolls back;
+3. create the Order and its OrderItems, each with a snapshot of the
+   product (title, slug, primary image URL, category id), so order
+   history never reads the live catalog.
+
+The same UPDATE moves ``updated_at`` of the products (the validator of
+the product detail ETag). Caches that depend on stock and purchases
+(rankings, facets, product cards, catalog versions) are notified after
+commit.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from catalog import cards, conditional, facets, home, rankings
+from catalog.models import Product, ProductImage
+from . import reservations
+from .models import Order, OrderItem
+
+
+class InsufficientStock(Exception):
+    """Some cart lines ask for more than is in stock."""
+
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f'Not enough stock for products {self.product_ids}')
+
+
+def merge_lines(lines):
+    """{product_id: (qty, price)}; repeated products are summed."""
+    merged = {}
+    for line in lines:
+        qty, price = merged.get(line.product_id, (0, line.price_at_add))
+        merged[line.product_id] = (qty + line.qty, price)
+    return merged
+
+
+def product_snapshots(product_ids):
+    """
+    {product_id: {title, slug, category_id, image}} in two queries.
+    image is the URL of the product's first image, or ''.
+    """
+    storage = ProductImage._meta.get_field('src').storage
+    images = {}
+    for pid, name in (
+        ProductImage.objects.filter(product_id__in=product_ids)
+        .order_by('product_id', 'id')
+        .values_list('product_id', 'src')
+    ):
+        if pid not in images and name:
+            images[pid] = storage.url(name)
+    return {
+        pid: {'title': title, 'slug': slug, 'category_id': category_id, 'image': images.get(pid, '')}
+        for pid, title, slug, category_id in (
+            Product.objects.filter(pk__in=product_ids)
+            .values_list('pk', 'title', 'slug', 'category_id')
+        )
+    }
+
+
+def _per_product(values):
+    return Case(
+        *[When(pk=pid, then=Value(value)) for pid, value in values.items()],
+        default=Value(0),
+    )
+
+
+def _take_stock(quantities, held):
+    """Conditional decrement of every line in one UPDATE; returns the rows updated."""
+    return (
+        Product.objects
+        .filter(reduce(or_, [
+            # count >= qty and free stock + own hold >= qty
+            Q(pk=pid, count__gte=qty) & Q(count__gte=F('reserved_count') + (qty - held.get(pid, 0)))
+            for pid, qty in quantities.items()
+        ]))
+        .update(
+            count=F('count') - _per_product(quantities),
+            reserved_count=F('reserved_count') - _per_product(held),
+            purchases_count=F('purchases_count') + _per_product(quantities),
+            updated_at=timezone.now(),
+        )
+    )
+
+
+def place_order(lines, *, user=None, session_key=None, reservation_owner=None, **order_fields):
+    """
+    Creates an order from cart lines, taking the stock atomically.
+    reservation_owner is the cart owner whose stock holds are used up.
+    Raises InsufficientStock (nothing is written) if any line cannot be served.
+    """
+    merged = merge_lines(lines)
+    quantities = {pid: qty for pid, (qty, _) in merged.items()}
+    ids = sorted(quantities)
+
+    with transaction.atomic():
+        stock = {
+            pid: (count, reserved)
+            for pid, count, reserved in Product.objects.select_for_update()
+            .filter(pk__in=ids)
+            .order_by('pk')
+            .values_list('pk', 'count', 'reserved_count')
+        }
+        held = reservations.take(reservation_owner, ids) if reservation_owner else {}
+        short = [
+            pid for pid in ids
+            if pid not in stock
+            or stock[pid][0] < quantities[pid]
+            or stock[pid][0] - stock[pid][1] + held.get(pid, 0) < quantities[pid]
+        ]
+        if short:
+            raise InsufficientStock(short)
+        if _take_stock(quantities, held) != len(ids):
+            # stock changed between the read and the update (no row locks on SQLite)
+            raise InsufficientStock(ids)
+
+        order = Order.objects.create(
+            user=user,
+            session_key=session_key,
+            total_amount=sum((qty * price for qty, price in merged.values()), 0),
+            **order_fields,
+        )
+        snapshots = product_snapshots(ids)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=pid, qty=qty, price_at_order=price, **snapshots[pid])
+            for pid, (qty, price) in merged.items()
+        ])
+
+        sold_out = [
+            pid for pid in ids
+            if stock[pid][0] - stock[pid][1] + held.get(pid, 0) == quantities[pid]
+        ]
+        transaction.on_commit(lambda: rankings.note_purchases(quantities))
+        # the stock count is part of the cached product cards
+        transaction.on_commit(lambda: cards.invalidate(ids))
+        # ... and of the popular/limited cards on the home page
+        transaction.on_commit(home.invalidate)
+        # the stock count is in the product detail: its ETag and cached responses change too
+        conditional.products_changed(ids, {s['category_id'] for s in snapshots.values()})
+        if sold_out:
+            # availability counts in the catalog facets changed
+            transaction.on_commit(lambda: facets.refresh_products(sold_out))
+    return order
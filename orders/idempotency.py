@@ -0,0 +1,227 @@
+"""
+Idempotency-Key support for the order endpoints.
+
+A client may send ``Idempotency-Key: <unique string>`` with a POST. The
+first request with a key claims it and runs normally. Its response is
+stored (status code and data) for ``TTL`` seconds. A retry with the same
+key and the same request gets the stored response back, with
+``Idempotent-Replayed: true``, and the view is not run again.
+
+* same key, different request (method, path or body) -> 422;
+* same key while the first request is still running -> 409;
+* 5xx responses and exceptions release the key, so a retry runs again.
+
+Keys are scoped to the cart owner: the user, the guest session or the
+cookie cart, taken before the view runs (checkout may start a session for
+a cookie-cart guest). A guest with none of them yet has no stable scope,
+so a key from them is rejected with 400. Stored responses live in the
+IdempotencyKey table with a per-process LRU in front of it, so a replay
+is one dict lookup or, at worst, one indexed query. Expired rows are
+removed by ``manage.py purge_idempotency_keys``.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http.request import RawPostDataException
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .cart import get_cart
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+DEFAULTS = {
+    'TTL': 24 * 3600,      # seconds a stored response is replayed
+    'LOCK_TIMEOUT': 60,    # seconds after which an unfinished claim can be taken over
+    'LRU_SIZE': 1024,      # stored responses kept in process memory
+    'MAX_KEY_LENGTH': 255,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'IDEMPOTENCY', {})}
+
+
+def request_scope(request):
+    """'user:<pk>', 'session:<key>' or 'cookie:<cart id>'; None without a stable owner."""
+    storage, owner = get_cart(request)
+    if owner is None or getattr(storage, 'is_new', False):
+        return None
+    return str(owner)
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.get_full_path().encode())
+    try:
+        digest.update(request.body)
+    except RawPostDataException:
+        # the stream was already consumed (multipart); fall back to the parsed data
+        digest.update(json.dumps(dict(request.data), sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class ResponseLRU:
+    """(scope, key) -> (fingerprint, status_code, data, expires_at timestamp)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, scope, key):
+        with self._lock:
+            entry = self._items.get((scope, key))
+            if entry is None:
+                return None
+            if entry[3] <= time.time():
+                del self._items[(scope, key)]
+                return None
+            self._items.move_to_end((scope, key))
+            return entry
+
+    def put(self, scope, key, entry):
+        size = get_config()['LRU_SIZE']
+        with self._lock:
+            self._items[(scope, key)] = entry
+            self._items.move_to_end((scope, key))
+            while len(self._items) > size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+lru = ResponseLRU()
+
+
+def _mismatch():
+    return Response(
+        {'detail': f'{HEADER} was already used with a different request'},
+        status=422,
+    )
+
+
+def _in_progress():
+    return Response({'detail': 'A request with this key is in progress'}, status=409)
+
+
+def _replay(entry, fingerprint):
+    stored_fingerprint, status_code, data, _ = entry
+    if stored_fingerprint != fingerprint:
+        return _mismatch()
+    response = Response(data, status=status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(scope, key, fingerprint, config):
+    """
+    Claims the key for this request. Returns None if claimed, otherwise
+    the response to send (a replay, 409 or 422).
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=config['TTL'])
+    row = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+    if row is None:
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(
+                    scope=scope, key=key, fingerprint=fingerprint,
+                    created_at=now, expires_at=expires_at,
+                )
+            return None
+        except IntegrityError:
+            # a parallel request claimed it first
+            row = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+            if row is None:
+                return _in_progress()
+    stale = row.status_code is None and row.created_at <= now - timedelta(seconds=config['LOCK_TIMEOUT'])
+    if row.expires_at <= now or stale:
+        # take over the expired or abandoned claim; created_at guards against a parallel takeover
+        taken = IdempotencyKey.objects.filter(pk=row.pk, created_at=row.created_at).update(
+            fingerprint=fingerprint, status_code=None, response=None,
+            created_at=now, expires_at=expires_at,
+        )
+        return None if taken else _in_progress()
+    if row.status_code is None:
+        return _mismatch() if row.fingerprint != fingerprint else _in_progress()
+
+    entry = (row.fingerprint, row.status_code, row.response, row.expires_at.timestamp())
+    lru.put(scope, key, entry)
+    return _replay(entry, fingerprint)
+
+
+def _complete(scope, key, response):
+    row = IdempotencyKey.objects.filter(scope=scope, key=key, status_code__isnull=True).first()
+    if row is None:
+        return
+    row.status_code = response.status_code
+    row.response = response.data
+    row.save(update_fields=['status_code', 'response'])
+    lru.put(scope, key, (row.fingerprint, row.status_code, row.response, row.expires_at.timestamp()))
+
+
+def _release(scope, key):
+    IdempotencyKey.objects.filter(scope=scope, key=key, status_code__isnull=True).delete()
+
+
+def idempotent(view_method):
+    """Decorator for APIView handlers that honours the Idempotency-Key header."""
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        config = get_config()
+        if len(key) > config['MAX_KEY_LENGTH']:
+            return Response({'detail': f'{HEADER} is too long'}, status=400)
+
+        scope = request_scope(request)
+        if scope is None:
+            return Response({'detail': f'{HEADER} needs a session or a cart'}, status=400)
+        fingerprint = request_fingerprint(request)
+        entry = lru.get(scope, key)
+        if entry is not None:
+            return _replay(entry, fingerprint)
+
+        replay = _claim(scope, key, fingerprint, config)
+        if replay is not None:
+            return replay
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            _release(scope, key)
+            raise
+        if response.status_code >= 500 or not hasattr(response, 'data'):
+            _release(scope, key)
+        else:
+            _complete(scope, key, response)
+        return response
+
+    return wrapper
+
+
+def purge_expired(batch_size=1000):
+    """Deletes expired keys in batches; returns the number removed."""
+    removed = 0
+    while True:
+        ids = list(
+            IdempotencyKey.objects
+            .filter(expires_at__lte=timezone.now())
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return removed
+        removed += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,86 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection
+
+from catalog.models import Category, Product
+from orders.cart import CartLine
+from orders.checkout import InsufficientStock, place_order
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочная проверка checkout: параллельные заказы на товар с ограниченным "
+        "остатком. Создаёт временные товары и удаляет их вместе с заказами."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--checkouts", type=int, default=300)
+        parser.add_argument("--workers", type=int, default=32)
+        parser.add_argument("--stock", type=int, default=50)
+        parser.add_argument("--products", type=int, default=3, help="товаров в каждой корзине")
+
+    def handle(self, *args, checkouts, workers, stock, products, **options):
+        category, _ = Category.objects.get_or_create(slug="bench-checkout", defaults={"name": "Bench"})
+        items = [
+            Product.objects.create(
+                category=category, title=f"Bench {i}", slug=f"bench-checkout-{i}",
+                price=Decimal("10.00"), count=stock, is_limited=True,
+            )
+            for i in range(products)
+        ]
+        ids = [p.pk for p in items]
+
+        def checkout(n):
+            close_old_connections()
+            # разный порядок строк в корзинах — блокировки всё равно берутся по id
+            order = ids[n % len(ids):] + ids[:n % len(ids)]
+            lines = [CartLine(pid, 1, Decimal("10.00")) for pid in order]
+            started = time.perf_counter()
+            try:
+                place_order(lines, session_key=f"bench-{n}")
+                result = "ok"
+            except InsufficientStock:
+                result = "sold_out"
+            except OperationalError:
+                result = "db_error"
+            finally:
+                connection.close()
+            return result, time.perf_counter() - started
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(checkout, range(checkouts)))
+            elapsed = time.perf_counter() - started
+
+            outcome = Counter(result for result, _ in results)
+            latencies = sorted(duration for _, duration in results)
+            left = dict(Product.objects.filter(pk__in=ids).values_list("pk", "count"))
+            sold = {pid: stock - left[pid] for pid in ids}
+            ordered = Order.objects.filter(session_key__startswith="bench-").count()
+
+            self.stdout.write(
+                f"{checkouts} checkouts, {workers} workers, {elapsed:.2f}s "
+                f"({checkouts / elapsed:.0f}/s); p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+                f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms"
+            )
+            self.stdout.write(f"outcome: {dict(outcome)}; orders: {ordered}; sold: {sold}")
+            consistent = (
+                all(count >= 0 for count in left.values())
+                and all(qty == outcome["ok"] for qty in sold.values())
+                and ordered == outcome["ok"]
+            )
+            if consistent:
+                self.stdout.write(self.style.SUCCESS("No overselling, stock matches orders"))
+            else:
+                self.stdout.write(self.style.ERROR("Stock and orders do not match"))
+        finally:
+            Order.objects.filter(session_key__startswith="bench-").delete()
+            Product.objects.filter(pk__in=ids).delete()
+            if not category.products.exists():
+                category.delete()
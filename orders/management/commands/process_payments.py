@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from orders import payments
+
+
+class Command(BaseCommand):
+    help = (
+        "Проводит платежи, которым подошло время (повторы после рестарта, "
+        "зависшие по истёкшей аренде). Для cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=100)
+
+    def handle(self, *args, limit, **options):
+        processed = payments.process_due(limit)
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} payments"))
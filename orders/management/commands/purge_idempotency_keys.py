@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from orders import idempotency
+
+
+class Command(BaseCommand):
+    help = "Удаляет просроченные ключи идемпотентности (для cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        removed = idempotency.purge_expired(batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} expired idempotency keys"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from orders import reservations
+
+
+class Command(BaseCommand):
+    help = (
+        "Снимает просроченные резервы товаров пачками. Обычно это делает фоновая "
+        "задача orders.tasks.release_expired_reservations; команда — для cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, batch_size, **options):
+        released = reservations.release_expired(batch_size)
+        # holds left from before the task existed get a queued reaper too
+        reservations.schedule_reaper()
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations"))
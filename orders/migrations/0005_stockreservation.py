@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 06:08
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_product_reserved_count'),
+        ('orders', '0004_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(help_text='user:<id>, session:<key> или cookie:<id>', max_length=80, verbose_name='Корзина')),
+                ('qty', models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Кол-во')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Истекает')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='catalog.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Резерв товара',
+                'verbose_name_plural': 'Резервы товаров',
+                'constraints': [models.UniqueConstraint(fields=('owner', 'product'), name='uniq_reservation_per_cart')],
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.5 on 2026-10-17 06:10
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def product_snapshots(Product, ProductImage, product_ids):
+    # то же, что orders.checkout.product_snapshots() на момент миграции
+    storage = ProductImage._meta.get_field('src').storage
+    images = {}
+    for pid, name in (
+        ProductImage.objects.filter(product_id__in=product_ids)
+        .order_by('product_id', 'id')
+        .values_list('product_id', 'src')
+    ):
+        if pid not in images and name:
+            images[pid] = storage.url(name)
+    return {
+        pid: {'title': title, 'slug': slug, 'category_id': category_id, 'image': images.get(pid, '')}
+        for pid, title, slug, category_id in (
+            Product.objects.filter(pk__in=product_ids).values_list('pk', 'title', 'slug', 'category_id')
+        )
+    }
+
+
+def fill_snapshots(apps, schema_editor):
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    Product = apps.get_model('catalog', 'Product')
+    ProductImage = apps.get_model('catalog', 'ProductImage')
+    items = list(OrderItem.objects.filter(title=''))
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        snapshots = product_snapshots(Product, ProductImage, {item.product_id for item in batch})
+        for item in batch:
+            for field, value in snapshots.get(item.product_id, {}).items():
+                setattr(item, field, value)
+        OrderItem.objects.bulk_update(batch, ['title', 'slug', 'category_id', 'image'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_history_indexes'),
+        ('catalog', '0009_product_reserved_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='category_id',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Категория'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='image',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Картинка'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='slug',
+            field=models.CharField(blank=True, default='', max_length=200, verbose_name='Слаг'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='title',
+            field=models.CharField(blank=True, default='', max_length=128, verbose_name='Название'),
+        ),
+        migrations.RunPython(fill_snapshots, migrations.RunPython.noop),
+    ]
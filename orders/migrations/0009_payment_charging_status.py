@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_payment'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает'), ('processing', 'Обрабатывается'), ('charging', 'Списывается'), ('succeeded', 'Проведён'), ('failed', 'Отклонён')], default='pending', max_length=20, verbose_name='Статус'),
+        ),
+    ]
@@ -76,6 +76,11 @@ class Order(models.Model):
         ordering = ('-created_at', )
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        # история заказов: keyset-страницы по (created_at, id) владельца
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_history_idx'),
+            models.Index(fields=['session_key', 'created_at', 'id'], name='order_session_history_idx'),
+        ]
 
 
     def __str__(self):
@@ -102,6 +107,11 @@ class OrderItem(models.Model):
         validators=[MinValueValidator(0)],
         verbose_name='Цена в заказе'
     )
+    # снимок товара на момент заказа: история заказов не читает каталог
+    title = models.CharField(max_length=128, blank=True, default='', verbose_name='Название')
+    slug = models.CharField(max_length=200, blank=True, default='', verbose_name='Слаг')
+    image = models.CharField(max_length=255, blank=True, default='', verbose_name='Картинка')
+    category_id = models.PositiveIntegerField(null=True, blank=True, verbose_name='Категория')
 
     class Meta:
         verbose_name = 'Позиция заказа'
@@ -116,9 +126,133 @@ class OrderItem(models.Model):
     def __str__(self):
         return f'{self.product} × {self.qty}'
 
+    def save(self, *args, **kwargs):
+        # позиции из checkout приходят со снимком (bulk_create); для прочих — снимаем здесь
+        if not self.title and self.product_id:
+            self.fill_snapshot()
+        super().save(*args, **kwargs)
+
+    def fill_snapshot(self):
+        from .checkout import product_snapshots
+
+        for field, value in product_snapshots([self.product_id]).get(self.product_id, {}).items():
+            setattr(self, field, value)
+
     @property
     def amount(self):
         if self.price_at_order is None or self.qty in (None, 0):
             return None
         return self.qty * self.price_at_order
 
+
+
+class IdempotencyKey(models.Model):
+    """Stored response of a request sent with an Idempotency-Key header."""
+    scope = models.CharField(max_length=80, verbose_name='Владелец')
+    key = models.CharField(max_length=255, verbose_name='Ключ')
+    fingerprint = models.CharField(max_length=64, verbose_name='Хеш запроса')
+    status_code = models.PositiveSmallIntegerField(
+        null=True, blank=True, verbose_name='Код ответа',
+        help_text='Пусто, пока запрос выполняется'
+    )
+    response = models.JSONField(null=True, blank=True, verbose_name='Ответ')
+    created_at = models.DateTimeField(verbose_name='Создан')
+    expires_at = models.DateTimeField(db_index=True, verbose_name='Истекает')
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['scope', 'key'],
+                name='uniq_idempotency_key'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.scope} {self.key} ({self.status_code or "..."})'
+
+
+class StockReservation(models.Model):
+    """Units of a product held by a cart until expires_at (see orders.reservations)."""
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name='Товар'
+    )
+    owner = models.CharField(
+        max_length=80, verbose_name='Корзина',
+        help_text='user:<id>, session:<key> или cookie:<id>'
+    )
+    qty = models.PositiveIntegerField(
+        default=1, validators=[MinValueValidator(1)],
+        verbose_name='Кол-во'
+    )
+    expires_at = models.DateTimeField(db_index=True, verbose_name='Истекает')
+
+    class Meta:
+        verbose_name = 'Резерв товара'
+        verbose_name_plural = 'Резервы товаров'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'product'],
+                name='uniq_reservation_per_cart'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.product} × {self.qty} ({self.owner})'
+
+
+class PaymentStatus(models.TextChoices):
+    PENDING = 'pending', 'Ожидает'
+    PROCESSING = 'processing', 'Обрабатывается'
+    CHARGING = 'charging', 'Списывается'
+    SUCCEEDED = 'succeeded', 'Проведён'
+    FAILED = 'failed', 'Отклонён'
+
+
+class Payment(models.Model):
+    """A payment attempt for an order, processed in the background (orders.payments)."""
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE,
+        related_name='payments',
+        verbose_name='Заказ'
+    )
+    amount = models.DecimalField(
+        max_digits=10, decimal_places=2,
+        validators=[MinValueValidator(0)],
+        verbose_name='Сумма'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=PaymentStatus.choices,
+        default=PaymentStatus.PENDING,
+        verbose_name='Статус'
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    next_attempt_at = models.DateTimeField(verbose_name='Следующая попытка')
+    locked_until = models.DateTimeField(
+        null=True, blank=True, verbose_name='Обрабатывается до',
+        help_text='После этого момента зависший платёж можно взять снова'
+    )
+    transaction_id = models.CharField(max_length=100, blank=True, default='', verbose_name='ID транзакции')
+    last_error = models.CharField(max_length=255, blank=True, default='', verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создан')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлён')
+
+    class Meta:
+        verbose_name = 'Платёж'
+        verbose_name_plural = 'Платежи'
+        ordering = ('-created_at', )
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='payment_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'Платёж #{self.id} по заказу #{self.order_id} ({self.get_status_display()})'
+
+    @property
+    def idempotency_key(self):
+        """Sent with every charge of this payment, so the provider charges it at most once."""
+        return f'payment-{self.pk}'
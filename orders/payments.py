@@ -0,0 +1,256 @@
+"""
+Background payment processing.
+
+POST /api/orders/<pk> no longer marks the order paid inline. It creates a
+Payment, moves the order to ``processing`` and enqueues the
+``charge_payment`` task in the same transaction (taskqueue), then answers
+202 at once. The frontend polls GET /api/orders/<pk>/status.
+
+A worker (``manage.py runworker``) charges the payment through the
+configured gateway:
+
+* success -> payment ``succeeded``, order ``paid``;
+* decline -> payment ``failed``, order ``canceled``;
+* GatewayError (timeout, 5xx, ...) -> retried with exponential backoff
+  up to ``MAX_ATTEMPTS``; after that the payment fails as above.
+
+Payments are claimed with a conditional UPDATE and a lease
+(``locked_until``), so two workers never charge the same attempt, and a
+payment left behind by a crashed process is picked up again. Right before
+calling the gateway the payment is marked ``charging``: one found in that
+state with an expired lease may have been charged already. Every charge of
+a payment carries the same idempotency key (``payment-<pk>``), so charging
+it again only returns the provider's first result instead of taking the
+money twice.
+``manage.py process_payments`` processes due payments from cron as a
+safety net.
+"""
+import logging
+import random
+import time
+import uuid
+from datetime import timedelta
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import F, Q
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Order, OrderStatus, Payment, PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'GATEWAY': 'orders.payments.FakePaymentGateway',
+    'OPTIONS': {},
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 2.0,         # seconds before the 2nd attempt, doubled each time
+    'LEASE': 60,            # seconds a claimed payment stays locked
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PAYMENTS', {})}
+
+
+# ==============================
+# Gateways
+# ==============================
+class GatewayError(Exception):
+    """Temporary gateway failure; the charge is retried."""
+
+
+class ChargeResult(NamedTuple):
+    ok: bool
+    transaction_id: str = ''
+    error: str = ''
+
+
+class BasePaymentGateway:
+    def __init__(self, **options):
+        self.options = options
+
+    def charge(self, payment, idempotency_key):
+        """
+        Charges payment.amount for payment.order. Returns ChargeResult or raises
+        GatewayError. Repeated charges with the same idempotency_key must not
+        take the money again, but return the result of the first one.
+        """
+        raise NotImplementedError
+
+
+class FakePaymentGateway(BasePaymentGateway):
+    """
+    Local stand-in for a payment provider: sleeps for a random latency,
+    fails temporarily with ``failure_rate`` and declines with ``decline_rate``.
+    """
+
+    def __init__(self, latency=(0.2, 1.5), failure_rate=0.1, decline_rate=0.05, **options):
+        super().__init__(**options)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self.results = {}  # idempotency key -> result, as the provider keeps them
+
+    def charge(self, payment, idempotency_key):
+        time.sleep(random.uniform(*self.latency))
+        if idempotency_key in self.results:
+            return self.results[idempotency_key]
+        roll = random.random()
+        if roll < self.failure_rate:
+            raise GatewayError('Gateway timeout')
+        if roll < self.failure_rate + self.decline_rate:
+            result = ChargeResult(ok=False, error='Payment declined')
+        else:
+            result = ChargeResult(ok=True, transaction_id=uuid.uuid4().hex)
+        self.results[idempotency_key] = result
+        return result
+
+
+_gateway = None
+
+
+@receiver(setting_changed)
+def _reset_gateway(setting, **kwargs):
+    global _gateway
+    if setting == 'PAYMENTS':
+        _gateway = None
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        config = get_config()
+        _gateway = import_string(config['GATEWAY'])(**config['OPTIONS'])
+    return _gateway
+
+
+# ==============================
+# Starting a payment
+# ==============================
+def start_payment(order):
+    """
+    Creates a payment for the order (or returns the one in flight) and
+    queues its charge. Returns None if the order is already paid.
+    """
+    from .tasks import charge_payment
+
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order.pk)
+        if order.status == OrderStatus.PAID:
+            return None
+        active = order.payments.filter(
+            status__in=[PaymentStatus.PENDING, PaymentStatus.PROCESSING, PaymentStatus.CHARGING]
+        ).first()
+        if active is not None:
+            return active
+        payment = Payment.objects.create(
+            order=order, amount=order.total_amount, next_attempt_at=timezone.now()
+        )
+        Order.objects.filter(pk=order.pk).update(status=OrderStatus.PROCESSING, updated_at=timezone.now())
+        charge_payment.enqueue(payment.pk)
+    return payment
+
+
+# ==============================
+# Processing
+# ==============================
+def _due(now):
+    return (
+        Q(status=PaymentStatus.PENDING, next_attempt_at__lte=now)
+        | Q(status__in=[PaymentStatus.PROCESSING, PaymentStatus.CHARGING], locked_until__lte=now)
+    )
+
+
+def _claim(payment_id, config):
+    now = timezone.now()
+    return Payment.objects.filter(_due(now), pk=payment_id).update(
+        status=PaymentStatus.PROCESSING,
+        attempts=F('attempts') + 1,
+        locked_until=now + timedelta(seconds=config['LEASE']),
+        updated_at=now,
+    )
+
+
+def _finish(payment, ok, transaction_id='', error=''):
+    with transaction.atomic():
+        Payment.objects.filter(pk=payment.pk).update(
+            status=PaymentStatus.SUCCEEDED if ok else PaymentStatus.FAILED,
+            transaction_id=transaction_id,
+            last_error=error[:255],
+            locked_until=None,
+            updated_at=timezone.now(),
+        )
+        Order.objects.filter(pk=payment.order_id, status=OrderStatus.PROCESSING).update(
+            status=OrderStatus.PAID if ok else OrderStatus.CANCELED,
+            updated_at=timezone.now(),
+        )
+
+
+def _wait_for(payment_id):
+    """Seconds until a payment that could not be claimed is due again, None if it is finished."""
+    row = Payment.objects.filter(pk=payment_id).values_list('status', 'next_attempt_at', 'locked_until').first()
+    if row is None:
+        return None
+    status, next_attempt_at, locked_until = row
+    due = {
+        PaymentStatus.PENDING: next_attempt_at,
+        PaymentStatus.PROCESSING: locked_until,
+        PaymentStatus.CHARGING: locked_until,
+    }.get(status)
+    if due is None:
+        return None
+    return max((due - timezone.now()).total_seconds(), 0)
+
+
+def process_payment(payment_id):
+    """
+    One attempt at charging the payment. Returns the delay in seconds before
+    the next attempt, or None if there is nothing more to do. A payment that
+    is not due yet, or is leased by another worker, is not charged; the delay
+    until it is due is returned.
+    """
+    config = get_config()
+    if not _claim(payment_id, config):
+        return _wait_for(payment_id)
+    payment = Payment.objects.get(pk=payment_id)
+    # recorded before calling out: if this worker dies after the gateway took
+    # the money, the next attempt repeats the charge under the same key
+    if not Payment.objects.filter(
+        pk=payment.pk, status=PaymentStatus.PROCESSING, locked_until=payment.locked_until,
+    ).update(status=PaymentStatus.CHARGING, updated_at=timezone.now()):
+        return _wait_for(payment_id)
+    try:
+        result = get_gateway().charge(payment, payment.idempotency_key)
+    except GatewayError as exc:
+        if payment.attempts >= config['MAX_ATTEMPTS']:
+            logger.warning('Payment %s failed after %s attempts: %s', payment.pk, payment.attempts, exc)
+            _finish(payment, ok=False, error=f'{exc} (attempts exhausted)')
+            return None
+        delay = config['BACKOFF'] * 2 ** (payment.attempts - 1)
+        Payment.objects.filter(pk=payment.pk).update(
+            status=PaymentStatus.PENDING,
+            next_attempt_at=timezone.now() + timedelta(seconds=delay),
+            last_error=str(exc)[:255],
+            locked_until=None,
+            updated_at=timezone.now(),
+        )
+        return delay
+    _finish(payment, result.ok, result.transaction_id, result.error)
+    return None
+
+
+def process_due(limit=100):
+    """Processes payments that are due (or whose lease expired); returns how many were tried."""
+    now = timezone.now()
+    ids = list(
+        Payment.objects.filter(_due(now))
+        .order_by('next_attempt_at').values_list('pk', flat=True)[:limit]
+    )
+    for payment_id in ids:
+        process_payment(payment_id)
+    return len(ids)
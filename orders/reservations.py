@@ -0,0 +1,192 @@
+"""
+Time-limited stock reservations.
+
+Adding a product to the basket holds the units for ``TTL`` seconds.
+Product.reserved_count is the sum of active holds, kept in step by every
+change below (conditional UPDATEs, no per-request SUM). Free stock is
+``count - reserved_count``, which is what the catalog "available" filter
+and facets use.
+
+* reserve() - on basket add; fails with OutOfStock if free stock is short;
+* release() - on basket remove;
+* take() - inside the checkout transaction; the holds are consumed by the
+  same UPDATE that takes the stock (see orders.checkout);
+* release_expired() - the reaper. It runs as the queued task
+  orders.tasks.release_expired_reservations: reserve() queues it for the
+  hold's expiry unless one is queued by then, and each run queues the next
+  one for the earliest remaining hold. ``manage.py
+  release_expired_reservations`` does the same from cron.
+
+reserve() and the releases notify the catalog (facets, catalog versions
+and cached responses) only when free stock may have crossed zero, since
+that is all the "available" filter sees.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from catalog import conditional, facets
+from catalog.models import Product
+from taskqueue.models import Task, TaskStatus
+from .models import StockReservation
+
+DEFAULTS = {
+    'TTL': 15 * 60,     # seconds a basket holds the stock
+    'BATCH_SIZE': 500,  # expired holds released per transaction
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'STOCK_RESERVATIONS', {})}
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id, available):
+        self.product_id = product_id
+        self.available = max(available, 0)
+        super().__init__(f'Only {self.available} of product {product_id} available')
+
+
+def _free_stock(product_id):
+    row = Product.objects.filter(pk=product_id).values_list('count', 'reserved_count').first()
+    return row[0] - row[1] if row else 0
+
+
+def _availability_changed(product_ids):
+    """Free stock may have crossed zero: "available" facets and catalog lists change."""
+    transaction.on_commit(lambda: facets.refresh_products(list(product_ids)))
+    conditional.products_changed(product_ids)
+
+
+def _back_in_stock(released):
+    """
+    Of {product_id: qty just returned to free stock}, the products whose free
+    stock went from zero to above it. Only those change "available"; the
+    catalog caches of the others stay valid.
+    """
+    return [
+        pid for pid, count, reserved in Product.objects.filter(pk__in=released)
+        .values_list('pk', 'count', 'reserved_count')
+        if count - reserved - released[pid] <= 0 < count - reserved
+    ]
+
+
+def reserve(owner, product, qty):
+    """Holds qty more units of product for the cart owner and extends the hold."""
+    expires_at = timezone.now() + timedelta(seconds=get_config()['TTL'])
+    with transaction.atomic():
+        taken = (
+            Product.objects
+            .filter(pk=product.pk, count__gte=F('reserved_count') + qty)
+            .update(reserved_count=F('reserved_count') + qty)
+        )
+        if not taken:
+            raise OutOfStock(product.pk, _free_stock(product.pk))
+        held = (
+            StockReservation.objects
+            .filter(owner=owner, product_id=product.pk)
+            .update(qty=F('qty') + qty, expires_at=expires_at)
+        )
+        if not held:
+            StockReservation.objects.create(
+                owner=owner, product_id=product.pk, qty=qty, expires_at=expires_at
+            )
+        schedule_reaper(expires_at)
+        if product.count - product.reserved_count <= qty:
+            # the free stock may have just run out: update "available" in the facets
+            _availability_changed([product.pk])
+
+
+def release(owner, product_id, qty=None):
+    """Returns up to qty held units (all of them if qty is None) to free stock."""
+    with transaction.atomic():
+        hold = (
+            StockReservation.objects.select_for_update()
+            .filter(owner=owner, product_id=product_id)
+            .first()
+        )
+        if hold is None:
+            return 0
+        qty = hold.qty if qty is None else min(qty, hold.qty)
+        if qty >= hold.qty:
+            hold.delete()
+        else:
+            hold.qty -= qty
+            hold.save(update_fields=['qty'])
+        Product.objects.filter(pk=product_id).update(reserved_count=F('reserved_count') - qty)
+        back = _back_in_stock({product_id: qty})
+        if back:
+            _availability_changed(back)
+    return qty
+
+
+def take(owner, product_ids):
+    """
+    Removes the owner's holds on product_ids and returns {product_id: qty}.
+    Must run inside the checkout transaction, which also decrements
+    reserved_count by the returned quantities.
+    """
+    holds = (
+        StockReservation.objects.select_for_update()
+        .filter(owner=owner, product_id__in=product_ids)
+    )
+    held = dict(holds.values_list('product_id', 'qty'))
+    if held:
+        holds.delete()
+    return held
+
+
+def schedule_reaper(expires_at=None):
+    """
+    Queues the reaper for expires_at (the earliest hold if None), unless a
+    queued run comes by then. Returns the new Task row or None.
+    """
+    from .tasks import release_expired_reservations
+
+    if expires_at is None:
+        expires_at = (
+            StockReservation.objects.order_by('expires_at')
+            .values_list('expires_at', flat=True).first()
+        )
+        if expires_at is None:
+            return None
+    queued = Task.objects.filter(
+        name=release_expired_reservations.name, status=TaskStatus.QUEUED, run_at__lte=expires_at,
+    ).exists()
+    if queued:
+        return None
+    delay = max((expires_at - timezone.now()).total_seconds(), 0)
+    return release_expired_reservations.enqueue(delay=delay)
+
+
+def release_expired(batch_size=None, now=None):
+    """Releases expired holds in batches; returns the number of holds released."""
+    batch_size = batch_size or get_config()['BATCH_SIZE']
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('pk', 'product_id', 'qty')[:batch_size]
+            )
+            if not rows:
+                return released
+            totals = Counter()
+            for _, product_id, qty in rows:
+                totals[product_id] += qty
+            StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+            Product.objects.filter(pk__in=totals).update(reserved_count=F('reserved_count') - Case(
+                *[When(pk=pid, then=Value(qty)) for pid, qty in totals.items()],
+                default=Value(0),
+            ))
+            back = _back_in_stock(totals)
+            if back:
+                _availability_changed(back)
+        released += len(rows)
@@ -68,15 +68,30 @@ class CartSerializer(serializers.Serializer):
 # ============================================
 #  4. ORDER SERIALIZERS
 # ============================================
+def snapshot_images(item):
+    """The order line's image snapshot in the product images format."""
+    return [{"src": item.image, "alt": item.title}] if item.image else []
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
-    """Represents a single item in an order."""
-    product = ProductSerializer(read_only=True)
+    """Represents a single item in an order (from the line's product snapshot)."""
+    product = serializers.SerializerMethodField()
     amount = serializers.SerializerMethodField()
 
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'qty', 'price_at_order', 'amount']
 
+    def get_product(self, obj):
+        """Product as it was at checkout; the live catalog is not read."""
+        return {
+            "id": obj.product_id,
+            "title": obj.title,
+            "slug": obj.slug,
+            "price": float(obj.price_at_order),
+            "images": snapshot_images(obj),
+        }
+
     def get_amount(self, obj):
         """Calculates the total amount for a specific items."""
         return float(obj.qty * obj.price_at_order)
@@ -103,24 +118,19 @@ class OrderDetailSerializer(serializers.ModelSerializer):
             return 0.0
 
     def get_products(self, obj):
-        """Returns a detailed product list for this order."""
-        products_data = []
-        for item in obj.items.all():
-            product = item.product
-            images = ProductImageSerializer(
-                getattr(product, "images", []).all() if hasattr(product, "images") else [],
-                many=True
-            ).data
-
-            products_data.append({
-                "id": product.id,
-                "title": product.title,
-                "slug": product.slug,
+        """Returns a detailed product list for this order (from the line snapshots)."""
+        return [
+            {
+                "id": item.product_id,
+                "category": item.category_id,
+                "title": item.title,
+                "slug": item.slug,
                 "price": float(item.price_at_order),
                 "qty": item.qty,
-                "images": images,
-            })
-        return products_data
+                "images": snapshot_images(item),
+            }
+            for item in obj.items.all()
+        ]
 
 
 class OrderCreateSerializer(serializers.ModelSerializer):
@@ -0,0 +1,20 @@
+"""Background tasks of the orders app (see taskqueue.queue)."""
+from taskqueue.queue import Retry, task
+
+from . import payments, reservations
+
+
+@task()
+def charge_payment(payment_id):
+    """One charge attempt; a retryable gateway failure schedules the next one."""
+    delay = payments.process_payment(payment_id)
+    if delay is not None:
+        # payments counts its own attempts, the task only waits for the backoff
+        raise Retry(delay)
+
+
+@task()
+def release_expired_reservations():
+    """Releases expired stock holds and queues the next run for the earliest remaining one."""
+    reservations.release_expired()
+    reservations.schedule_reaper()
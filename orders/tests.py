@@ -1,3 +1,824 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from catalog.cache import forget_snapshots
+from catalog.models import Category, Product, ProductImage
+from taskqueue.models import Task, TaskStatus
+from taskqueue.queue import run_pending
+from .cart import (
+    CartLine, CartOwner, KeyValueCartStorage, LocalKeyValueStore, ORMCartStorage, get_storage,
+)
+from . import payments
+from .idempotency import lru
+from .models import CartItem, Order, OrderItem, OrderStatus, Payment, PaymentStatus, StockReservation
+from .payments import BasePaymentGateway, ChargeResult, GatewayError
+from .tasks import charge_payment, release_expired_reservations
+
+
+def clear_caches():
+    for cache in caches.all(initialized_only=True):
+        cache.clear()
+    forget_snapshots()
+
+
+class CheckoutConditionalTests(TestCase):
+    """Checkout changes the stock, so the product detail must stop matching old validators."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", slug="laptops")
+        cls.product = Product.objects.create(
+            category=category, title="Laptop", slug="laptop", price=Decimal("100.00"), count=3,
+        )
+
+    def setUp(self):
+        clear_caches()
+
+    def test_checkout_moves_product_detail_etag(self):
+        url = f"/api/product/{self.product.pk}"
+        before = self.client.get(url)
+        self.assertEqual(before.status_code, 200)
+        self.assertEqual(before.json()["count"], 3)
+        old_etag = before["ETag"]
+
+        self.client.post("/api/basket", {"id": self.product.pk, "count": 2}, content_type="application/json")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/orders/checkout", {}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+
+        after = self.client.get(url, HTTP_IF_NONE_MATCH=old_etag)
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after.json()["count"], 1)
+        self.assertNotEqual(after["ETag"], old_etag)
+
+    def test_checkout_moves_home_etag(self):
+        before = self.client.get("/api/home")
+        self.assertEqual(before.json()["popular"][0]["count"], 3)
+
+        self.client.post("/api/basket", {"id": self.product.pk, "count": 1}, content_type="application/json")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/orders/checkout", {}, content_type="application/json")
+
+        after = self.client.get("/api/home", HTTP_IF_NONE_MATCH=before["ETag"])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after.json()["popular"][0]["count"], 2)
+
+
+class BasketTests(TestCase):
+    """The basket is rebuilt from the storage after every change."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", slug="laptops")
+        cls.products = [
+            Product.objects.create(
+                category=category, title=f"Laptop {i}", slug=f"laptop-{i}", price=Decimal("100.00"), count=10,
+            )
+            for i in range(3)
+        ]
+        cls.user = User.objects.create_user("buyer", password="secret")
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_login(self.user)
+
+    def add(self, product, count=1):
+        return self.client.post("/api/basket", {"id": product.pk, "count": count}, content_type="application/json")
+
+    def remove(self, product, count=1):
+        return self.client.delete("/api/basket", {"id": product.pk, "count": count}, content_type="application/json")
+
+    def basket(self):
+        return [(line["id"], line["count"]) for line in self.client.get("/api/basket").json()]
+
+    def test_add_and_remove(self):
+        first, second, _ = self.products
+        self.add(first, 2)
+        response = self.add(second)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(line["id"], line["count"]) for line in response.json()], [(second.pk, 1), (first.pk, 2)])
+
+        self.assertEqual([(line["id"], line["count"]) for line in self.remove(first).json()],
+                         [(first.pk, 1), (second.pk, 1)])
+        self.assertEqual([line["id"] for line in self.remove(first).json()], [second.pk])
+        self.assertEqual(self.basket(), [(second.pk, 1)])
+        self.assertEqual(self.remove(first).status_code, 404)
+
+    def test_change_from_another_request_is_kept(self):
+        first, second, third = self.products
+        self.add(first)
+        self.basket()  # lines are cached now
+        # another request (another worker) adds a line behind this one's back
+        get_storage().add(CartOwner("user", str(self.user.pk)), second, 1)
+        response = self.add(third)
+        self.assertEqual(sorted(line["id"] for line in response.json()), sorted(p.pk for p in self.products))
+
+    def test_follows_product_changes(self):
+        product = self.products[0]
+        self.add(product)
+        self.basket()
+        product.title = "Renamed"
+        product.price = Decimal("90.00")
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        line = self.client.get("/api/basket").json()[0]
+        self.assertEqual((line["title"], line["price"]), ("Renamed", 90.0))
+
+    def test_failed_checkout_rolls_back_cart(self):
+        first, second, _ = self.products
+        self.add(first)
+        self.add(second, 2)
+        # the cart rows are emptied in the order's transaction, so nothing is put back by hand
+        with mock.patch("orders.views.place_order", side_effect=RuntimeError("database gone")), \
+                mock.patch.object(ORMCartStorage, "restore") as restore, \
+                self.assertRaises(RuntimeError):
+            self.client.post("/api/orders/checkout", {}, content_type="application/json")
+        restore.assert_not_called()
+        self.assertEqual(self.basket(), [(second.pk, 2), (first.pk, 1)])
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_guest_read_creates_no_session(self):
+        self.client.logout()
+        response = self.client.get("/api/basket")
+        self.assertEqual(response.json(), [])
+        self.assertNotIn("sessionid", response.cookies)
+
+
+class CartStorageContract:
+    """The same behaviour from every cart backend; subclasses provide make_storage()."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", slug="laptops")
+        cls.products = [
+            Product.objects.create(
+                category=category, title=f"Laptop {i}", slug=f"laptop-{i}", price=Decimal(f"{i + 1}00.00"),
+            )
+            for i in range(3)
+        ]
+        cls.user = User.objects.create_user("buyer", password="secret")
+
+    def setUp(self):
+        self.storage = self.make_storage()
+        self.owner = CartOwner("session", "abc")
+
+    def test_add_keeps_first_price(self):
+        first, second, _ = self.products
+        self.assertEqual(self.storage.add(self.owner, first, 2), 2)
+        self.storage.add(self.owner, second, 1)
+        first.price = Decimal("1.00")
+        self.assertEqual(self.storage.add(self.owner, first, 1), 3)
+        # most recently changed first
+        self.assertEqual(self.storage.lines(self.owner), [
+            CartLine(first.pk, 3, Decimal("100.00")),
+            CartLine(second.pk, 1, Decimal("200.00")),
+        ])
+
+    def test_remove(self):
+        product = self.products[0]
+        self.storage.add(self.owner, product, 2)
+        self.assertEqual(self.storage.remove(self.owner, product.pk, 1), 1)
+        self.assertEqual(self.storage.remove(self.owner, product.pk, 5), 0)
+        self.assertIsNone(self.storage.remove(self.owner, product.pk, 1))
+        self.assertEqual(self.storage.lines(self.owner), [])
+
+    def test_owners_are_separate(self):
+        other = CartOwner("user", str(self.user.pk))
+        self.storage.add(self.owner, self.products[0], 1)
+        self.storage.add(other, self.products[1], 1)
+        self.assertEqual([line.product_id for line in self.storage.lines(other)], [self.products[1].pk])
+
+    def test_pop_all_and_restore(self):
+        for product in self.products:
+            self.storage.add(self.owner, product, 1)
+        lines = self.storage.pop_all(self.owner)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(self.storage.lines(self.owner), [])
+        self.assertEqual(self.storage.pop_all(self.owner), [])
+
+        self.storage.restore(self.owner, lines)
+        self.assertEqual(sorted(self.storage.lines(self.owner)), sorted(lines))
+
+
+class ORMCartStorageTests(CartStorageContract, TestCase):
+    def make_storage(self):
+        return ORMCartStorage()
+
+
+class KeyValueCartStorageTests(CartStorageContract, TestCase):
+    def make_storage(self):
+        KeyValueCartStorage._local_store = LocalKeyValueStore()
+        return KeyValueCartStorage()
+
+    def test_abandoned_cart_expires(self):
+        storage = KeyValueCartStorage(ttl=0)
+        storage.add(self.owner, self.products[0], 1)
+        self.assertEqual(storage.lines(self.owner), [])
+
+    def test_no_cart_rows(self):
+        self.storage.add(self.owner, self.products[0], 1)
+        self.assertFalse(CartItem.objects.exists())
+
+
+@override_settings(CART_STORAGE={'BACKEND': 'orders.cart.KeyValueCartStorage'})
+class KeyValueBasketTests(TestCase):
+    """Basket and checkout on the key-value backend: no CartItem rows at all."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", slug="laptops")
+        cls.product = Product.objects.create(
+            category=category, title="Laptop", slug="laptop", price=Decimal("100.00"), count=5,
+        )
+
+    def setUp(self):
+        clear_caches()
+        KeyValueCartStorage._local_store = LocalKeyValueStore()
+
+    def test_basket_to_order(self):
+        self.client.post("/api/basket", {"id": self.product.pk, "count": 2}, content_type="application/json")
+        basket = self.client.get("/api/basket").json()
+        self.assertEqual([(line["id"], line["count"]) for line in basket], [(self.product.pk, 2)])
+        self.assertFalse(CartItem.objects.exists())
+
+        response = self.client.post("/api/orders/checkout", {}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.json()["orderId"])
+        self.assertEqual([(item.product_id, item.qty) for item in order.items.all()], [(self.product.pk, 2)])
+        self.assertEqual(self.client.get("/api/basket").json(), [])
+
+
+class OrderHistoryTests(TestCase):
+    """Order history is a full list or keyset pages; order detail costs the same for any size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", slug="laptops")
+        cls.products = [
+            Product.objects.create(
+                category=category, title=f"Laptop {i}", slug=f"laptop-{i}", price=Decimal("100.00"),
+            )
+            for i in range(5)
+        ]
+        cls.user = User.objects.create_user("buyer", password="secret")
+        other = User.objects.create_user("other", password="secret")
+        cls.orders = [Order.objects.create(user=cls.user) for _ in range(25)]
+        # equal timestamps: the page boundary falls inside a tie, broken by id
+        Order.objects.filter(pk__in=[o.pk for o in cls.orders[12:18]]).update(
+            created_at=cls.orders[12].created_at,
+        )
+        cls.foreign = Order.objects.create(user=other)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def page(self, **params):
+        response = self.client.get("/api/orders", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_newest_first(self):
+        expected = [o.pk for o in Order.objects.filter(user=self.user).order_by("-created_at", "-id")]
+        seen, cursor, pages = [], None, []
+        while True:
+            page = self.page(limit=10, **({"cursor": cursor} if cursor else {}))
+            pages.append(page)
+            seen += [item["id"] for item in page["items"]]
+            cursor = page["nextCursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+        self.assertEqual([len(p["items"]) for p in pages], [10, 10, 5])
+        self.assertNotIn("items", pages[0]["items"][0])
+
+        back = self.page(limit=10, cursor=pages[2]["prevCursor"])
+        self.assertEqual(back["items"], pages[1]["items"])
+        self.assertIsNone(pages[0]["prevCursor"])
+
+    def test_full_list_by_default(self):
+        order = self.order_with_lines(2)
+        expected = [o.pk for o in Order.objects.filter(user=self.user).order_by("-created_at", "-id")]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/orders")
+        orders = response.json()
+        self.assertIsInstance(orders, list)
+        self.assertEqual([o["id"] for o in orders], expected)
+        items = next(o["items"] for o in orders if o["id"] == order.pk)
+        self.assertEqual(len(items), 2)
+        # items are prefetched, not loaded per order
+        self.assertLess(len(queries), 10)
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get("/api/orders", {"cursor": "nonsense"}).status_code, 404)
+
+    def order_with_lines(self, count):
+        order = Order.objects.create(user=self.user)
+        for product in self.products[:count]:
+            OrderItem.objects.create(order=order, product=product, qty=1, price_at_order=product.price)
+        return order
+
+    def test_detail_query_count(self):
+        small, large = self.order_with_lines(1), self.order_with_lines(5)
+        with CaptureQueriesContext(connection) as small_queries:
+            self.client.get(f"/api/orders/{small.pk}")
+        with CaptureQueriesContext(connection) as large_queries:
+            response = self.client.get(f"/api/orders/{large.pk}")
+        self.assertEqual(len(response.json()["items"]), 5)
+        self.assertEqual(len(large_queries), len(small_queries))
+
+    def test_foreign_order(self):
+        self.assertNotIn(self.foreign.pk, [item["id"] for item in self.page(limit=100)["items"]])
+        self.assertEqual(self.client.get(f"/api/orders/{self.foreign.pk}").status_code, 404)
+
+
+class OrderSnapshotTests(TestCase):
+    """Order lines keep the product as it was at checkout; the detail reads no catalog tables."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Laptops", slug="laptops")
+        cls.product = Product.objects.create(
+            category=cls.category, title="Laptop", slug="laptop", price=Decimal("100.00"), count=5,
+        )
+        ProductImage.objects.create(product=cls.product, src="catalog/product-images/first.png")
+        ProductImage.objects.create(product=cls.product, src="catalog/product-images/second.png")
+        cls.user = User.objects.create_user("buyer", password="secret")
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_login(self.user)
+
+    def test_detail_shows_product_at_checkout(self):
+        self.client.post("/api/basket", {"id": self.product.pk, "count": 2}, content_type="application/json")
+        order_id = self.client.post("/api/orders/checkout", {}, content_type="application/json").json()["orderId"]
+
+        other = Category.objects.create(name="Sale", slug="sale")
+        Product.objects.filter(pk=self.product.pk).update(title="Renamed", price=Decimal("1.00"), category=other)
+        ProductImage.objects.filter(product=self.product).delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/orders/{order_id}")
+        self.assertFalse([q["sql"] for q in queries if "catalog_" in q["sql"]])
+        line = response.json()["products"][0]
+        self.assertEqual(
+            (line["title"], line["slug"], line["price"], line["qty"], line["category"]),
+            ("Laptop", "laptop", 100.0, 2, self.category.pk),
+        )
+        self.assertEqual([image["src"] for image in line["images"]], ["/media/catalog/product-images/first.png"])
+        self.assertEqual(response.json()["items"][0]["product"]["title"], "Laptop")
+
+    def test_save_fills_snapshot(self):
+        order = Order.objects.create(user=self.user)
+        item = OrderItem.objects.create(order=order, product=self.product, qty=1, price_at_order=Decimal("100.00"))
+        self.assertEqual((item.title, item.slug, item.category_id), ("Laptop", "laptop", self.category.pk))
+        self.assertTrue(item.image.endswith("first.png"))
+
+
+COOKIE_CARTS = {
+    'BACKEND': 'orders.cart.ORMCartStorage',
+    'GUEST_BACKEND': 'orders.cart.SignedCookieCartStorage',
+}
+
+
+class GuestSessionTests(TestCase):
+    """Guests get a session (or a cart cookie) only when they change the cart."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", slug="laptops")
+        cls.products = [
+            Product.objects.create(
+                category=category, title=f"Laptop {i}", slug=f"laptop-{i}", price=Decimal("100.00"), count=10,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        clear_caches()
+
+    def add(self, product, count=1):
+        return self.client.post("/api/basket", {"id": product.pk, "count": count}, content_type="application/json")
+
+    def test_reads_create_no_session(self):
+        responses = [
+            self.client.get("/api/basket"),
+            self.client.get("/api/orders"),
+            self.client.get("/api/orders/1"),
+            self.client.delete("/api/basket", {"id": self.products[0].pk}, content_type="application/json"),
+            self.client.post("/api/orders/checkout", {}, content_type="application/json"),
+        ]
+        self.assertEqual([r.status_code for r in responses], [200, 200, 404, 404, 400])
+        self.assertEqual(responses[1].json(), [])
+        self.assertFalse(any("sessionid" in r.cookies for r in responses))
+        self.assertFalse(Session.objects.exists())
+
+    def test_add_creates_one_session(self):
+        self.assertIn("sessionid", self.add(self.products[0]).cookies)
+        self.add(self.products[1])
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(len(self.client.get("/api/basket").json()), 2)
+
+    @override_settings(CART_STORAGE={**COOKIE_CARTS, 'GUEST_OPTIONS': {'max_lines': 2}})
+    def test_cookie_cart(self):
+        first, second, third = self.products
+        self.add(first, 2)
+        response = self.add(second)
+        self.assertNotIn("sessionid", response.cookies)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual([(line["id"], line["count"]) for line in self.client.get("/api/basket").json()],
+                         [(second.pk, 1), (first.pk, 2)])
+
+        # the cookie is full
+        self.assertEqual(self.add(third).status_code, 400)
+        self.assertEqual(len(self.client.get("/api/basket").json()), 2)
+
+        # checkout needs a session to find the order later
+        response = self.client.post("/api/orders/checkout", {}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(self.client.get(f"/api/orders/{response.json()['orderId']}").status_code, 200)
+        self.assertEqual(self.client.get("/api/basket").json(), [])
+
+    @override_settings(CART_STORAGE=COOKIE_CARTS)
+    def test_tampered_cookie_is_dropped(self):
+        self.add(self.products[0])
+        self.client.cookies["cart"] = self.client.cookies["cart"].value + "x"
+        self.assertEqual(self.client.get("/api/basket").json(), [])
+
+
+class IdempotentCheckoutTests(TestCase):
+    """Idempotency-Key replays are scoped to the cart owner."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", slug="laptops")
+        cls.product = Product.objects.create(
+            category=category, title="Laptop", slug="laptop", price=Decimal("100.00"), count=10,
+        )
+
+    def setUp(self):
+        clear_caches()
+        lru.clear()
+
+    def add(self, client):
+        client.post("/api/basket", {"id": self.product.pk, "count": 1}, content_type="application/json")
+
+    def checkout(self, client, key="key-1", body=None):
+        return client.post("/api/orders/checkout", body or {}, content_type="application/json",
+                           HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay(self):
+        self.add(self.client)
+        first = self.checkout(self.client)
+        self.assertEqual(first.status_code, 201)
+        second = self.checkout(self.client)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        lru.clear()  # from the table this time
+        self.assertEqual(self.checkout(self.client).json(), first.json())
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_reuse_with_different_body(self):
+        self.add(self.client)
+        self.checkout(self.client, body={"comment": "a"})
+        response = self.checkout(self.client, body={"comment": "b"})
+        self.assertEqual(response.status_code, 422)
+
+    def test_guests_do_not_share_keys(self):
+        other = self.client_class()
+        self.add(self.client)
+        self.add(other)
+        mine, theirs = self.checkout(self.client), self.checkout(other)
+        self.assertEqual((mine.status_code, theirs.status_code), (201, 201))
+        self.assertNotIn("Idempotent-Replayed", theirs)
+        self.assertNotEqual(mine.json(), theirs.json())
+
+    def test_guest_without_cart_is_rejected(self):
+        response = self.checkout(self.client)
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("sessionid", response.cookies)
+
+    @override_settings(CART_STORAGE=COOKIE_CARTS)
+    def test_cookie_cart_scope_is_stable(self):
+        self.add(self.client)
+        self.assertIn("cart", self.client.cookies)
+        # checkout starts a session for the order, the scope stays the cart
+        first = self.checkout(self.client)
+        self.assertEqual(first.status_code, 201)
+        second = self.checkout(self.client)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(second.json(), first.json())
+
+
+class ReservationTests(TestCase):
+    """Basket adds hold stock; holds are released on failure and on expiry."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", slug="laptops")
+        cls.product = Product.objects.create(
+            category=category, title="Laptop", slug="laptop", price=Decimal("100.00"), count=2,
+        )
+
+    def setUp(self):
+        clear_caches()
+
+    def add(self, client, count=1):
+        return client.post("/api/basket", {"id": self.product.pk, "count": count}, content_type="application/json")
+
+    def reserved(self):
+        self.product.refresh_from_db()
+        return self.product.reserved_count
+
+    def expire_all(self):
+        past = timezone.now() - timedelta(seconds=1)
+        StockReservation.objects.update(expires_at=past)
+        Task.objects.filter(status=TaskStatus.QUEUED).update(run_at=past)
+
+    def test_out_of_stock(self):
+        self.assertEqual(self.add(self.client, 2).status_code, 200)
+        response = self.add(self.client_class())
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["available"], 0)
+        self.assertEqual(self.reserved(), 2)
+
+    def test_failed_add_releases_hold(self):
+        with mock.patch.object(ORMCartStorage, "add", side_effect=RuntimeError("storage down")):
+            with self.assertRaises(RuntimeError):
+                self.add(self.client)
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def catalog_etag(self):
+        return self.client.get("/api/catalog", HTTP_ACCEPT="application/json")["ETag"]
+
+    def remove(self, client, count=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            return client.delete("/api/basket", {"id": self.product.pk, "count": count},
+                                 content_type="application/json")
+
+    def test_release_with_stock_left_keeps_catalog(self):
+        self.add(self.client)
+        etag = self.catalog_etag()
+        self.assertEqual(self.remove(self.client).status_code, 200)
+        self.assertEqual(self.reserved(), 0)
+        self.assertEqual(self.catalog_etag(), etag)
+
+        # expired holds of products that still had free stock: same
+        self.add(self.client)
+        etag = self.catalog_etag()
+        self.expire_all()
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending()
+        self.assertEqual(self.reserved(), 0)
+        self.assertEqual(self.catalog_etag(), etag)
+
+    def test_release_back_in_stock_moves_catalog(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add(self.client, 2)
+        etag = self.catalog_etag()
+        self.remove(self.client)
+        self.assertNotEqual(self.catalog_etag(), etag)
+
+    def test_reaper_is_queued_once(self):
+        self.add(self.client)
+        self.add(self.client_class())
+        reapers = Task.objects.filter(name=release_expired_reservations.name, status=TaskStatus.QUEUED)
+        self.assertEqual(reapers.count(), 1)
+        hold = StockReservation.objects.order_by("expires_at").first()
+        self.assertAlmostEqual(reapers.get().run_at, hold.expires_at, delta=timedelta(seconds=1))
+
+    def test_expiry(self):
+        self.add(self.client)
+        self.expire_all()
+        self.add(self.client_class())  # a live hold, expiring later
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(run_pending(), 1)
+        self.assertEqual(self.reserved(), 1)
+        # the reaper queued itself for the remaining hold
+        next_run = Task.objects.get(name=release_expired_reservations.name, status=TaskStatus.QUEUED)
+        self.assertAlmostEqual(next_run.run_at, StockReservation.objects.get().expires_at,
+                               delta=timedelta(seconds=1))
+
+        self.expire_all()
+        run_pending()
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(Task.objects.filter(status=TaskStatus.QUEUED).exists())
+
+
+class ScriptedGateway(BasePaymentGateway):
+    """
+    Answers charges from a list: 'ok', 'decline', 'error' (GatewayError) or
+    'crash' (the money is taken, then the worker dies). Like a real provider,
+    it answers a repeated idempotency key with the first result.
+    """
+    script = []
+    charged = []
+    keys = []
+    statuses = []
+    results = {}
+
+    def charge(self, payment, idempotency_key):
+        ScriptedGateway.keys.append(idempotency_key)
+        # the payment as it is stored while the call is in flight
+        ScriptedGateway.statuses.append(Payment.objects.get(pk=payment.pk).status)
+        if idempotency_key in ScriptedGateway.results:
+            return ScriptedGateway.results[idempotency_key]
+        ScriptedGateway.charged.append(payment.pk)
+        outcome = ScriptedGateway.script.pop(0) if ScriptedGateway.script else 'ok'
+        if outcome == 'error':
+            raise GatewayError('Gateway timeout')
+        if outcome == 'decline':
+            result = ChargeResult(ok=False, error='Payment declined')
+        else:
+            result = ChargeResult(ok=True, transaction_id=f'tx-{payment.pk}')
+        ScriptedGateway.results[idempotency_key] = result
+        if outcome == 'crash':
+            raise SystemExit('worker killed')
+        return result
+
+
+@override_settings(PAYMENTS={'GATEWAY': 'orders.tests.ScriptedGateway', 'MAX_ATTEMPTS': 3, 'BACKOFF': 0, 'LEASE': 60})
+class PaymentTests(TestCase):
+    """Payments are charged by the task queue: retried with backoff, leased against double charges."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", password="secret")
+
+    def setUp(self):
+        ScriptedGateway.script, ScriptedGateway.charged, ScriptedGateway.keys = [], [], []
+        ScriptedGateway.statuses, ScriptedGateway.results = [], {}
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal("100.00"))
+        self.client.force_login(self.user)
+
+    def pay(self):
+        return self.client.post(f"/api/orders/{self.order.pk}", {}, content_type="application/json")
+
+    def state(self):
+        status = self.client.get(f"/api/orders/{self.order.pk}/status").json()
+        return status["status"], status["payment"] and status["payment"]["status"]
+
+    def test_paid_in_background(self):
+        response = self.pay()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.state(), (OrderStatus.PROCESSING, PaymentStatus.PENDING))
+        self.assertEqual(ScriptedGateway.charged, [])
+
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(self.state(), (OrderStatus.PAID, PaymentStatus.SUCCEEDED))
+        self.assertEqual(Payment.objects.get().transaction_id, f"tx-{Payment.objects.get().pk}")
+        # paying again does nothing
+        self.assertEqual(self.pay().json()["status"], OrderStatus.PAID)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_second_request_joins_payment_in_flight(self):
+        self.pay()
+        self.assertEqual(self.pay().status_code, 202)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(Task.objects.filter(name=charge_payment.name).count(), 1)
+
+    def test_gateway_errors_are_retried(self):
+        ScriptedGateway.script = ['error', 'error', 'ok']
+        self.pay()
+        run_pending()
+        payment = Payment.objects.get()
+        self.assertEqual((payment.status, payment.attempts), (PaymentStatus.SUCCEEDED, 3))
+        self.assertEqual(self.state()[0], OrderStatus.PAID)
+        # the task waited for the backoff, it did not use up its own attempts
+        task = Task.objects.get(name=charge_payment.name)
+        self.assertEqual((task.status, task.attempts), (TaskStatus.DONE, 1))
+
+    @override_settings(PAYMENTS={'GATEWAY': 'orders.tests.ScriptedGateway', 'MAX_ATTEMPTS': 3, 'BACKOFF': 30})
+    def test_backoff(self):
+        ScriptedGateway.script = ['error']
+        self.pay()
+        self.assertEqual(run_pending(), 1)
+        payment = Payment.objects.get()
+        self.assertEqual(payment.status, PaymentStatus.PENDING)
+        self.assertAlmostEqual(payment.next_attempt_at, timezone.now() + timedelta(seconds=30),
+                               delta=timedelta(seconds=1))
+        self.assertAlmostEqual(Task.objects.get(name=charge_payment.name).run_at, payment.next_attempt_at,
+                               delta=timedelta(seconds=1))
+
+    def test_attempts_exhausted(self):
+        ScriptedGateway.script = ['error'] * 3
+        self.pay()
+        run_pending()
+        payment = Payment.objects.get()
+        self.assertEqual((payment.status, payment.attempts), (PaymentStatus.FAILED, 3))
+        self.assertIn("attempts exhausted", payment.last_error)
+        self.assertEqual(self.state()[0], OrderStatus.CANCELED)
+
+    def test_decline(self):
+        ScriptedGateway.script = ['decline']
+        self.pay()
+        run_pending()
+        self.assertEqual(self.state(), (OrderStatus.CANCELED, PaymentStatus.FAILED))
+        self.assertEqual(len(ScriptedGateway.charged), 1)
+
+    def test_lease(self):
+        self.pay()
+        payment = Payment.objects.get()
+        # another worker holds the payment
+        Payment.objects.filter(pk=payment.pk).update(
+            status=PaymentStatus.PROCESSING, locked_until=timezone.now() + timedelta(seconds=60),
+        )
+        self.assertAlmostEqual(payments.process_payment(payment.pk), 60, delta=1)
+        self.assertEqual(ScriptedGateway.charged, [])
+
+        # ... and died: once the lease runs out the payment is charged again
+        Payment.objects.filter(pk=payment.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(payments.process_payment(payment.pk))
+        self.assertEqual(ScriptedGateway.charged, [payment.pk])
+        self.assertEqual(self.state(), (OrderStatus.PAID, PaymentStatus.SUCCEEDED))
+
+
+    def test_same_key_on_every_attempt(self):
+        ScriptedGateway.script = ['error', 'ok']
+        self.pay()
+        run_pending()
+        payment = Payment.objects.get()
+        self.assertEqual(ScriptedGateway.keys, [f"payment-{payment.pk}"] * 2)
+        self.assertEqual(ScriptedGateway.statuses, [PaymentStatus.CHARGING] * 2)
+
+    def test_crash_after_charge_is_not_charged_twice(self):
+        ScriptedGateway.script = ['crash']
+        self.pay()
+        payment = Payment.objects.get()
+        with self.assertRaises(SystemExit):
+            payments.process_payment(payment.pk)
+        # the money may be gone: the payment says so
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.CHARGING)
+
+        # the lease runs out and another worker repeats the charge under the same key
+        Payment.objects.filter(pk=payment.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(payments.process_payment(payment.pk))
+        self.assertEqual(ScriptedGateway.keys, [f"payment-{payment.pk}"] * 2)
+        self.assertEqual(ScriptedGateway.charged, [payment.pk])
+        self.assertEqual(self.state(), (OrderStatus.PAID, PaymentStatus.SUCCEEDED))
+
+    def test_only_owner_can_pay(self):
+        other = self.client_class()
+        other.force_login(User.objects.create_user("other", password="secret"))
+        guest = self.client_class()
+        for client in (other, guest):
+            response = client.post(f"/api/orders/{self.order.pk}", {}, content_type="application/json")
+            self.assertEqual(response.status_code, 404)
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, OrderStatus.NEW)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Two checkouts racing for the last unit: exactly one of them gets it."""
+
+    def setUp(self):
+        clear_caches()
+        category = Category.objects.create(name="Laptops", slug="laptops")
+        self.product = Product.objects.create(
+            category=category, title="Laptop", slug="laptop", price=Decimal("100.00"), count=1,
+        )
+        # lines put straight into the carts: no holds, so both reach the stock UPDATE
+        self.clients = []
+        for name in ("first", "second"):
+            user = User.objects.create_user(name, password="secret")
+            get_storage().add(CartOwner("user", str(user.pk)), self.product, 1)
+            client = Client()
+            client.force_login(user)
+            self.clients.append(client)
+
+    def test_one_unit_two_buyers(self):
+        barrier = threading.Barrier(len(self.clients))
+        statuses = []
+
+        def checkout(client):
+            try:
+                barrier.wait()
+                response = client.post("/api/orders/checkout", {}, content_type="application/json")
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(client,)) for client in self.clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [201, 409])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.count, self.product.reserved_count), (0, 0))
+        self.assertEqual(Order.objects.count(), 1)
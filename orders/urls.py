@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import BasketView, MyOrdersView, OrderDetailView, CheckoutView
+from .views import BasketView, MyOrdersView, OrderDetailView, OrderStatusView, CheckoutView
 
 urlpatterns = [
     path('basket', BasketView.as_view(), name='basket'),
@@ -7,6 +7,7 @@ urlpatterns = [
     # orders
     path('orders', MyOrdersView.as_view(), name='order-list'),
     path('orders/<int:pk>', OrderDetailView.as_view(), name='order-detail'),
+    path('orders/<int:pk>/status', OrderStatusView.as_view(), name='order-status'),
     path('orders/checkout', CheckoutView.as_view(), name='order-checkout'),
     path('order/<int:pk>', OrderDetailView.as_view(), name='order-detail-legacy'),
 ]
\ No newline at end of file
@@ -4,138 +4,185 @@
 # ==============================
 
 import json
-from django.db.models import Sum, F
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.urls import reverse
 from rest_framework import status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from catalog import cards
+from catalog.cache import shared_cache
 from catalog.models import Product
-from .models import CartItem, Order, OrderItem
+from catalog.pagination import KeysetPagination
+from . import payments, reservations
+from .cart import CartStorageError, get_cart, save_cart
+from .checkout import InsufficientStock, place_order
+from .idempotency import idempotent
+from .models import Order, OrderItem, OrderStatus, Payment
 from .serializers import (
     OrderCreateSerializer,
     OrderDetailSerializer,
+    OrderListSerializer,
 )
 
 
 # ==============================
-# Helper function for the cart
+# Helper functions for the cart
 # ==============================
-def get_cart_qs(request):
+def basket_cache_key(owner):
     """
-    Returns the cart QuerySet for the current user or session.
+    Cache key of the cart lines for the cart owner. Cookie carts are not
+    cached: their lines come with the request anyway.
     """
-    if request.user.is_authenticated:
-        return (
-            CartItem.objects
-            .select_related('product', 'user')
-            .filter(user=request.user)
-            .order_by('-update_at')
-        )
+    if owner is None or owner.kind == 'cookie':
+        return None
+    return f'orders:basket:{owner}'
+
 
-    if not request.session.session_key:
+def forget_basket(owner):
+    """Drops the cached lines; call it after every change to the stored cart."""
+    key = basket_cache_key(owner)
+    if key:
+        shared_cache.delete(key)
+
+
+def guest_session_key(request, create=False):
+    """Session key of an anonymous visitor, or None if they have no session yet."""
+    if not request.session.session_key and create:
         request.session.save()
-    sk = request.session.session_key
+    return request.session.session_key
 
-    return (
-        CartItem.objects
-        .select_related('product')
-        .filter(session_key=sk)
-        .order_by('-update_at')
-    )
+
+def owned_orders(request, qs=None):
+    """Orders of the current user or guest session; None for a guest without a session."""
+    qs = Order.objects.all() if qs is None else qs
+    if request.user.is_authenticated:
+        return qs.filter(user=request.user)
+    sk = guest_session_key(request)
+    if not sk:
+        return None
+    return qs.filter(session_key=sk)
+
+
+def basket_line(card, qty):
+    """One basket line in the format the frontend expects, from a cached product card."""
+    return {
+        "id": card["id"],
+        "category": card["category"],
+        "price": float(card["price"] or 0),
+        "count": int(qty),
+        "title": card["title"] or "",
+        "images": [
+            {"src": img["src"] or "", "alt": img["alt"]}
+            for img in card["images"]
+        ],  # always present, even if empty
+    }
+
+
+def cart_lines(storage, owner, use_cache=True):
+    """
+    Cart lines of the owner, cached per user/session for BASKET_CACHE_TTL
+    in the cache shared by all processes (a change made by one worker must
+    reach the others).
+    """
+    key = basket_cache_key(owner) if use_cache else None
+    lines = shared_cache.get(key) if key else None
+    if lines is None:
+        lines = storage.lines(owner)
+        if key:
+            shared_cache.set(key, lines, getattr(settings, 'BASKET_CACHE_TTL', 300))
+    return lines
+
+
+def build_basket(storage, owner, use_cache=True):
+    """
+    Basket lines from the cart storage. Product data comes from the card
+    cache (catalog.cards), which follows product changes, so only the
+    (product, qty) lines are cached here and a warm basket costs no catalog queries.
+    """
+    if owner is None:
+        return []
+    lines = cart_lines(storage, owner, use_cache)
+    if not lines:
+        return []
+    product_cards = {card["id"]: card for card in cards.get_cards([line.product_id for line in lines])}
+    return [
+        basket_line(product_cards[line.product_id], line.qty)
+        for line in lines if line.product_id in product_cards
+    ]
+
+
+def _parse_count(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return 1
+    return max(value, 1)
 
 
 # ==============================
 # /api/basket — main cart
 # ==============================
-class BasketView(APIView):
+class CartResponseMixin:
+    """Writes request-scoped cart state (the signed cookie cart) to every response."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return save_cart(request, response)
+
+
+class BasketView(CartResponseMixin, APIView):
+    """
+    The cart lines are cached per user/session. POST and DELETE change the
+    storage, drop the cached lines and answer with the basket rebuilt from
+    the storage, so concurrent changes are never overwritten.
+    Reading the basket never creates a session for a guest.
+    """
     permission_classes = [permissions.AllowAny]
 
+    def changed_basket(self, storage, owner):
+        forget_basket(owner)
+        return Response(build_basket(storage, owner, use_cache=False), status=200)
+
     def get(self, request):
         """
         Returns all items currently in the basket.
         """
-        items = []
-        for ci in get_cart_qs(request):
-            p = ci.product
-
-            # Collect images safely
-            images = []
-            try:
-                for img in p.images.all():
-                    src = getattr(img, "src", "")
-                    if hasattr(src, "url"):
-                        src = src.url
-                    alt = getattr(img, "alt", p.title)
-                    images.append({"src": src, "alt": alt})
-            except Exception:
-                    images = []
-
-            # Safe price and count conversion
-            price = getattr(p, "price", 0)
-            try:
-                price = float(price)
-            except Exception:
-                price = 0.0
-
-            count = getattr(ci, "qty", 1)
-            try:
-                count = int(count)
-            except Exception:
-                count = 1
-
-            items.append({
-                "id": int(p.id),
-                "category": getattr(p.category, "id", None),
-                "price": price,
-                "count": count,
-                "title": getattr(p, "title", ""),
-                "images": images,  # ✅ обязательно есть, даже если пустой
-            })
-
-        return Response(items, status=200)
+        return Response(build_basket(*get_cart(request)), status=200)
 
     # POST /api/basket
     def post(self, request):
         """
-        Adds a  product to the basket.
+        Adds a  product to the basket and reserves the stock for it.
         Expected data: {"id": product_id, "count": quantity}
+        409 if there is not enough free stock.
         """
         payload = request.data or {}
-        pid = payload.get("id")
-        cnt = payload.get("count", 1)
+        cnt = _parse_count(payload.get("count", 1))
 
         try:
-            from catalog.models import Product
-            product = Product.objects.get(id=pid)
-        except Exception:
+            product = Product.objects.get(id=payload.get("id"))
+        except (Product.DoesNotExist, ValueError, TypeError):
             return Response({"detail": "Product not found"}, status=404)
 
+        storage, owner = get_cart(request, create=True)
+        try:
+            reservations.reserve(str(owner), product, cnt)
+        except reservations.OutOfStock as exc:
+            return Response({"detail": "Not enough stock", "available": exc.available}, status=409)
         try:
-            cnt = int(cnt)
+            storage.add(owner, product, cnt)
+        except CartStorageError as exc:
+            reservations.release(str(owner), product.pk, cnt)
+            return Response({"detail": str(exc)}, status=400)
         except Exception:
-            cnt = 1
-        if cnt < 1:
-            cnt = 1
-
-        from orders.models import CartItem  # путь по твоему проекту
-        defaults = {"price_at_add": getattr(product, "price", 0)}
-
-        if request.user.is_authenticated:
-            obj, created = CartItem.objects.get_or_create(
-                user=request.user, product=product, defaults=defaults
-            )
-        else:
-            if not request.session.session_key:
-                request.session.save()
-            sk = request.session.session_key
-            obj, created = CartItem.objects.get_or_create(
-                session_key=sk, product=product, defaults=defaults
-            )
-
-        obj.qty = (obj.qty + cnt) if not created else cnt
-        obj.save()
+            # the hold must not outlive a failed add
+            reservations.release(str(owner), product.pk, cnt)
+            raise
 
-        return self.get(request)
+        return self.changed_basket(storage, owner)
 
     def delete(self, request):
         """
@@ -144,97 +191,133 @@ class BasketView(APIView):
         """
         payload = request.data or {}
         pid = payload.get("id")
-        dec = payload.get("count", 1)
+        dec = _parse_count(payload.get("count", 1))
 
         try:
-            dec = int(dec)
-        except Exception:
-            dec = 1
-        if dec < 1:
-            dec = 1
+            pid = int(pid)
+        except (ValueError, TypeError):
+            return Response({"detail": "Item not found"}, status=404)
 
-        qs = get_cart_qs(request).filter(product_id=pid)
-        if not qs.exists():
+        storage, owner = get_cart(request)
+        if owner is None:
             return Response({"detail": "Item not found"}, status=404)
 
-        item = qs.first()
-        new_qty = int(getattr(item, "qty", 1)) - dec
-        if new_qty > 0:
-            item.qty = new_qty
-            item.save()
-        else:
-            item.delete()
+        new_qty = storage.remove(owner, pid, dec)
+        if new_qty is None:
+            return Response({"detail": "Item not found"}, status=404)
+        reservations.release(str(owner), pid, None if new_qty == 0 else dec)
 
-        return self.get(request)
+        return self.changed_basket(storage, owner)
 
 # ==============================
 # /api/checkout — order creation
 # ==============================
-class CheckoutView(APIView):
+class CheckoutView(CartResponseMixin, APIView):
     permission_classes = [permissions.AllowAny]
 
+    @idempotent
     def post(self, request):
         """
         Creates an order based on the current basket.
+        Stock is taken atomically; if a line cannot be served, nothing is
+        ordered, the basket is kept and 409 lists the products concerned.
         """
-        qs = get_cart_qs(request)
-        # for item in qs:
-        #     print(f"Product: {item.product}, Qty: {item.qty}, Price: {item.price_at_add}")
-        # print("DEBUG CART:", qs)
-
-        if not qs.exists():
+        storage, owner = get_cart(request)
+        if owner is None:
             return Response({'detail': 'Your basket is empty'}, status=400)
 
-        agg = qs.aggregate(total=Sum(F('qty') * F('price_at_add')))
-        total_amount = agg['total'] or 0
+        if storage.transactional:
+            # the cart rows are deleted in the order's transaction: they come
+            # back by themselves if the order cannot be placed
+            try:
+                with transaction.atomic():
+                    lines = storage.pop_all(owner)
+                    order = self.place_order(request, owner, lines) if lines else None
+            except InsufficientStock as exc:
+                return self.out_of_stock(exc)
+            finally:
+                forget_basket(owner)
+        else:
+            # read and empty the cart in one step, so a concurrent request
+            # cannot order the same lines twice; put them back on failure
+            lines = storage.pop_all(owner)
+            forget_basket(owner)
+            try:
+                order = self.place_order(request, owner, lines) if lines else None
+            except InsufficientStock as exc:
+                storage.restore(owner, lines)
+                forget_basket(owner)
+                return self.out_of_stock(exc)
+            except Exception:
+                storage.restore(owner, lines)
+                forget_basket(owner)
+                raise
+
+        if order is None:
+            return Response({'detail': 'Your basket is empty'}, status=400)
+        return Response({'orderId': order.id}, status=status.HTTP_201_CREATED)
 
+    @staticmethod
+    def place_order(request, owner, lines):
+        """Places the order for the popped lines; raises InsufficientStock."""
         ser = OrderCreateSerializer(data={})
         ser.is_valid(raise_exception=False)
 
-        payload = {'total_amount': total_amount}
-
         if request.user.is_authenticated:
-            order = Order.objects.create(user=request.user, **payload)
+            owner_fields = {'user': request.user}
         else:
-            order = Order.objects.create(session_key=request.session.session_key, **payload)
-
-        items = [
-            OrderItem(
-                order=order,
-                product=ci.product,
-                qty=ci.qty,
-                price_at_order=ci.price_at_add
-            )
-            for ci in qs
-        ]
-        OrderItem.objects.bulk_create(items)
-
-        qs.delete()
-
-        return Response({'orderId': order.id}, status=status.HTTP_201_CREATED)
+            # the order is looked up by session later, so a cookie cart gets one now
+            owner_fields = {'session_key': guest_session_key(request, create=True)}
+        return place_order(lines, reservation_owner=str(owner), **owner_fields)
+
+    @staticmethod
+    def out_of_stock(exc):
+        return Response(
+            {'detail': 'Not enough stock', 'products': exc.product_ids},
+            status=status.HTTP_409_CONFLICT,
+        )
 
 
 # ==============================
 # /api/orders — orders list
 # ==============================
-class MyOrdersView(APIView):
+class OrderHistoryPagination(KeysetPagination):
+    """Keyset pages of order history, newest first."""
+    page_size = 10
+    default_ordering = ('-created_at', '-id')
+
+
+class MyOrdersView(CartResponseMixin, APIView):
     permission_classes = [permissions.AllowAny]
 
+    pagination_class = OrderHistoryPagination
+
+    def use_cursor_pagination(self):
+        params = self.request.query_params
+        return 'cursor' in params or 'limit' in params
+
     def get(self, request):
         """
-        Returns all orders for the current user or session
+        Returns the orders of the current user or session, newest first.
+        By default this is the full list with items, as the frontend expects;
+        with ?cursor=... or ?limit=... it is one keyset page without items
+        (they come from /api/orders/<pk>).
         """
-        if request.user.is_authenticated:
-            orders = Order.objects.filter(user=request.user).order_by('-created_at')
-        else:
-            if not request.session.session_key:
-                request.session.save()
-            sk = request.session.session_key
-            orders = Order.objects.filter(session_key=sk).order_by('-created_at')
+        orders = owned_orders(request)
+        if orders is None:
+            orders = Order.objects.none()
+        orders = orders.order_by('-created_at', '-id')
+
+        if not self.use_cursor_pagination():
+            orders = orders.prefetch_related(Prefetch('items', queryset=OrderItem.objects.order_by('id')))
+            return Response(OrderDetailSerializer(orders, many=True).data, status=200)
 
-        return Response(OrderDetailSerializer(orders, many=True).data, status=200)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(orders, request, view=self)
+        return paginator.get_paginated_response(OrderListSerializer(page, many=True).data)
 
     def post(self, request, *args, **kwargs):
+        # CheckoutView.post handles the Idempotency-Key header
         checkout_view = CheckoutView()
         return checkout_view.post(request)
 
@@ -249,13 +332,12 @@ class OrderDetailView(APIView):
         """
         Returns details of a specific order.
         """
-        qs = Order.objects.all()
-        if request.user.is_authenticated:
-            qs = qs.filter(user=request.user)
-        else:
-            if not request.session.session_key:
-                request.session.save()
-            qs = qs.filter(session_key=request.session.session_key)
+        # items carry a product snapshot, so the catalog tables are not joined
+        qs = owned_orders(
+            request, Order.objects.prefetch_related(Prefetch('items', queryset=OrderItem.objects.order_by('id')))
+        )
+        if qs is None:
+            return Response({'detail': 'Order not found'}, status=404)
 
         try:
             order = qs.get(pk=pk)
@@ -264,18 +346,60 @@ class OrderDetailView(APIView):
 
         return Response(OrderDetailSerializer(order).data, status=200)
 
+    @idempotent
     def post(self, request, pk):
         """
-        Marks the order as paid and returns redirect URL.
+        Starts the payment of the order in the background and returns at once
+        (202). The result is polled at /api/orders/<pk>/status.
+        Only the owner of the order can pay it, as with get().
         """
-        try:
-            order = Order.objects.get(pk=pk)
-        except Order.DoesNotExist:
+        qs = owned_orders(request)
+        order = qs.filter(pk=pk).first() if qs is not None else None
+        if order is None:
             return Response({'detail': 'Заказ не найден'}, status=404)
 
-        order.status = 'paid'
-        order.save(update_fields=['status'])
+        payment = payments.start_payment(order)
+        if payment is None:
+            return Response({
+                'detail': 'Заказ уже оплачен',
+                'status': OrderStatus.PAID,
+                'redirect_url': '/history-order/'
+            }, status=200)
         return Response({
-            'detail': 'Заказ успешно оплачен',
+            'detail': 'Платёж принят в обработку',
+            'status': OrderStatus.PROCESSING,
+            'status_url': reverse('order-status', args=[order.pk]),
             'redirect_url': '/history-order/'
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+# ==============================
+# /api/orders/{id}/status — payment status polling
+# ==============================
+class OrderStatusView(APIView):
+    """Cheap status endpoint for polling: two small indexed queries."""
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, pk):
+        qs = owned_orders(request)
+        if qs is None:
+            return Response({'detail': 'Order not found'}, status=404)
+
+        order_status = qs.filter(pk=pk).values_list('status', flat=True).first()
+        if order_status is None:
+            return Response({'detail': 'Order not found'}, status=404)
+        payment = (
+            Payment.objects.filter(order_id=pk)
+            .order_by('-id')
+            .values('status', 'attempts', 'last_error')
+            .first()
+        )
+        return Response({
+            'id': pk,
+            'status': order_status,
+            'payment': payment and {
+                'status': payment['status'],
+                'attempts': payment['attempts'],
+                'error': payment['last_error'],
+            },
         }, status=200)
\ No newline at end of file
@@ -0,0 +1,14 @@
+from django.contrib import admin
+
+from .models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'started_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'last_error')
+    readonly_fields = ('name', 'args', 'kwargs', 'attempts', 'max_attempts', 'locked_by',
+                       'locked_until', 'last_error', 'created_at', 'started_at', 'finished_at')
+    ordering = ('-created_at', )
+    list_per_page = 50
@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class TaskQueueConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'taskqueue'
+    verbose_name = 'Фоновые задачи'
+
+    def ready(self):
+        # задачи объявляются в <app>/tasks.py — регистрируем их в каждом процессе
+        autodiscover_modules('tasks')
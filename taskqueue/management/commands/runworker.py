@@ -0,0 +1,71 @@
+import os
+import signal
+import traceback
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from taskqueue import queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Запускает обработчики фоновых задач (taskqueue): N процессов забирают "
+        "задачи из таблицы Task. Остановка — SIGTERM/Ctrl+C, текущая задача дорабатывает."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=None, help="по умолчанию TASK_QUEUE['WORKERS']")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--poll-interval", type=float, default=None)
+        parser.add_argument("--once", action="store_true", help="выполнить готовые задачи и выйти")
+
+    def handle(self, *args, processes, batch_size, poll_interval, once, **options):
+        processes = processes or queue.get_config()["WORKERS"]
+        options = {"batch_size": batch_size, "poll_interval": poll_interval, "once": once}
+        if processes == 1 or not hasattr(os, "fork"):
+            done = self.run_worker(options)
+            self.stdout.write(self.style.SUCCESS(f"Worker {queue.worker_name()} ran {done} tasks"))
+            return
+
+        # дочерние процессы не должны унаследовать открытые соединения с БД
+        connections.close_all()
+        children = []
+        for _ in range(processes):
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    self.run_worker(options)
+                except BaseException:
+                    traceback.print_exc()
+                    code = 1
+                finally:
+                    connections.close_all()
+                    os._exit(code)
+            children.append(pid)
+        self.stdout.write(f"Started {processes} workers: {', '.join(map(str, children))}")
+
+        def forward(signum, frame):
+            for child in children:
+                try:
+                    os.kill(child, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+        failed = 0
+        for child in children:
+            _, status = os.waitpid(child, 0)
+            failed += os.waitstatus_to_exitcode(status) != 0
+        if failed:
+            self.stderr.write(self.style.ERROR(f"{failed} workers exited with an error"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Workers stopped"))
+
+    def run_worker(self, options):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+        return queue.work(should_stop=lambda: bool(stopping), **options)
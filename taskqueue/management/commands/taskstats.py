@@ -0,0 +1,57 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from taskqueue import queue
+from taskqueue.models import Task, TaskStatus
+
+
+def _percentile(values, share):
+    return values[min(int(len(values) * share), len(values) - 1)] if values else 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Статистика фоновых задач: очередь по статусам и задержки (ожидание в очереди, "
+        "выполнение) по задачам за последние часы. --purge удаляет старые завершённые задачи."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=float, default=24, help="окно для задержек")
+        parser.add_argument("--purge", type=float, default=None, metavar="DAYS",
+                            help="удалить выполненные и упавшие задачи старше DAYS дней")
+
+    def handle(self, *args, hours, purge, **options):
+        if purge is not None:
+            removed = queue.purge(timezone.now() - timedelta(days=purge))
+            self.stdout.write(self.style.SUCCESS(f"Removed {removed} finished tasks"))
+            return
+
+        counts = defaultdict(Counter)
+        for name, status in Task.objects.values_list("name", "status"):
+            counts[name][status] += 1
+        waits, runs = defaultdict(list), defaultdict(list)
+        for name, wait_ms, run_ms in (
+            Task.objects
+            .filter(status=TaskStatus.DONE, finished_at__gte=timezone.now() - timedelta(hours=hours))
+            .values_list("name", "wait_ms", "run_ms")
+        ):
+            waits[name].append(wait_ms or 0)
+            runs[name].append(run_ms or 0)
+
+        statuses = [status for status, _ in TaskStatus.choices]
+        self.stdout.write(
+            f"{'task':40} " + " ".join(f"{s:>8}" for s in statuses)
+            + f" {'wait p50':>9} {'wait p95':>9} {'run p50':>9} {'run p95':>9}"
+        )
+        for name in sorted(counts):
+            wait, run = sorted(waits[name]), sorted(runs[name])
+            self.stdout.write(
+                f"{name:40} " + " ".join(f"{counts[name][s]:>8}" for s in statuses)
+                + f" {_percentile(wait, 0.5):>7.0f}ms {_percentile(wait, 0.95):>7.0f}ms"
+                + f" {_percentile(run, 0.5):>7.0f}ms {_percentile(run, 0.95):>7.0f}ms"
+            )
+        due = Task.objects.filter(queue.due_condition(timezone.now())).count()
+        self.stdout.write(self.style.SUCCESS(f"{due} tasks due now"))
@@ -0,0 +1,46 @@
+from django.db import models
+
+
+class TaskStatus(models.TextChoices):
+    QUEUED = 'queued', 'В очереди'
+    RUNNING = 'running', 'Выполняется'
+    DONE = 'done', 'Выполнена'
+    FAILED = 'failed', 'Ошибка'
+
+
+class Task(models.Model):
+    """A queued call of a registered task function (see taskqueue.queue)."""
+    name = models.CharField(max_length=100, verbose_name='Задача')
+    args = models.JSONField(default=list, blank=True, verbose_name='Аргументы')
+    kwargs = models.JSONField(default=dict, blank=True, verbose_name='Именованные аргументы')
+    status = models.CharField(
+        max_length=10,
+        choices=TaskStatus.choices,
+        default=TaskStatus.QUEUED,
+        verbose_name='Статус'
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveSmallIntegerField(default=5, verbose_name='Максимум попыток')
+    run_at = models.DateTimeField(verbose_name='Запустить после')
+    locked_by = models.CharField(max_length=100, blank=True, default='', verbose_name='Воркер')
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name='Аренда до')
+    last_error = models.TextField(blank=True, default='', verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Начата')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Завершена')
+    # последний запуск: ожидание в очереди (от run_at до старта) и выполнение
+    wait_ms = models.FloatField(null=True, blank=True, verbose_name='Ожидание, мс')
+    run_ms = models.FloatField(null=True, blank=True, verbose_name='Выполнение, мс')
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ('-created_at', )
+        indexes = [
+            # выборка воркером: готовые к запуску и с истёкшей арендой
+            models.Index(fields=['status', 'run_at'], name='task_due_idx'),
+            models.Index(fields=['status', 'locked_until'], name='task_lease_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.id} ({self.get_status_display()})'
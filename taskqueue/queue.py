@@ -0,0 +1,286 @@
+"""
+Durable background tasks stored in the database.
+
+Declare a task in ``<app>/tasks.py``::
+
+    @task()
+    def charge_payment(payment_id):
+        ...
+
+and enqueue it with ``charge_payment.enqueue(payment.pk)``. enqueue()
+inserts a Task row with the caller's connection, so inside
+``transaction.atomic()`` the task is committed together with the data it
+refers to and is dropped on rollback (outbox pattern) - no after-commit
+hand-off that a crash can lose.
+
+``manage.py runworker`` runs N worker processes. A worker claims a batch
+of due tasks (``SELECT ... FOR UPDATE SKIP LOCKED`` where the database
+supports it, a conditional UPDATE always), holds them under a lease
+(``locked_until``) and runs them:
+
+* success -> ``done``;
+* an exception -> queued again with exponential backoff until the task's
+  ``max_attempts``, then ``failed``;
+* ``raise Retry(delay)`` -> queued again after delay, not counted as an
+  attempt (for tasks that poll an external state);
+* a worker that dies mid-task leaves the lease to expire; the task is then
+  claimed again.
+
+Tasks therefore run at least once and should be idempotent. Each run
+logs one JSON line to the ``taskqueue`` logger with the queue wait and
+run time; ``manage.py taskstats`` aggregates the same numbers from the
+table.
+"""
+import json
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task, TaskStatus
+
+logger = logging.getLogger('taskqueue')
+
+DEFAULTS = {
+    'WORKERS': 2,           # processes started by runworker
+    'BATCH_SIZE': 10,       # tasks claimed per query
+    'POLL_INTERVAL': 0.5,   # seconds a worker sleeps when the queue is empty
+    'LEASE': 300,           # seconds a claimed task stays locked to its worker
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 2.0,         # seconds before the 2nd attempt, doubled each time
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'TASK_QUEUE', {})}
+
+
+# ==============================
+# Declaring and enqueueing
+# ==============================
+registry = {}
+
+
+class Retry(Exception):
+    """Raised by a task to run it again after delay seconds without using up an attempt."""
+
+    def __init__(self, delay=0, reason=''):
+        self.delay = delay
+        super().__init__(reason or f'Retry in {delay}s')
+
+
+class TaskFunction:
+    def __init__(self, func, name, max_attempts=None, backoff=None):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<task {self.name}>'
+
+    def enqueue(self, *args, delay=0, **kwargs):
+        """
+        Queues a call with JSON-serialisable arguments. Runs in the caller's
+        transaction, if any. Returns the Task row.
+        """
+        return Task.objects.create(
+            name=self.name,
+            args=list(args),
+            kwargs=kwargs,
+            max_attempts=self.max_attempts or get_config()['MAX_ATTEMPTS'],
+            run_at=timezone.now() + timedelta(seconds=delay),
+        )
+
+
+def task(name=None, *, max_attempts=None, backoff=None):
+    """Registers a function as a task; the name defaults to '<module>.<function>'."""
+
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        if task_name in registry:
+            raise ValueError(f'Task {task_name} is already registered')
+        registry[task_name] = TaskFunction(func, task_name, max_attempts, backoff)
+        return registry[task_name]
+
+    return decorator
+
+
+# ==============================
+# Claiming
+# ==============================
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def due_condition(now):
+    return (
+        Q(status=TaskStatus.QUEUED, run_at__lte=now)
+        | Q(status=TaskStatus.RUNNING, locked_until__lte=now)
+    )
+
+
+def claim(worker_id, batch_size, lease):
+    """Locks up to batch_size due tasks to worker_id and returns them, oldest first."""
+    now = timezone.now()
+    with transaction.atomic():
+        due = Task.objects.filter(due_condition(now)).order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            # other workers skip these rows instead of waiting for them
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+        # the conditional UPDATE is the claim on databases without row locks
+        Task.objects.filter(due_condition(now), pk__in=ids).update(
+            status=TaskStatus.RUNNING,
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=lease),
+            attempts=F('attempts') + 1,
+            started_at=now,
+        )
+    return list(
+        Task.objects
+        .filter(pk__in=ids, status=TaskStatus.RUNNING, locked_by=worker_id, started_at=now)
+        .order_by('run_at', 'id')
+    )
+
+
+# ==============================
+# Running
+# ==============================
+def _settle(task_row, worker_id, **fields):
+    """Updates the task only while this worker still holds it."""
+    return Task.objects.filter(
+        pk=task_row.pk, status=TaskStatus.RUNNING, locked_by=worker_id
+    ).update(locked_until=None, **fields)
+
+
+def _log(task_row, status, wait_ms, run_ms, **extra):
+    logger.info(json.dumps({
+        'task': task_row.name,
+        'id': task_row.pk,
+        'status': status,
+        'attempt': task_row.attempts,
+        'wait_ms': wait_ms,
+        'run_ms': run_ms,
+        **extra,
+    }))
+
+
+def execute(task_row, worker_id):
+    """Runs one claimed task and records the outcome; returns the new status."""
+    config = get_config()
+    # from run_at to now, not to the claim: the batch may have waited for earlier tasks
+    wait_ms = round((timezone.now() - task_row.run_at).total_seconds() * 1000, 1)
+    func = registry.get(task_row.name)
+    if func is None:
+        _settle(task_row, worker_id, status=TaskStatus.FAILED, finished_at=timezone.now(),
+                last_error=f'Unknown task {task_row.name}')
+        _log(task_row, TaskStatus.FAILED, wait_ms, 0, error='unknown task')
+        return TaskStatus.FAILED
+    if task_row.attempts > task_row.max_attempts:
+        # its previous runs never finished (worker killed); don't start it again
+        _settle(task_row, worker_id, status=TaskStatus.FAILED, finished_at=timezone.now(),
+                last_error='Lease expired on the last attempt')
+        _log(task_row, TaskStatus.FAILED, wait_ms, 0, error='attempts exhausted')
+        return TaskStatus.FAILED
+
+    started = time.monotonic()
+    try:
+        func(*task_row.args, **task_row.kwargs)
+    except Retry as exc:
+        run_ms = round((time.monotonic() - started) * 1000, 1)
+        _settle(task_row, worker_id, status=TaskStatus.QUEUED, attempts=F('attempts') - 1,
+                run_at=timezone.now() + timedelta(seconds=exc.delay), last_error=str(exc)[:1000],
+                wait_ms=wait_ms, run_ms=run_ms)
+        _log(task_row, 'retry', wait_ms, run_ms, delay=exc.delay)
+        return TaskStatus.QUEUED
+    except Exception as exc:
+        run_ms = round((time.monotonic() - started) * 1000, 1)
+        error = traceback.format_exc()[-4000:]
+        if task_row.attempts >= task_row.max_attempts:
+            status = TaskStatus.FAILED
+            _settle(task_row, worker_id, status=status, finished_at=timezone.now(), last_error=error,
+                    wait_ms=wait_ms, run_ms=run_ms)
+            logger.error('Task %s #%s failed after %s attempts: %s',
+                         task_row.name, task_row.pk, task_row.attempts, exc)
+        else:
+            status = TaskStatus.QUEUED
+            backoff = func.backoff if func.backoff is not None else config['BACKOFF']
+            _settle(task_row, worker_id, status=status, last_error=error, wait_ms=wait_ms, run_ms=run_ms,
+                    run_at=timezone.now() + timedelta(seconds=backoff * 2 ** (task_row.attempts - 1)))
+        _log(task_row, status if status == TaskStatus.FAILED else 'error', wait_ms, run_ms, error=str(exc)[:200])
+        return status
+    run_ms = round((time.monotonic() - started) * 1000, 1)
+    _settle(task_row, worker_id, status=TaskStatus.DONE, finished_at=timezone.now(), last_error='',
+            wait_ms=wait_ms, run_ms=run_ms)
+    _log(task_row, TaskStatus.DONE, wait_ms, run_ms)
+    return TaskStatus.DONE
+
+
+def work(worker_id=None, *, batch_size=None, poll_interval=None, lease=None,
+         once=False, should_stop=lambda: False):
+    """
+    Worker loop: claims and runs tasks until should_stop() is true, or, with
+    once=True, until the queue has no due tasks. Returns the number of tasks run.
+    """
+    config = get_config()
+    worker_id = worker_id or worker_name()
+    batch_size = batch_size or config['BATCH_SIZE']
+    poll_interval = config['POLL_INTERVAL'] if poll_interval is None else poll_interval
+    lease = lease or config['LEASE']
+    done = 0
+    while not should_stop():
+        batch = claim(worker_id, batch_size, lease)
+        if not batch:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        for task_row in batch:
+            if should_stop():
+                # unstarted tasks go back to the queue instead of waiting for the lease
+                _settle(task_row, worker_id, status=TaskStatus.QUEUED, attempts=F('attempts') - 1)
+                continue
+            execute(task_row, worker_id)
+            done += 1
+    return done
+
+
+def run_pending(limit=None):
+    """Runs due tasks in the current process (tests, cron fallback); returns how many ran."""
+    worker_id = worker_name()
+    done = 0
+    while limit is None or done < limit:
+        batch = claim(worker_id, 1, get_config()['LEASE'])
+        if not batch:
+            break
+        execute(batch[0], worker_id)
+        done += 1
+    return done
+
+
+def purge(older_than, statuses=(TaskStatus.DONE, TaskStatus.FAILED), batch_size=1000):
+    """Deletes finished tasks older than older_than (a datetime); returns the number removed."""
+    removed = 0
+    while True:
+        ids = list(
+            Task.objects
+            .filter(status__in=statuses, finished_at__lt=older_than)
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return removed
+        removed += Task.objects.filter(pk__in=ids).delete()[0]
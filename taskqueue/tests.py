@@ -0,0 +1,115 @@
+import threading
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from .models import Task, TaskStatus
+from .queue import _settle, claim, execute, run_pending, task
+
+calls = []
+
+
+@task(name='taskqueue.tests.record')
+def record(value):
+    calls.append(value)
+
+
+@task(name='taskqueue.tests.fail', max_attempts=3, backoff=10)
+def fail():
+    raise RuntimeError('boom')
+
+
+class QueueTests(TestCase):
+    """Outbox enqueueing, leases and retries."""
+
+    def setUp(self):
+        calls.clear()
+
+    def make_due(self, *tasks):
+        Task.objects.filter(pk__in=[t.pk for t in tasks]).update(run_at=timezone.now() - timedelta(seconds=1))
+
+    def test_enqueue_follows_the_transaction(self):
+        try:
+            with transaction.atomic():
+                record.enqueue('lost')
+                raise RuntimeError('rollback')
+        except RuntimeError:
+            pass
+        with transaction.atomic():
+            record.enqueue('kept')
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, ['kept'])
+
+    def test_expired_lease_is_reclaimed(self):
+        row = record.enqueue('once')
+        self.assertEqual([t.pk for t in claim('first', 10, 60)], [row.pk])
+        # still leased to the first worker
+        self.assertEqual(claim('second', 10, 60), [])
+
+        # ... which died: the lease runs out
+        Task.objects.filter(pk=row.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = claim('second', 10, 60)
+        self.assertEqual([t.pk for t in reclaimed], [row.pk])
+        self.assertEqual(reclaimed[0].attempts, 2)
+
+        # a late result from the first worker no longer counts
+        self.assertEqual(_settle(row, 'first', status=TaskStatus.DONE), 0)
+        self.assertEqual(Task.objects.get(pk=row.pk).status, TaskStatus.RUNNING)
+
+        self.assertEqual(execute(reclaimed[0], 'second'), TaskStatus.DONE)
+        self.assertEqual(calls, ['once'])
+
+
+    def test_backoff_until_max_attempts(self):
+        row = fail.enqueue()
+        delays = []
+        for _ in range(2):
+            started = timezone.now()
+            self.assertEqual(run_pending(), 1)
+            row.refresh_from_db()
+            self.assertEqual(row.status, TaskStatus.QUEUED)
+            delays.append((row.run_at - started).total_seconds())
+            self.assertEqual(run_pending(), 0)  # not due yet
+            self.make_due(row)
+        self.assertAlmostEqual(delays[0], 10, delta=1)
+        self.assertAlmostEqual(delays[1], 20, delta=1)
+
+        self.assertEqual(run_pending(), 1)
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), (TaskStatus.FAILED, 3))
+        self.assertIn('boom', row.last_error)
+        self.assertIsNotNone(row.finished_at)
+
+
+class ConcurrentClaimTests(TransactionTestCase):
+    """Workers claiming at the same moment never take the same row."""
+
+    def test_no_row_is_claimed_twice(self):
+        for n in range(20):
+            record.enqueue(n)
+        workers = [f'worker-{n}' for n in range(4)]
+        barrier = threading.Barrier(len(workers))
+        claimed = {}
+
+        def take(worker_id):
+            try:
+                barrier.wait()
+                claimed[worker_id] = [t.pk for t in claim(worker_id, 10, 60)]
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=take, args=(worker_id,)) for worker_id in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        ids = [pk for batch in claimed.values() for pk in batch]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), 20)
+        for worker_id, batch in claimed.items():
+            self.assertEqual(
+                set(Task.objects.filter(locked_by=worker_id).values_list('pk', flat=True)), set(batch),
+            )